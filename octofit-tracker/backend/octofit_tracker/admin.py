@@ -1,9 +1,32 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from .admin_performance import PerformanceAdminMixin
 from .models import User, Team, Activity, Leaderboard, Workout
+from .search import KINDS, find, query_words
+from .sharding import is_sharded, locate_activity
+
+# Most matches the changelist search box is filtered to
+ADMIN_SEARCH_LIMIT = 1000
+
+
+class IndexedSearchMixin:
+    """
+    Answers the changelist search box from the search index instead of
+    ``icontains`` over ``search_fields``, which djongo runs as an
+    unanchored regex over the whole collection. Terms too short for the
+    index fall back to the default search.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        if not query_words(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        matches = find(search_term, kinds=[KINDS[self.model]], limit=ADMIN_SEARCH_LIMIT)
+        return queryset.filter(_id__in=[match['_id'] for match in matches]), False
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(PerformanceAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
     """Admin interface for User model"""
     list_display = ('_id', 'name', 'email', 'team_id', 'role')
     list_filter = ('role', 'team_id')
@@ -12,25 +35,62 @@ class UserAdmin(admin.ModelAdmin):
 
 
 @admin.register(Team)
-class TeamAdmin(admin.ModelAdmin):
+class TeamAdmin(PerformanceAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
     """Admin interface for Team model"""
     list_display = ('_id', 'name', 'description')
     search_fields = ('name', 'description')
     ordering = ('_id',)
 
 
+class ShardListFilter(admin.SimpleListFilter):
+    """Lists one activity shard at a time; the first by default"""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.ACTIVITY_SHARDS]
+
+    def queryset(self, request, queryset):
+        alias = self.value()
+        return queryset.using(alias if alias in settings.ACTIVITY_SHARDS else settings.ACTIVITY_SHARDS[0])
+
+
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(PerformanceAdminMixin, admin.ModelAdmin):
     """Admin interface for Activity model"""
     list_display = ('_id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date')
     list_filter = ('activity_type', 'date')
     search_fields = ('activity_type',)
-    ordering = ('-date', '_id')
+    # Matches activity_date_idx; a mixed-direction sort cannot use it
+    ordering = ('-date', '-_id')
     date_hierarchy = 'date'
 
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        return [ShardListFilter, *list_filter] if is_sharded() else list_filter
+
+    def get_object(self, request, object_id, from_field=None):
+        if not is_sharded():
+            return super().get_object(request, object_id, from_field)
+        try:
+            _id = Activity._meta.pk.to_python(object_id)
+        except ValidationError:
+            return None
+        alias = locate_activity(_id)
+        if alias is None:
+            return None
+        return self.get_queryset(request).using(alias).filter(_id=_id).first()
+
+    def save_model(self, request, obj, form, change):
+        previous = obj._state.db
+        super().save_model(request, obj, form, change)
+        if change and previous != obj._state.db:
+            # A new user_id saved the activity to another shard
+            Activity.objects.using(previous).filter(_id=obj._id).delete()
+
 
 @admin.register(Leaderboard)
-class LeaderboardAdmin(admin.ModelAdmin):
+class LeaderboardAdmin(PerformanceAdminMixin, admin.ModelAdmin):
     """Admin interface for Leaderboard model"""
     list_display = ('_id', 'user_id', 'team_id', 'total_points', 'rank')
     list_filter = ('team_id',)
@@ -39,7 +99,7 @@ class LeaderboardAdmin(admin.ModelAdmin):
 
 
 @admin.register(Workout)
-class WorkoutAdmin(admin.ModelAdmin):
+class WorkoutAdmin(PerformanceAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
     """Admin interface for Workout model"""
     list_display = ('_id', 'name', 'difficulty', 'duration', 'description')
     list_filter = ('difficulty',)
@@ -0,0 +1,169 @@
+"""
+Admin changelists that stay fast on very large collections.
+
+PerformanceAdminMixin replaces the three parts of a changelist load that
+otherwise scan a whole collection:
+
+- Counts. An unfiltered list is counted with ``estimated_document_count``,
+  which reads collection metadata. A filtered list is counted up to
+  ADMIN_EXACT_COUNT_LIMIT matches, and only that many can be paged
+  through. The "N total" link, a second full count, is hidden.
+- Filter choices. The values offered by a field's list filter come from
+  one ``distinct`` command, cached for ADMIN_CACHE_TIMEOUT seconds.
+- Date hierarchy. Each year, month or day link is found with one seek on
+  the date index instead of a distinct scan, and cached for the same time.
+
+Choices and links of the sharded activities cover every shard.
+
+Cached choices and links describe the whole collection and may lag writes
+by up to ADMIN_CACHE_TIMEOUT: a value can linger after its last row goes,
+or appear late.
+"""
+from datetime import date, datetime, time
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import models
+from django.utils.functional import cached_property
+from pymongo import DESCENDING
+
+from .cache import get_cache
+from .mongo import get_db
+from .sharding import collection_dbs
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never counts a whole collection"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            return get_db(queryset.db)[queryset.model._meta.db_table].estimated_document_count()
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        return len(queryset.values_list('pk', flat=True)[:limit])
+
+
+def cached_distinct(model, field):
+    """The distinct values of ``field`` on every shard, cached; None sorts last"""
+    key = f'admin:choices:{model._meta.db_table}:{field.column}'
+    values = get_cache().get(key)
+    if values is None:
+        stored = {}
+        for database in collection_dbs(model._meta.db_table):
+            stored.update(dict.fromkeys(database[model._meta.db_table].distinct(field.column)))
+        values = [value for value in stored if value is not None]
+        try:
+            # By value, as Django's list filter orders them
+            values.sort()
+        except TypeError:
+            # Mixed types do not compare with each other
+            values.sort(key=str)
+        if None in stored:
+            values.append(None)
+        get_cache().set(key, values, settings.ADMIN_CACHE_TIMEOUT)
+    return values
+
+
+class CachedAllValuesFieldListFilter(admin.AllValuesFieldListFilter):
+    """AllValuesFieldListFilter whose choices come from ``cached_distinct``"""
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        # Replaces the lazy distinct queryset before anything evaluates it
+        self.lookup_choices = cached_distinct(model, field)
+
+
+def _as_date(value):
+    # djongo stores dates as midnight datetimes; documents written before
+    # migrate_activity_dates may hold strings
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _truncate(value, kind):
+    if kind == 'year':
+        return date(value.year, 1, 1)
+    if kind == 'month':
+        return date(value.year, value.month, 1)
+    return value
+
+
+def _latest(collection, column, lower, upper):
+    """The latest stored date in [lower, upper), via the index on ``column``"""
+    latest = None
+    # Query each stored representation separately: MongoDB never compares
+    # strings with dates, and each query stays a bounded index seek
+    for convert in (lambda day: datetime.combine(day, time.min), date.isoformat):
+        document = collection.find_one(
+            {column: {'$gte': convert(lower), '$lt': convert(upper)}},
+            projection={'_id': 0, column: 1},
+            sort=[(column, DESCENDING)],
+        )
+        if document is not None:
+            value = _as_date(document[column])
+            latest = value if latest is None else max(latest, value)
+    return latest
+
+
+def date_buckets(model, field_name, kind, year=None, month=None):
+    """
+    The years, the months of ``year`` or the days of ``year``-``month``
+    that have rows, oldest first. One index seek per bucket, cached.
+    """
+    column = model._meta.get_field(field_name).column
+    key = f'admin:dates:{model._meta.db_table}:{column}:{kind}:{year}:{month}'
+    buckets = get_cache().get(key)
+    if buckets is not None:
+        return buckets
+
+    if kind == 'year':
+        lower, upper = date.min, date.max
+    elif kind == 'month':
+        lower, upper = date(year, 1, 1), date(year + 1, 1, 1)
+    else:
+        lower, upper = date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+
+    collections = [database[model._meta.db_table] for database in collection_dbs(model._meta.db_table)]
+    buckets = []
+    while True:
+        latest = max(
+            (value for value in (_latest(collection, column, lower, upper) for collection in collections)
+             if value is not None),
+            default=None,
+        )
+        if latest is None:
+            break
+        upper = _truncate(latest, kind)
+        buckets.append(upper)
+    buckets.reverse()
+    get_cache().set(key, buckets, settings.ADMIN_CACHE_TIMEOUT)
+    return buckets
+
+
+def _uses_all_values_filter(field):
+    return not (
+        field.is_relation or field.choices
+        or isinstance(field, (models.DateField, models.BooleanField))
+    )
+
+
+class PerformanceAdminMixin:
+    """Estimated counts, cached filter choices and an index-seek date hierarchy"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/octofit_tracker/performance_change_list.html'
+
+    def get_list_filter(self, request):
+        list_filter = []
+        for item in super().get_list_filter(request):
+            if isinstance(item, str) and '__' not in item:
+                field = self.model._meta.get_field(item)
+                if _uses_all_values_filter(field):
+                    item = (item, CachedAllValuesFieldListFilter)
+            list_filter.append(item)
+        return list_filter
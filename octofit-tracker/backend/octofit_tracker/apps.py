@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Connect the response cache invalidation, event and search index
+        # signal receivers
+        from . import cache, events, search  # noqa: F401
+        # The write-behind journal is started by the ASGI/WSGI entry points,
+        # not here: every management command runs ready() too
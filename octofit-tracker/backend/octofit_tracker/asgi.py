@@ -9,8 +9,19 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+# Django's handler, except streaming bodies are produced off the event loop
+from octofit_tracker.handlers import get_asgi_application  # noqa: E402
+
+django_application = get_asgi_application()
+
+from octofit_tracker.journal import start_journal  # noqa: E402
+
+# Replays journal segments left by a crashed process
+start_journal()
+
+# Imported once Django is set up; serves the Server-Sent Events streams
+from octofit_tracker.sse import route_streams  # noqa: E402
+
+application = route_streams(django_application)
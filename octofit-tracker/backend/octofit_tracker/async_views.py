@@ -0,0 +1,222 @@
+"""
+Async read paths for the list and lookup endpoints.
+
+Under ASGI (``asgi.py``) GET requests for the routes in ``ASYNC_READS`` are
+answered on the event loop with Motor, so a MongoDB round trip does not hold
+a worker thread. The response goes through the same viewset's content
+negotiation, pagination, exception handling, response cache and renderer,
+so it is identical to the synchronous route. Everything else -- writes,
+``?expand=``, the browsable API, format suffixes and all requests served
+over WSGI -- falls through to the synchronous viewset.
+
+Like a response cache hit, the async path does not run authentication or
+permission checks; the routes it serves are readable by everyone.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.urls import URLPattern
+from rest_framework.exceptions import NotAcceptable, NotFound
+from rest_framework.response import Response
+
+from .cache import CachedResponseMixin, cache_entry, cache_timeout, cached_response, get_cache
+from .models import Team
+from .mongo import get_async_db
+from .routers import ReadPreferenceMixin, read_alias, reading_from
+from .sharding import is_sharded
+from .profiling import phase
+from .renderers import ORJSONRenderer
+from .repositories import (
+    ActivityRepository,
+    LeaderboardRepository,
+    TeamRepository,
+    UserRepository,
+    WorkoutRepository
+)
+from .views import around_params, around_response
+
+
+async def paginate(view, query):
+    """Async counterpart of ``DirectReadMixin.direct_response``"""
+    query = view.sparse_query(query)
+    paginator = view.paginator
+    page = None
+    if paginator is not None:
+        page = await paginator.apaginate_queryset(query, view.request, view=view)
+    if page is None:
+        return Response(view.sparse_rows(await query.alist()))
+    return paginator.get_paginated_response(view.sparse_rows(page))
+
+
+async def user_list(view, db):
+    return await paginate(view, UserRepository(db).all())
+
+
+async def team_list(view, db):
+    return await paginate(view, TeamRepository(db).all())
+
+
+async def team_members(view, db, pk):
+    """Get all members of a team"""
+    try:
+        team_id = Team._meta.pk.to_python(pk)
+    except ValidationError:
+        raise NotFound()
+    if await db[Team._meta.db_table].find_one({'_id': team_id}, {'_id': 1}) is None:
+        raise NotFound()
+    return await paginate(view, UserRepository(db).by_team(team_id))
+
+
+async def activity_list(view, db):
+    return await paginate(view, ActivityRepository(db).all())
+
+
+async def activity_by_user(view, db):
+    """Get activities by user_id"""
+    user_id = view.request.query_params.get('user_id')
+    if user_id:
+        return await paginate(view, ActivityRepository(db).by_user(int(user_id)))
+    return Response({"error": "user_id parameter is required"}, status=400)
+
+
+async def leaderboard_list(view, db):
+    return await paginate(view, LeaderboardRepository(db).all())
+
+
+async def leaderboard_by_team(view, db):
+    """Get leaderboard by team_id"""
+    team_id = view.request.query_params.get('team_id')
+    if team_id:
+        return await paginate(view, LeaderboardRepository(db).by_team(int(team_id)))
+    return Response({"error": "team_id parameter is required"}, status=400)
+
+
+async def workout_list(view, db):
+    return await paginate(view, WorkoutRepository(db).all())
+
+
+async def workout_by_difficulty(view, db):
+    """Get workouts by difficulty level"""
+    difficulty = view.request.query_params.get('difficulty')
+    if difficulty:
+        return await paginate(view, WorkoutRepository(db).by_difficulty(difficulty))
+    return Response({"error": "difficulty parameter is required"}, status=400)
+
+
+async def leaderboard_around(view, db):
+    """Get a user's rank with the k entries above and below it"""
+    params, error = around_params(view.request)
+    if error:
+        return Response({"error": error}, status=400)
+    repository = LeaderboardRepository(db)
+    entries = await repository.by_user(params['user_id']).alist(1)
+    if not entries:
+        return around_response(params['user_id'], None, [], [])
+    entry, k = entries[0], params['k']
+    above = await repository.above(entry).alist(k) if k else []
+    below = await repository.below(entry).alist(k) if k else []
+    return around_response(params['user_id'], entry, above, below)
+
+
+# Router URL name -> async handler
+ASYNC_READS = {
+    'user-list': user_list,
+    'team-list': team_list,
+    'team-members': team_members,
+    'activity-list': activity_list,
+    'activity-by-user': activity_by_user,
+    'leaderboard-list': leaderboard_list,
+    'leaderboard-by-team': leaderboard_by_team,
+    'leaderboard-around': leaderboard_around,
+    'workout-list': workout_list,
+    'workout-by-difficulty': workout_by_difficulty,
+}
+# Motor reads one database; sharded activities are read by the sync viewset
+SHARDED_READS = {'activity-list', 'activity-by-user'}
+
+
+def setup_view(sync_view, request, args, kwargs):
+    """Instantiate the viewset the way ``ViewSetMixin.as_view`` and ``APIView.dispatch`` do"""
+    view = sync_view.cls(**sync_view.initkwargs)
+    actions = dict(sync_view.actions)
+    if 'get' in actions and 'head' not in actions:
+        actions['head'] = actions['get']
+    view.action_map = actions
+    for method, action in actions.items():
+        setattr(view, method, getattr(view, action))
+    view.args, view.kwargs = args, kwargs
+    view.request = view.initialize_request(request, *args, **kwargs)
+    view.format_kwarg = view.get_format_suffix(**kwargs)
+    view.headers = view.default_response_headers
+    return view
+
+
+def async_read_view(sync_view, handler):
+    """Wrap a router view so GET requests under ASGI are served by ``handler``"""
+    fallback = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method != 'GET' or 'format' in kwargs or not isinstance(request, ASGIRequest):
+            return await fallback(request, *args, **kwargs)
+
+        viewset = setup_view(sync_view, request, args, kwargs)
+        drf_request = viewset.request
+        if 'expand' in drf_request.query_params:
+            return await fallback(request, *args, **kwargs)
+        try:
+            negotiated = viewset.perform_content_negotiation(drf_request)
+        except NotAcceptable:
+            return await fallback(request, *args, **kwargs)
+        if not isinstance(negotiated[0], ORJSONRenderer):
+            return await fallback(request, *args, **kwargs)
+        drf_request.accepted_renderer, drf_request.accepted_media_type = negotiated
+
+        # The default locmem cache answers in-process, so it is used inline
+        key = None
+        if isinstance(viewset, CachedResponseMixin):
+            key = viewset.get_cache_key(request, viewset.action, kwargs)
+            entry = get_cache().get(key)
+            if entry is not None:
+                return cached_response(request, entry)
+
+        alias = None
+        if isinstance(viewset, ReadPreferenceMixin) and settings.DATABASE_READ_REPLICAS:
+            # A due replica lag check is a blocking pymongo command
+            alias = await sync_to_async(viewset.get_read_alias, thread_sensitive=False)(request)
+        with reading_from(alias):
+            try:
+                response = await handler(viewset, get_async_db(read_alias()), **kwargs)
+            except Exception as exc:
+                response = viewset.handle_exception(exc)
+            response = viewset.finalize_response(drf_request, response, *args, **kwargs)
+            with phase('render'):
+                response.render()
+
+            if key is None or response.status_code != 200:
+                return response
+            entry = cache_entry(response)
+            get_cache().set(key, entry, cache_timeout())
+        return cached_response(request, entry, response)
+
+    functools.update_wrapper(view, sync_view)
+    return view
+
+
+def async_read_urls(urls):
+    """Swap the router's views for ``ASYNC_READS`` routes with async wrappers"""
+    patterns = []
+    for pattern in urls:
+        name = getattr(pattern, 'name', None)
+        handler = ASYNC_READS.get(name)
+        if handler is not None and not (name in SHARDED_READS and is_sharded()):
+            pattern = URLPattern(
+                pattern.pattern,
+                async_read_view(pattern.callback, handler),
+                pattern.default_args,
+                pattern.name,
+            )
+        patterns.append(pattern)
+    return patterns
@@ -0,0 +1,146 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+from .models import User, Team, Activity, Leaderboard, Workout
+from .profiling import phase
+from .routers import read_alias
+
+CACHED_MODELS = (User, Team, Activity, Leaderboard, Workout)
+
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def cache_timeout():
+    """
+    Seconds to cache a response. One read from a replica may predate a
+    write the generation tokens already count, so it expires within the
+    staleness bound instead.
+    """
+    if read_alias() == 'default':
+        return settings.API_CACHE_TIMEOUT
+    return min(settings.API_CACHE_TIMEOUT, settings.DATABASE_MAX_REPLICA_LAG_SECONDS)
+
+
+def _generation_key(model, pk=None):
+    key = f'api:gen:{model._meta.db_table}'
+    return key if pk is None else f'{key}:{pk}'
+
+
+def _generations(keys):
+    """
+    Return the current token for each generation key. Tokens are random so
+    an evicted generation can never bring back an older cached response.
+    """
+    cache = get_cache()
+    tokens = cache.get_many(keys)
+    missing = [key for key in keys if key not in tokens]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        tokens.update(cache.get_many(missing))
+    return [tokens.get(key, '') for key in keys]
+
+
+def invalidate(model, pk=None):
+    """Expire cached responses that depend on ``model`` (and on object ``pk``)"""
+    cache = get_cache()
+    keys = [_generation_key(model)]
+    if pk is not None:
+        keys.append(_generation_key(model, pk))
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_on_write(sender, instance, **kwargs):
+    if sender in CACHED_MODELS:
+        invalidate(sender, instance.pk)
+
+
+class CachedResponseMixin:
+    """
+    Read-through cache for GET responses rendered as JSON.
+
+    Entries are keyed on the request URL and the generation tokens of the
+    models the response reads: ``cache_models`` by default, or
+    ``cache_action_models[action]``. ``retrieve`` depends on the object's
+    own token instead of the model-wide one, so writing one row does not
+    expire every detail response. Responses carry a strong ETag and a
+    matching ``If-None-Match`` is answered with 304 from the cache alone.
+    Cache hits skip authentication and permission checks, so only mix this
+    into viewsets whose responses are the same for every client.
+    """
+    cache_models = ()
+    cache_action_models = {}
+
+    def get_cache_dependencies(self, action, kwargs):
+        models = self.cache_action_models.get(action, self.cache_models)
+        if action == 'retrieve':
+            pk = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+            return [_generation_key(models[0], pk)] + [_generation_key(model) for model in models[1:]]
+        return [_generation_key(model) for model in models]
+
+    def get_cache_key(self, request, action, kwargs):
+        parts = [
+            request.build_absolute_uri(),
+            request.META.get('HTTP_ACCEPT', ''),
+        ]
+        parts += _generations(self.get_cache_dependencies(action, kwargs))
+        digest = hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+        return f'api:response:{digest}'
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower()) if request.method in ('GET', 'HEAD') else None
+        if action is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = self.get_cache_key(request, action, kwargs)
+        entry = cache.get(key)
+        if entry is not None:
+            return cached_response(request, entry)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if not (isinstance(response, Response) and response.status_code == 200
+                and response.accepted_renderer.format == 'json'):
+            return response
+        with phase('render'):
+            response.render()
+        entry = cache_entry(response)
+        cache.set(key, entry, cache_timeout())
+        return cached_response(request, entry, response)
+
+
+def cache_entry(response):
+    """The cached form of a rendered 200 JSON response"""
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'etag': '"%s"' % hashlib.sha1(response.content).hexdigest(),
+        'headers': {name: response[name] for name in ('Vary', 'Allow') if response.has_header(name)},
+    }
+
+
+def cached_response(request, entry, response=None):
+    """
+    Answer from a cache entry, or decorate the ``response`` it was just built
+    from, adding the ETag and replying 304 to a matching ``If-None-Match``.
+    """
+    if response is None:
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    if entry['etag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    response['ETag'] = entry['etag']
+    for name, value in entry['headers'].items():
+        response[name] = value
+    return response
@@ -0,0 +1,182 @@
+"""
+In-process publish/subscribe for the Server-Sent Events streams.
+
+Writers in any thread call ``publish``; subscribers are SSE connections
+waiting on the ASGI event loop. Each message is encoded to an SSE frame
+once and handed to every event loop with a single ``call_soon_threadsafe``,
+which then fans it out to that loop's subscriptions. An idle subscription
+is a small bounded deque and a future, so one process can hold many
+thousands of open streams.
+
+A subscriber that falls more than ``QUEUE_SIZE`` frames behind has its
+backlog replaced by a ``reset`` event, telling the client to refetch.
+
+Only writes made in this process are published. Changes made by other
+workers or by management commands such as rebuild_leaderboard reach
+clients on their next full fetch.
+"""
+import asyncio
+import itertools
+import json
+import threading
+from collections import deque
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Leaderboard
+
+QUEUE_SIZE = 256
+
+LEADERBOARD = 'leaderboard'
+ACTIVITIES = 'activities'
+
+# Publish key for messages every subscriber receives, whatever it follows
+EVERYONE = object()
+
+
+def encode(event, data, event_id=None):
+    """Format one Server-Sent Events frame"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append('data: ' + json.dumps(data, separators=(',', ':'), default=str))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Subscription:
+    """One SSE connection's view of a topic, read with ``await get()``"""
+
+    def __init__(self, broker, loop, topic, key=None):
+        self.broker = broker
+        self.loop = loop
+        self.topic = topic
+        self.key = key
+        self._frames = deque()
+        self._waiter = None
+
+    def offer(self, frame):
+        """Queue a frame; runs on the subscription's event loop"""
+        if len(self._frames) >= QUEUE_SIZE:
+            self._frames.clear()
+            frame = encode('reset', {'reason': 'lagging'})
+        self._frames.append(frame)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self):
+        """Wait for the next frame"""
+        while not self._frames:
+            self._waiter = self.loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._frames.popleft()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Fans published frames out to the subscriptions of every event loop"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # loop -> topic -> set of subscriptions
+        self._loops = {}
+        self._ids = itertools.count(1)
+
+    def subscribe(self, topic, key=None):
+        """Subscribe the running event loop to ``topic``, optionally only for ``key``"""
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(self, loop, topic, key)
+        with self._lock:
+            self._loops.setdefault(loop, {}).setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            topics = self._loops.get(subscription.loop, {})
+            subscribers = topics.get(subscription.topic, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                topics.pop(subscription.topic, None)
+            if not topics:
+                self._loops.pop(subscription.loop, None)
+
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            return sum(
+                len(subscribers)
+                for topics in self._loops.values()
+                for name, subscribers in topics.items()
+                if topic is None or name == topic
+            )
+
+    def publish(self, topic, event, data, key=EVERYONE, others=None):
+        """
+        Send ``data`` to subscribers of ``topic`` that follow ``key`` or
+        no key at all. Subscribers following a different key receive
+        ``others`` instead, or nothing when it is None. Safe to call from
+        any thread.
+        """
+        with self._lock:
+            loops = [loop for loop, topics in self._loops.items() if topic in topics]
+        if not loops:
+            return
+        event_id = next(self._ids)
+        frame = encode(event, data, event_id)
+        other_frame = encode(event, others, event_id) if others is not None else None
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._deliver, loop, topic, key, frame, other_frame)
+            except RuntimeError:
+                # The loop was closed without its subscriptions being closed
+                with self._lock:
+                    self._loops.pop(loop, None)
+
+    def _deliver(self, loop, topic, key, frame, other_frame):
+        with self._lock:
+            subscribers = list(self._loops.get(loop, {}).get(topic, ()))
+        for subscription in subscribers:
+            if key is EVERYONE or subscription.key is None or subscription.key == key:
+                subscription.offer(frame)
+            elif other_frame is not None:
+                subscription.offer(other_frame)
+
+
+broker = Broker()
+
+
+def publish_points(entry, shift):
+    """
+    Publish a leaderboard row's new points and rank.
+
+    ``shift`` describes the other rows whose rank moved:
+    ``{'gte': low, 'lt': high, 'by': n}`` means every other row with
+    ``low <= total_points < high`` (``gte`` None for no lower bound) had
+    ``n`` added to its rank. Streams for other teams receive just the
+    shift, since it can move their members too.
+    """
+    broker.publish(
+        LEADERBOARD, 'points', dict(entry, shift=shift),
+        key=entry['team_id'], others={'shift': shift},
+    )
+
+
+def publish_activity(action, activity):
+    """Publish an activity that was created, updated or deleted, keyed on its user"""
+    broker.publish(ACTIVITIES, action, activity, key=activity['user_id'])
+
+
+def publish_reset(topic, reason):
+    """Tell every subscriber of ``topic`` to refetch"""
+    broker.publish(topic, 'reset', {'reason': reason})
+
+
+@receiver(post_save, sender=Leaderboard)
+@receiver(post_delete, sender=Leaderboard)
+def reset_on_leaderboard_write(sender, instance, **kwargs):
+    # Direct edits can move any number of ranks
+    publish_reset(LEADERBOARD, 'edited')
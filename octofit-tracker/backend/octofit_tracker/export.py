@@ -0,0 +1,81 @@
+"""
+Streaming activity export.
+
+Activities are read with a batched pymongo cursor and encoded one cursor
+batch at a time, so an export holds a single batch in memory however many
+rows match, and the first bytes go out as soon as the first batch is read.
+The CSV columns match what ``ActivityViewSet.bulk`` ingests.
+"""
+import csv
+import io
+import json
+
+from .repositories import ActivityRepository
+from .serializers import ActivitySerializer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+BATCH_SIZE = 2000
+
+EXPORT_FIELDS = tuple(ActivitySerializer.Meta.fields)
+
+
+def export_query(user_id=None, start=None, end=None):
+    """The activities to export, newest first, on the same indexes as the list endpoints"""
+    repository = ActivityRepository()
+    query = repository.by_user(user_id) if user_id is not None else repository.all()
+    if start is not None:
+        query = query.filter(date__gte=start)
+    if end is not None:
+        query = query.filter(date__lte=end)
+    return query
+
+
+def _dumps(row):
+    if orjson is not None:
+        return orjson.dumps(row)
+    return json.dumps(row, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def ndjson_chunks(rows, batch_size=BATCH_SIZE):
+    """Yield one NDJSON chunk per ``batch_size`` rows"""
+    batch = []
+    for row in rows:
+        batch.append(_dumps(row))
+        if len(batch) >= batch_size:
+            yield b'\n'.join(batch) + b'\n'
+            batch = []
+    if batch:
+        yield b'\n'.join(batch) + b'\n'
+
+
+def csv_chunks(rows, batch_size=BATCH_SIZE):
+    """Yield the CSV header, then one chunk per ``batch_size`` rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    pending = 0
+    for row in rows:
+        writer.writerow([row[field] for field in EXPORT_FIELDS])
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+EXPORT_ENCODERS = {
+    'ndjson': ndjson_chunks,
+    'csv': csv_chunks,
+}
+
+
+def export_chunks(query, export_format, batch_size=BATCH_SIZE):
+    """Stream ``query`` as encoded chunks in ``export_format`` (ndjson or csv)"""
+    rows = query.iterator(batch_size=batch_size)
+    return EXPORT_ENCODERS[export_format](rows, batch_size)
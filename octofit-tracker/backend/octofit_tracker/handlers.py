@@ -0,0 +1,50 @@
+"""
+ASGI handler for the project.
+
+Django 4.1 iterates streaming response bodies on the event loop, so a body
+that blocks on I/O between chunks -- such as the activity export reading
+MongoDB batches -- would stall every other connection in the worker,
+including the Server-Sent Events streams. This handler pulls each part on
+a worker thread instead. Django 4.2 does the same for sync iterators.
+"""
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+
+_DONE = object()
+
+
+def _next_part(parts):
+    return next(parts, _DONE)
+
+
+class ASGIHandler(asgi.ASGIHandler):
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        parts = iter(response)
+        next_part = sync_to_async(_next_part, thread_sensitive=False)
+        while (part := await next_part(parts)) is not _DONE:
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    """Like ``django.core.asgi.get_asgi_application``, with the handler above"""
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -0,0 +1,91 @@
+from collections import namedtuple
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+from .models import User, Team, Activity, UserDailyRollup, TeamDailyRollup, Leaderboard, Workout, SearchEntry
+
+# Indexes that back the primary key and must never be dropped
+PROTECTED_INDEXES = ('_id_', '__primary_key__')
+
+IndexSpec = namedtuple('IndexSpec', ['name', 'keys', 'unique'])
+
+# The queries the viewsets run on every request. Each one mirrors an ORM
+# query in views.py and must be served by an index.
+HotQuery = namedtuple('HotQuery', ['name', 'model', 'filter', 'sort'])
+
+SAMPLE_DATE = datetime(2026, 2, 16)
+
+HOT_QUERIES = [
+    HotQuery('UserViewSet.list', User, {}, [('_id', ASCENDING)]),
+    HotQuery('TeamViewSet.list', Team, {}, [('_id', ASCENDING)]),
+    HotQuery('TeamViewSet.members', User, {'team_id': 1}, [('_id', ASCENDING)]),
+    HotQuery('ActivityViewSet.list', Activity, {}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    HotQuery(
+        'ActivityViewSet.list (next page)',
+        Activity,
+        {'$or': [{'date': {'$lt': SAMPLE_DATE}}, {'date': SAMPLE_DATE, '_id': {'$lt': 5}}]},
+        [('date', DESCENDING), ('_id', DESCENDING)],
+    ),
+    HotQuery('ActivityViewSet.by_user', Activity, {'user_id': 1}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    HotQuery('LeaderboardViewSet.list', Leaderboard, {}, [('rank', ASCENDING), ('_id', ASCENDING)]),
+    HotQuery('LeaderboardViewSet.by_team', Leaderboard, {'team_id': 1}, [('rank', ASCENDING), ('_id', ASCENDING)]),
+    HotQuery(
+        'LeaderboardViewSet.around (above)',
+        Leaderboard,
+        {'$or': [{'rank': {'$lt': 5}}, {'rank': 5, '_id': {'$lt': 5}}]},
+        [('rank', DESCENDING), ('_id', DESCENDING)],
+    ),
+    HotQuery(
+        'LeaderboardViewSet.around (below)',
+        Leaderboard,
+        {'$or': [{'rank': {'$gt': 5}}, {'rank': 5, '_id': {'$gt': 5}}]},
+        [('rank', ASCENDING), ('_id', ASCENDING)],
+    ),
+    HotQuery('scoring.apply_points (row)', Leaderboard, {'user_id': 1}, None),
+    HotQuery('scoring.apply_points (ranks)', Leaderboard, {'total_points': {'$gte': 500, '$lt': 700}}, None),
+    HotQuery('rebuild_leaderboard', Leaderboard, {}, [('total_points', DESCENDING), ('_id', ASCENDING)]),
+    HotQuery('stats.user_stats', UserDailyRollup, {'user_id': 1, 'date': {'$gte': SAMPLE_DATE}}, None),
+    HotQuery('stats.team_stats', TeamDailyRollup, {'team_id': 1, 'date': {'$gte': SAMPLE_DATE}}, None),
+    HotQuery('WorkoutViewSet.list', Workout, {}, [('_id', ASCENDING)]),
+    HotQuery('WorkoutViewSet.by_difficulty', Workout, {'difficulty': 'Hard'}, [('_id', ASCENDING)]),
+    HotQuery('search.find', SearchEntry, {'terms': {'$all': ['stark', 'to']}}, None),
+]
+
+
+def index_specs(model):
+    """Return the MongoDB index specs declared on a model"""
+    specs = []
+    for field in model._meta.fields:
+        if field.unique and not field.primary_key:
+            specs.append(IndexSpec(f'{field.column}_1', [(field.column, ASCENDING)], True))
+    for names in model._meta.unique_together:
+        keys = [(model._meta.get_field(name).column, ASCENDING) for name in names]
+        specs.append(IndexSpec('_'.join(f'{column}_1' for column, _ in keys), keys, True))
+    for index in model._meta.indexes:
+        keys = [
+            (model._meta.get_field(name.lstrip('-')).column, DESCENDING if name.startswith('-') else ASCENDING)
+            for name in index.fields
+        ]
+        specs.append(IndexSpec(index.name, keys, False))
+    return specs
+
+
+def plan_stages(plan):
+    """Flatten an explain plan into a list of ``(stage, index name)`` pairs"""
+    stages = [(plan.get('stage'), plan.get('indexName'))]
+    children = list(plan.get('inputStages', []))
+    if 'inputStage' in plan:
+        children.append(plan['inputStage'])
+    for child in children:
+        stages.extend(plan_stages(child))
+    return stages
+
+
+def explain_query(db, query, limit=101):
+    """Return the winning plan stages MongoDB picks for a hot query"""
+    cursor = db[query.model._meta.db_table].find(query.filter)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    winning_plan = cursor.limit(limit).explain()['queryPlanner']['winningPlan']
+    return plan_stages(winning_plan.get('queryPlan', winning_plan))
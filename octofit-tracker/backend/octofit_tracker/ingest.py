@@ -0,0 +1,203 @@
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime, time
+
+from pymongo.errors import BulkWriteError
+
+from .cache import invalidate
+from .events import ACTIVITIES, publish_reset
+from .models import Activity
+from .mongo import get_db
+from .rollups import apply_rollups
+from .scoring import activity_points, apply_points
+from .sequences import get_sequence, reserve_ids
+from .sharding import group_by_shard, scatter, shard_db
+from .serializers import ActivitySerializer
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl')
+CSV_CONTENT_TYPES = ('text/csv',)
+
+
+class ActivityIngestSerializer(ActivitySerializer):
+    """
+    ActivitySerializer without the per-row ``_id`` uniqueness query;
+    duplicate ids are reported from the bulk insert instead.
+    """
+
+    def validate__id(self, value):
+        return value
+
+
+def read_records(stream, content_type):
+    """
+    Yield ``(line, record, error)`` for each record in an NDJSON or CSV
+    stream, reading one line at a time.
+    """
+    if content_type in CSV_CONTENT_TYPES:
+        yield from _read_csv(stream)
+    elif content_type in NDJSON_CONTENT_TYPES:
+        yield from _read_ndjson(stream)
+    else:
+        raise ValueError(f'Unsupported content type: {content_type}')
+
+
+def _read_ndjson(stream):
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except (ValueError, UnicodeDecodeError) as exc:
+            yield line_number, None, {'non_field_errors': [f'Invalid JSON: {exc}']}
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, {'non_field_errors': ['Expected a JSON object']}
+            continue
+        yield line_number, record, None
+
+
+def _read_csv(stream):
+    reader = csv.DictReader(line.decode('utf-8', errors='replace') for line in stream)
+    for record in reader:
+        if None in record:
+            yield reader.line_num, None, {'non_field_errors': ['Too many columns']}
+            continue
+        if not record.get('_id'):
+            # A blank _id cell asks for a server-assigned id
+            record.pop('_id', None)
+        yield reader.line_num, record, None
+
+
+def to_document(validated_data):
+    """Convert validated activity data to the document layout djongo writes"""
+    document = dict(validated_data)
+    document['date'] = datetime.combine(document['date'], time.min)
+    return document
+
+
+class IngestReport:
+    """Running totals for a bulk ingest; keeps at most MAX_REPORTED_ERRORS errors"""
+
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'received': self.received,
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def ingest_activities(records, db=None, chunk_size=CHUNK_SIZE):
+    """
+    Validate and insert activities from ``read_records`` in unordered
+    ``insert_many`` batches, holding one chunk in memory at a time.
+    """
+    db = db if db is not None else get_db()
+    report = IngestReport()
+    chunk = []
+    for line, record, error in records:
+        report.received += 1
+        if error is not None:
+            report.add_error(line, error)
+            continue
+        chunk.append((line, record))
+        if len(chunk) >= chunk_size:
+            _write_chunk(db, chunk, report)
+            chunk = []
+    if chunk:
+        _write_chunk(db, chunk, report)
+    if report.inserted:
+        # Too many to stream one by one; leaderboard deltas are still sent
+        publish_reset(ACTIVITIES, 'bulk')
+    return report
+
+
+def _write_chunk(db, chunk, report):
+    lines, documents = [], []
+    for line, record in chunk:
+        serializer = ActivityIngestSerializer(data=record)
+        if serializer.is_valid():
+            lines.append(line)
+            documents.append(to_document(serializer.validated_data))
+        else:
+            report.add_error(line, serializer.errors)
+    if not documents:
+        return
+
+    # Records without an _id get one from a single block reservation
+    explicit = [document['_id'] for document in documents if document.get('_id') is not None]
+    missing = [document for document in documents if document.get('_id') is None]
+    for document, _id in zip(missing, reserve_ids(Activity, len(missing), db=db)):
+        document['_id'] = _id
+
+    failed = write_activities(documents, db=db)
+    for index, write_error in failed.items():
+        report.add_error(lines[index], {'non_field_errors': [write_error['errmsg']]})
+    report.inserted += len(documents) - len(failed)
+    if explicit:
+        get_sequence(Activity).observe(max(explicit), db=db)
+
+
+def write_activities(documents, db=None):
+    """
+    Insert activity documents, then apply the leaderboard points and daily
+    rollups of the ones written. Returns ``{index: write error}`` for the
+    documents that were not.
+    """
+    failed = insert_activities(documents, db=db)
+    apply_activities([document for index, document in enumerate(documents) if index not in failed], db=db)
+    return failed
+
+
+def insert_activities(documents, db=None):
+    """
+    Insert activity documents with one unordered ``insert_many`` per shard,
+    in parallel. Returns ``{index: write error}`` for the documents that
+    were not inserted.
+    """
+    db = db if db is not None else get_db()
+
+    def insert(shard):
+        alias, indexes = shard
+        try:
+            shard_db(alias, db)[Activity._meta.db_table].insert_many([documents[index] for index in indexes], ordered=False)
+        except BulkWriteError as exc:
+            # Map positions in this shard's part back to ``documents``
+            return {
+                indexes[error['index']]: dict(error, index=indexes[error['index']])
+                for error in exc.details['writeErrors']
+            }
+        return {}
+
+    failed = {}
+    for shard_failed in scatter(insert, group_by_shard(documents).items()):
+        failed.update(shard_failed)
+    return failed
+
+
+def apply_activities(documents, db=None):
+    """Apply the leaderboard points and daily rollups of inserted activity documents"""
+    db = db if db is not None else get_db()
+    invalidate(Activity)
+    deltas = defaultdict(int)
+    for document in documents:
+        deltas[document['user_id']] += activity_points(Activity(**document))
+    for user_id, delta in deltas.items():
+        apply_points(user_id, delta, db=db)
+    apply_rollups([(document, 1) for document in documents], db=db)
@@ -0,0 +1,379 @@
+"""
+Write-behind buffer for high-rate activity logging.
+
+With ACTIVITY_WRITE_BEHIND enabled, an activity create sent with
+``Prefer: respond-async`` is validated, appended to a local journal file
+and fsynced, then answered 202 Accepted without waiting for MongoDB. A
+flusher thread writes the journal to MongoDB with one ``insert_many`` per
+ACTIVITY_JOURNAL_FLUSH_RECORDS records, at least every
+ACTIVITY_JOURNAL_FLUSH_MS milliseconds, and applies the leaderboard points
+and rollups as the bulk ingest does.
+
+Concurrent appends share fsyncs (group commit): a writer whose record was
+covered by another writer's fsync returns without its own.
+
+The journal is a series of NDJSON segment files, one per flush, in
+ACTIVITY_JOURNAL_DIR. Each process holds an exclusive flock on the
+segments it owns and deletes a segment once it is in MongoDB. Segments
+left unlocked -- by a process that crashed or was killed -- are replayed
+by the next journal to start. Records already inserted before the crash
+count as applied when the duplicate key they hit is the same document, so
+a replay never counts points twice; a crash between an insert and its
+points update is repaired by rebuild_leaderboard and rebuild_rollups.
+
+A flush that fails partway, say on a dropped connection, leaves its
+segment queued and retries it. Records the failed attempt inserted hit
+duplicate keys on the retry; they count as applied too, and since the
+failed insert never got to them, the retry applies their points and
+rollups and publishes them.
+
+Write status is tracked per process: ``status()`` is authoritative for
+writes this process accepted, and otherwise falls back to checking whether
+the activity exists.
+
+Only serving processes run a journal: asgi.py and wsgi.py call
+``start_journal()``, so management commands and the runserver autoreloader
+never take segment locks or replay segments. Otherwise it starts on first
+use.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from pathlib import Path
+
+from django.conf import settings
+
+from .events import publish_activity
+from .ingest import ActivityIngestSerializer, apply_activities, insert_activities, to_document
+from .models import Activity
+from .sequences import DUPLICATE_KEY, get_sequence
+from .serializers import ActivitySerializer
+from .sharding import ACTIVITIES, group_by_shard, locate_activity, shard_db
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no flock on Windows; run one process there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+APPLIED = 'applied'
+FAILED = 'failed'
+
+# Outcomes of finished writes remembered for status()
+STATUS_HISTORY = 10000
+# Seconds between attempts while MongoDB is unreachable
+RETRY_SECONDS = 1.0
+
+
+def _lock(handle):
+    """Take the segment's flock without blocking; False if another process holds it"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+class Segment:
+    """One journal file and the records appended to it"""
+
+    def __init__(self, path, handle, records=None):
+        self.path = path
+        self.handle = handle
+        self.records = records if records is not None else []
+        # Whether a flush of this segment has been attempted
+        self.attempted = False
+
+    def discard(self):
+        self.path.unlink(missing_ok=True)
+        self.handle.close()
+
+
+class ActivityJournal:
+    """An append-only journal of accepted activity creates and its flusher thread"""
+
+    def __init__(self, directory, flush_ms=50, flush_records=500):
+        self.directory = Path(directory)
+        self.flush_seconds = flush_ms / 1000
+        self.flush_records = flush_records
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._segment_ids = count()
+        # Appends and fsyncs so far, for group commit
+        self._appended = self._synced = 0
+        self._statuses = OrderedDict()
+        # Sealed segments whose flush failed, retried before newer ones
+        self._unflushed = []
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segment = self._open_segment()
+
+    def _open_segment(self):
+        path = self.directory / f'activities-{os.getpid()}-{time.time_ns()}-{next(self._segment_ids)}.ndjson'
+        handle = open(path, 'ab')
+        _lock(handle)
+        # Make the new file's directory entry durable too
+        if hasattr(os, 'O_DIRECTORY'):
+            directory = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        return Segment(path, handle)
+
+    # Accepting writes
+
+    def append(self, validated_data):
+        """
+        Journal a validated activity and return its representation once
+        the record is durable. Assigns the _id if the client left it out.
+        """
+        data = dict(validated_data)
+        sequence = get_sequence(Activity)
+        if data.get('_id') is None:
+            data['_id'] = sequence.next()
+        else:
+            sequence.observe(data['_id'])
+        record = dict(ActivitySerializer(Activity(**data)).data)
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._lock:
+            self._segment.handle.write(line)
+            self._segment.handle.flush()
+            self._segment.records.append(record)
+            self._set_status(record['_id'], PENDING)
+            self._appended += 1
+            position = self._appended
+            full = len(self._segment.records) >= self.flush_records
+        self._sync(position)
+        if full:
+            self._wakeup.set()
+        return record
+
+    def _sync(self, position):
+        """fsync the journal unless another writer already did past ``position``"""
+        with self._sync_lock:
+            if self._synced >= position:
+                return
+            with self._lock:
+                target = self._appended
+                handle = self._segment.handle
+            os.fsync(handle.fileno())
+            self._synced = target
+
+    # Status
+
+    def _set_status(self, _id, state, error=None):
+        self._statuses[_id] = (state, error)
+        self._statuses.move_to_end(_id)
+        while len(self._statuses) > STATUS_HISTORY:
+            oldest, (oldest_state, _) = next(iter(self._statuses.items()))
+            if oldest_state == PENDING:
+                break
+            self._statuses.popitem(last=False)
+
+    def status(self, _id):
+        """``(state, error)`` for an activity; state is None when unknown"""
+        with self._lock:
+            known = self._statuses.get(_id)
+        if known is not None:
+            return known
+        if locate_activity(_id) is not None:
+            return APPLIED, None
+        return None, None
+
+    # Flushing
+
+    def start(self):
+        """Replay orphaned segments, then flush in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='activity-journal', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        recovered = False
+        while not self._stopped.is_set():
+            try:
+                if not recovered:
+                    self.recover()
+                    recovered = True
+                self.flush()
+            except Exception:
+                logger.exception('Activity journal flush failed; retrying')
+                self._stopped.wait(RETRY_SECONDS)
+                continue
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+
+    def flush(self):
+        """Write every journaled record to MongoDB; returns how many were written"""
+        with self._sync_lock, self._lock:
+            if self._segment.records:
+                sealed = self._segment
+                os.fsync(sealed.handle.fileno())
+                self._synced = self._appended
+                self._segment = self._open_segment()
+                self._unflushed.append(sealed)
+        written = 0
+        while self._unflushed:
+            # Stays queued, and on disk, until MongoDB has it
+            segment = self._unflushed[0]
+            retry, segment.attempted = segment.attempted, True
+            written += self._apply(segment.records, retry=retry)
+            self._unflushed.pop(0).discard()
+        return written
+
+    def _apply(self, records, replay=False, retry=False):
+        """
+        Write records to MongoDB. A record of a replayed or retried segment
+        that hits a duplicate key of the same document was written by an
+        earlier attempt, so it counts as applied. A retry follows a failed
+        insert, so it also applies that record's points and publishes it;
+        a replay cannot tell whether the crashed process did.
+        """
+        written = 0
+        for start in range(0, len(records), self.flush_records):
+            chunk, documents = [], []
+            for record in records[start:start + self.flush_records]:
+                with self._lock:
+                    state, _ = self._statuses.get(record['_id'], (None, None))
+                if state in (APPLIED, FAILED):
+                    # Finished by an earlier attempt at this segment
+                    continue
+                serializer = ActivityIngestSerializer(data=record)
+                if not serializer.is_valid():
+                    self._finish(record, FAILED, serializer.errors)
+                    continue
+                chunk.append(record)
+                documents.append(to_document(serializer.validated_data))
+            if not documents:
+                continue
+            failed = insert_activities(documents)
+            earlier = self._written_earlier(documents, failed) if replay or retry else set()
+            apply_activities([
+                document for index, document in enumerate(documents)
+                if index not in failed or (retry and index in earlier)
+            ])
+            for index, record in enumerate(chunk):
+                write_error = failed.get(index)
+                if write_error is None or (retry and index in earlier):
+                    self._finish(record, APPLIED)
+                    publish_activity('created', record)
+                    written += 1
+                elif index in earlier:
+                    self._finish(record, APPLIED)
+                else:
+                    self._finish(record, FAILED, write_error['errmsg'])
+        return written
+
+    @staticmethod
+    def _written_earlier(documents, failed):
+        """Indexes of the duplicate-key failures whose stored document is the one we wrote"""
+        duplicates = [documents[index] for index, error in failed.items() if error['code'] == DUPLICATE_KEY]
+        stored = {}
+        for alias, indexes in group_by_shard(duplicates).items():
+            ids = [duplicates[index]['_id'] for index in indexes]
+            stored.update((document['_id'], document) for document in shard_db(alias)[ACTIVITIES].find({'_id': {'$in': ids}}))
+        return {
+            index for index, error in failed.items()
+            if error['code'] == DUPLICATE_KEY and stored.get(documents[index]['_id']) == documents[index]
+        }
+
+    def _finish(self, record, state, error=None):
+        if state == FAILED:
+            logger.warning('Journaled activity %s was not written: %s', record['_id'], error)
+        with self._lock:
+            self._set_status(record['_id'], state, error)
+
+    def recover(self):
+        """Replay segments no running process holds; returns how many records were written"""
+        own = {self._segment.path} | {segment.path for segment in self._unflushed}
+        written = 0
+        for path in sorted(self.directory.glob('activities-*.ndjson')):
+            if path in own:
+                continue
+            try:
+                handle = open(path, 'rb+')
+            except FileNotFoundError:
+                continue
+            if not _lock(handle):
+                handle.close()
+                continue
+            try:
+                records = []
+                for line in handle:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A torn final line: that write was never acknowledged
+                        break
+                if records:
+                    logger.info('Replaying %d journaled activities from %s', len(records), path.name)
+                    written += self._apply(records, replay=True)
+            except Exception:
+                # Unlocks the segment for the next attempt
+                handle.close()
+                raise
+            Segment(path, handle).discard()
+        return written
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """The process-wide journal, started on first use"""
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = ActivityJournal(
+                    settings.ACTIVITY_JOURNAL_DIR,
+                    flush_ms=settings.ACTIVITY_JOURNAL_FLUSH_MS,
+                    flush_records=settings.ACTIVITY_JOURNAL_FLUSH_RECORDS,
+                ).start()
+    return _journal
+
+
+def start_journal():
+    """Start the journal in a serving process when write-behind is enabled"""
+    if settings.ACTIVITY_WRITE_BEHIND:
+        get_journal()
+
+
+def write_behind_requested(request):
+    """Whether to journal this create: the mode is enabled and the client asked for it"""
+    if not settings.ACTIVITY_WRITE_BEHIND:
+        return False
+    preferences = request.headers.get('Prefer', '')
+    return 'respond-async' in [value.strip().lower() for value in preferences.split(',')]
+
+
+def _reset_after_fork():
+    # The flusher thread and segment locks belong to the parent
+    global _journal, _journal_lock
+    _journal = None
+    _journal_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
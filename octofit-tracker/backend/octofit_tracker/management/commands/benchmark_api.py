@@ -0,0 +1,248 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from octofit_tracker.management.commands.populate_db import count
+from octofit_tracker.models import User, Team, Workout
+from octofit_tracker.mongo import get_db
+from octofit_tracker.urls import router
+
+PERCENTILES = {'p50': 0.50, 'p95': 0.95, 'p99': 0.99}
+
+# Query parameters the list-level actions need, by action name
+ACTION_PARAMS = {
+    'by_user': ('user_id',),
+    'by_team': ('team_id',),
+    'by_difficulty': ('difficulty',),
+}
+
+
+def percentile(timings, q):
+    """Nearest-rank percentile, the same rule benchmark_reads uses for p95"""
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every GET route on the API router with concurrent clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per route')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients per route')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per route before measuring')
+        parser.add_argument('--routes', nargs='*', help='Only benchmark URL names containing one of these')
+        parser.add_argument(
+            '--base-url',
+            help='Benchmark a running server (e.g. http://localhost:8000) instead of in-process requests',
+        )
+        parser.add_argument(
+            '--no-cache',
+            action='store_true',
+            help='Disable the response cache so every request reaches MongoDB (in-process only)',
+        )
+        parser.add_argument('--users', type=count, help='Seed this many synthetic users first (see populate_db)')
+        parser.add_argument('--activities', type=count, help='Seed this many synthetic activities first')
+        parser.add_argument('--teams', type=count, help='Seed this many synthetic teams first')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the seeded dataset')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare against results JSON from an earlier run')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Allowed relative slowdown against the baseline before failing (0.2 = 20%%)',
+        )
+        parser.add_argument(
+            '--metric',
+            choices=sorted(PERCENTILES),
+            default='p95',
+            help='Latency percentile compared against the baseline',
+        )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+        if any(options[name] for name in ('users', 'activities', 'teams')):
+            call_command(
+                'populate_db',
+                users=options['users'],
+                activities=options['activities'],
+                teams=options['teams'],
+                seed=options['seed'],
+                stdout=self.stdout,
+            )
+
+        routes = self.discover_routes(options['routes'])
+        if not routes:
+            raise CommandError('No GET routes matched')
+
+        if options['no_cache'] and not options['base_url']:
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+                results = self.run(routes, options)
+        else:
+            results = self.run(routes, options)
+
+        self.stdout.write(
+            f'{"route":<28}{"req/s":>10}{"p50":>10}{"p95":>10}{"p99":>10}{"errors":>8}'
+        )
+        for name, result in results['routes'].items():
+            self.stdout.write(
+                f'{name:<28}{result["throughput"]:>10.1f}{result["p50"]:>8.2f}ms'
+                f'{result["p95"]:>8.2f}ms{result["p99"]:>8.2f}ms{result["errors"]:>8}'
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['metric'], options['threshold'])
+
+    def discover_routes(self, only=None):
+        """Return (url name, path) for every GET endpoint registered on the router"""
+        db = get_db()
+        user = db[User._meta.db_table].find_one({}, sort=[('_id', 1)]) or {}
+        team = db[Team._meta.db_table].find_one({}, sort=[('_id', 1)]) or {}
+        workout = db[Workout._meta.db_table].find_one({}, sort=[('_id', 1)]) or {}
+        samples = {
+            'user_id': user.get('_id', 1),
+            'team_id': team.get('_id', 1),
+            'difficulty': workout.get('difficulty', 'Beginner'),
+        }
+
+        routes = []
+        for prefix, viewset, basename in router.registry:
+            model = viewset.queryset.model
+            document = db[model._meta.db_table].find_one({}, {'_id': 1}, sort=[('_id', 1)]) or {'_id': 1}
+            for route in router.get_routes(viewset):
+                action = router.get_method_map(viewset, route.mapping).get('get')
+                if action is None:
+                    continue
+                name = route.name.format(basename=basename)
+                if only and not any(part in name for part in only):
+                    continue
+                kwargs = {'pk': document['_id']} if '{lookup}' in route.url else {}
+                path = reverse(name, kwargs=kwargs)
+                params = {param: samples[param] for param in ACTION_PARAMS.get(action, ())}
+                if params:
+                    path = f'{path}?{urlencode(params)}'
+                routes.append((name, path))
+        return routes
+
+    def run(self, routes, options):
+        fetch = self.remote_fetch(options['base_url']) if options['base_url'] else self.local_fetch()
+        results = {}
+        for name, path in routes:
+            for _ in range(options['warmup']):
+                fetch(path)
+            results[name] = self.measure(fetch, path, options['requests'], options['concurrency'])
+        return {
+            'meta': {
+                'created': datetime.now(timezone.utc).isoformat(),
+                'base_url': options['base_url'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'cache': not options['no_cache'],
+                'dataset': {
+                    prefix: get_db()[viewset.queryset.model._meta.db_table].estimated_document_count()
+                    for prefix, viewset, _ in router.registry
+                },
+            },
+            'routes': results,
+        }
+
+    def measure(self, fetch, path, requests, concurrency):
+        timings, errors = [], []
+
+        def client_loop(share):
+            for _ in range(share):
+                start = time.perf_counter()
+                ok = fetch(path)
+                timings.append((time.perf_counter() - start) * 1000)
+                if not ok:
+                    errors.append(path)
+
+        # Spread the requests over the clients as evenly as possible
+        shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+        started = time.perf_counter()
+        if concurrency == 1:
+            client_loop(requests)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for future in [executor.submit(client_loop, share) for share in shares if share]:
+                    future.result()
+        elapsed = time.perf_counter() - started
+
+        result = {
+            'path': path,
+            'requests': len(timings),
+            'errors': len(errors),
+            'throughput': len(timings) / elapsed if elapsed else 0.0,
+            'mean': sum(timings) / len(timings),
+        }
+        result.update({label: percentile(timings, q) for label, q in PERCENTILES.items()})
+        return result
+
+    def local_fetch(self):
+        """In-process requests through Django's test client, one client per thread"""
+        clients = threading.local()
+
+        def fetch(path):
+            client = getattr(clients, 'client', None)
+            if client is None:
+                client = clients.client = Client(HTTP_HOST='localhost', HTTP_ACCEPT='application/json')
+            try:
+                return client.get(path).status_code < 400
+            except Exception:
+                return False
+        return fetch
+
+    def remote_fetch(self, base_url):
+        """Real HTTP requests against a running server"""
+        base_url = base_url.rstrip('/')
+
+        def fetch(path):
+            try:
+                with urlopen(base_url + path, timeout=30) as response:
+                    response.read()
+                    return response.status < 400
+            except (HTTPError, OSError):
+                return False
+        return fetch
+
+    def compare(self, results, baseline_path, metric, threshold):
+        """Fail when a route's latency percentile regressed past the threshold"""
+        with open(baseline_path) as f:
+            baseline = json.load(f)['routes']
+
+        regressions = []
+        for name, result in results['routes'].items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write(f'{name}: not in baseline, skipped')
+                continue
+            limit = before[metric] * (1 + threshold)
+            change = (result[metric] / before[metric] - 1) * 100 if before[metric] else 0.0
+            line = f'{name}: {metric} {before[metric]:.2f}ms -> {result[metric]:.2f}ms ({change:+.0f}%)'
+            if result[metric] > limit:
+                regressions.append(line)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(
+                f'{len(regressions)} route(s) regressed more than {threshold:.0%} on {metric}'
+            )
+        self.stdout.write(self.style.SUCCESS(f'No route regressed more than {threshold:.0%} on {metric}'))
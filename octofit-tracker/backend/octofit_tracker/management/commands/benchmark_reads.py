@@ -0,0 +1,83 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.models import User, Activity, Leaderboard
+from octofit_tracker.repositories import ActivityRepository, LeaderboardRepository, UserRepository
+from octofit_tracker.serializers import UserSerializer, ActivitySerializer, LeaderboardSerializer
+from octofit_tracker.sharding import is_sharded
+
+
+class Command(BaseCommand):
+    help = 'Compare ORM + serializer latency against the direct pymongo read path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Timed runs per case')
+        parser.add_argument('--limit', type=int, default=100, help='Rows fetched per run (one page)')
+
+    def handle(self, *args, **options):
+        iterations, limit = options['iterations'], options['limit']
+        cases = [
+            (
+                'users list',
+                lambda: UserSerializer(User.objects.all().order_by('_id')[:limit], many=True).data,
+                lambda: UserRepository().all()[:limit],
+            ),
+            (
+                'activities list',
+                lambda: ActivitySerializer(Activity.objects.all().order_by('-date', '-_id')[:limit], many=True).data,
+                lambda: ActivityRepository().all()[:limit],
+            ),
+            (
+                'activities by_user',
+                lambda: ActivitySerializer(
+                    Activity.objects.filter(user_id=1).order_by('-date', '-_id')[:limit], many=True
+                ).data,
+                lambda: ActivityRepository().by_user(1)[:limit],
+            ),
+            (
+                'leaderboard list',
+                lambda: LeaderboardSerializer(Leaderboard.objects.all().order_by('rank', '_id')[:limit], many=True).data,
+                lambda: LeaderboardRepository().all()[:limit],
+            ),
+            (
+                'leaderboard by_team',
+                lambda: LeaderboardSerializer(
+                    Leaderboard.objects.filter(team_id=1).order_by('rank', '_id')[:limit], many=True
+                ).data,
+                lambda: LeaderboardRepository().by_team(1)[:limit],
+            ),
+        ]
+
+        if is_sharded():
+            # The ORM reads one shard at a time, so there is nothing to compare
+            self.stdout.write('Activities are sharded: skipping the activity cases')
+            cases = [case for case in cases if not case[0].startswith('activities')]
+
+        self.stdout.write(f'{"case":<22}{"orm p50":>10}{"orm p95":>10}{"direct p50":>12}{"direct p95":>12}{"speedup":>9}')
+        for name, orm, direct in cases:
+            if [dict(row) for row in orm()] != direct():
+                self.stdout.write(self.style.ERROR(f'{name}: direct path output differs from the serializer'))
+                continue
+            orm_times = self.measure(orm, iterations)
+            direct_times = self.measure(direct, iterations)
+            orm_p50, direct_p50 = statistics.median(orm_times), statistics.median(direct_times)
+            self.stdout.write(
+                f'{name:<22}{orm_p50:>8.2f}ms{self.p95(orm_times):>8.2f}ms'
+                f'{direct_p50:>10.2f}ms{self.p95(direct_times):>10.2f}ms'
+                f'{orm_p50 / direct_p50 if direct_p50 else 0:>8.1f}x'
+            )
+
+    def measure(self, func, iterations):
+        func()  # warm up connections and caches
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def p95(self, timings):
+        ordered = sorted(timings)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
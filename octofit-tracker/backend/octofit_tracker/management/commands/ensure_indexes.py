@@ -0,0 +1,96 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.indexes import HOT_QUERIES, PROTECTED_INDEXES, explain_query, index_specs
+from octofit_tracker.mongo import get_db
+from octofit_tracker.sharding import collection_dbs
+
+
+class Command(BaseCommand):
+    help = 'Create the MongoDB indexes declared on the octofit_tracker models'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Drop indexes that are not declared on any model',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the changes without applying them',
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        dry_run = options['dry_run']
+
+        for model, collection in self.collections(db):
+            existing = collection.index_information()
+            declared = set()
+
+            for spec in index_specs(model):
+                # Match on key pattern so indexes created under another name
+                # (e.g. by djongo) are not duplicated
+                match = next(
+                    (name for name, info in existing.items()
+                     if info['key'] == spec.keys and bool(info.get('unique')) == spec.unique),
+                    None,
+                )
+                if match is not None:
+                    declared.add(match)
+                    continue
+
+                if spec.name in existing:
+                    self.stdout.write(f'Rebuilding {collection.name}.{spec.name}')
+                    if not dry_run:
+                        collection.drop_index(spec.name)
+                else:
+                    self.stdout.write(f'Creating {collection.name}.{spec.name}')
+                if not dry_run:
+                    collection.create_index(spec.keys, name=spec.name, unique=spec.unique)
+                declared.add(spec.name)
+
+            for name in existing:
+                if name in declared or name in PROTECTED_INDEXES:
+                    continue
+                if options['drop']:
+                    self.stdout.write(f'Dropping undeclared index {collection.name}.{name}')
+                    if not dry_run:
+                        collection.drop_index(name)
+                else:
+                    self.stdout.write(self.style.WARNING(
+                        f'Undeclared index {collection.name}.{name} (use --drop to remove it)'
+                    ))
+
+        if not dry_run:
+            self.report_unused(db)
+
+        self.stdout.write(self.style.SUCCESS('Indexes are up to date'))
+
+    @staticmethod
+    def collections(db):
+        """``(model, collection)`` for each model, one per shard of a sharded one"""
+        for model in apps.get_app_config('octofit_tracker').get_models():
+            for database in collection_dbs(model._meta.db_table, db):
+                yield model, database[model._meta.db_table]
+
+    def report_unused(self, db):
+        """Warn about hot queries without an index and indexes no hot query uses"""
+        used = set()
+        for query in HOT_QUERIES:
+            collection = query.model._meta.db_table
+            for database in collection_dbs(collection, db):
+                stages = explain_query(database, query)
+                used.update((collection, name) for _, name in stages if name)
+                if any(stage == 'COLLSCAN' for stage, _ in stages):
+                    self.stdout.write(self.style.ERROR(f'{query.name} runs a COLLSCAN on {collection}'))
+
+        for model, collection in self.collections(db):
+            for name, info in collection.index_information().items():
+                if name in PROTECTED_INDEXES or info.get('unique'):
+                    continue
+                if (collection.name, name) not in used:
+                    self.stdout.write(self.style.WARNING(
+                        f'Index {collection.name}.{name} is not used by any hot query'
+                    ))
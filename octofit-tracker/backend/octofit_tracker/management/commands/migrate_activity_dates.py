@@ -0,0 +1,64 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from pymongo import UpdateOne
+
+from octofit_tracker.cache import invalidate
+from octofit_tracker.models import Activity
+from octofit_tracker.sharding import ACTIVITIES, scatter, shard_dbs
+
+
+class Command(BaseCommand):
+    help = 'Store activity dates kept as YYYY-MM-DD strings as midnight datetimes, as djongo writes them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of activities updated per bulk_write call',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        # Date filters and pagination cursors compare with datetimes, which
+        # MongoDB never matches against strings. Each update is conditional
+        # on the old string, so a rerun or a concurrent write is harmless.
+        shards = shard_dbs()
+        results = scatter(lambda shard: self.convert(shard[1][ACTIVITIES], options['batch_size']), shards)
+        for (alias, _), (converted, skipped) in zip(shards, results):
+            self.stdout.write(f'Converted {converted} activity dates on {alias}')
+            if skipped:
+                self.stdout.write(self.style.WARNING(f'Skipped {skipped} activities on {alias} with unparseable dates'))
+
+        invalidate(Activity)
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {sum(converted for converted, _ in results)} activity dates'
+        ))
+
+    @staticmethod
+    def convert(collection, batch_size):
+        """Convert the string dates in one collection; returns (converted, skipped)"""
+        converted = skipped = 0
+        batch = []
+        for document in collection.find({'date': {'$type': 'string'}}, projection={'date': 1}, batch_size=batch_size):
+            try:
+                day = parse_date(document['date'])
+            except ValueError:
+                day = None
+            if day is None:
+                skipped += 1
+                continue
+            batch.append(UpdateOne(
+                {'_id': document['_id'], 'date': document['date']},
+                {'$set': {'date': datetime.combine(day, time.min)}},
+            ))
+            if len(batch) >= batch_size:
+                converted += collection.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            converted += collection.bulk_write(batch, ordered=False).modified_count
+        return converted, skipped
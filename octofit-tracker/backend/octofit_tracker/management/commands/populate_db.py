@@ -1,28 +1,88 @@
-from django.core.management.base import BaseCommand
-from pymongo import MongoClient
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import BulkWriteError
+
+from octofit_tracker.mongo import get_db
+from octofit_tracker.sequences import reset_sequences
+from octofit_tracker.sharding import collection_dbs, group_by_shard, scatter, shard_db
+from octofit_tracker.synthetic import SyntheticDataset, np
+
+DUPLICATE_KEY = 11000
+
+
+def count(value):
+    """Accept 1000000, 1e6 or 1_000_000 for document counts"""
+    return int(float(value))
+
+
+def insert_batch(collection, documents):
+    """Unordered insert that skips documents already written by an earlier run"""
+    if not documents:
+        return 0
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        if any(error['code'] != DUPLICATE_KEY for error in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
+
+
+def insert_activities(db, documents):
+    """``insert_batch`` of activities, split across the shards in parallel"""
+    return sum(scatter(
+        lambda shard: insert_batch(shard_db(shard[0], db).activities, [documents[index] for index in shard[1]]),
+        group_by_shard(documents).items(),
+    ))
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=count, help='Generate this many synthetic users')
+        parser.add_argument('--activities', type=count, help='Generate this many synthetic activities')
+        parser.add_argument('--teams', type=count, help='Generate this many synthetic teams')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for synthetic data')
+        parser.add_argument(
+            '--batch-size',
+            type=count,
+            default=10000,
+            help='Documents generated and inserted per batch',
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Parallel insert threads')
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue an interrupted synthetic run instead of clearing the database',
+        )
+
     def handle(self, *args, **kwargs):
+        if any(kwargs.get(name) is not None for name in ('users', 'activities', 'teams')):
+            return self.populate_synthetic(**kwargs)
+
         self.stdout.write('Starting database population...')
         
-        # Connect to MongoDB
-        client = MongoClient('localhost', 27017)
-        db = client['octofit_db']
+        # Connect to MongoDB through the shared, pooled client
+        db = get_db()
         
         # Clear existing data
         self.stdout.write('Clearing existing data...')
         db.users.delete_many({})
         db.teams.delete_many({})
-        db.activities.delete_many({})
+        for database in collection_dbs('activities', db):
+            database.activities.delete_many({})
         db.leaderboard.delete_many({})
         db.workouts.delete_many({})
+        # Server-assigned ids restart after the highest seeded _id
+        reset_sequences(db)
         
-        # Create unique index on email field for users collection
-        self.stdout.write('Creating unique index on email field...')
-        db.users.create_index([('email', 1)], unique=True)
+        # Create the indexes declared on the models (including unique email)
+        self.stdout.write('Creating indexes...')
+        call_command('ensure_indexes', stdout=self.stdout)
         
         # Insert Teams
         self.stdout.write('Inserting teams...')
@@ -52,25 +112,26 @@ class Command(BaseCommand):
         ]
         db.users.insert_many(users)
         
-        # Insert Activities
+        # Insert Activities, with dates stored like djongo writes DateField
+        # values: naive midnight datetimes
         self.stdout.write('Inserting activities...')
         activities = [
             # Team Marvel activities
-            {'_id': 1, 'user_id': 1, 'activity_type': 'Running', 'duration': 45, 'distance': 8.5, 'calories': 650, 'date': '2026-02-15'},
-            {'_id': 2, 'user_id': 2, 'activity_type': 'Cycling', 'duration': 60, 'distance': 25.0, 'calories': 800, 'date': '2026-02-15'},
-            {'_id': 3, 'user_id': 3, 'activity_type': 'Swimming', 'duration': 30, 'distance': 2.0, 'calories': 400, 'date': '2026-02-16'},
-            {'_id': 4, 'user_id': 4, 'activity_type': 'Weight Training', 'duration': 90, 'distance': 0.0, 'calories': 600, 'date': '2026-02-16'},
-            {'_id': 5, 'user_id': 5, 'activity_type': 'Running', 'duration': 50, 'distance': 10.0, 'calories': 750, 'date': '2026-02-17'},
-            {'_id': 6, 'user_id': 6, 'activity_type': 'Cycling', 'duration': 40, 'distance': 15.0, 'calories': 500, 'date': '2026-02-17'},
+            {'_id': 1, 'user_id': 1, 'activity_type': 'Running', 'duration': 45, 'distance': 8.5, 'calories': 650, 'date': datetime(2026, 2, 15)},
+            {'_id': 2, 'user_id': 2, 'activity_type': 'Cycling', 'duration': 60, 'distance': 25.0, 'calories': 800, 'date': datetime(2026, 2, 15)},
+            {'_id': 3, 'user_id': 3, 'activity_type': 'Swimming', 'duration': 30, 'distance': 2.0, 'calories': 400, 'date': datetime(2026, 2, 16)},
+            {'_id': 4, 'user_id': 4, 'activity_type': 'Weight Training', 'duration': 90, 'distance': 0.0, 'calories': 600, 'date': datetime(2026, 2, 16)},
+            {'_id': 5, 'user_id': 5, 'activity_type': 'Running', 'duration': 50, 'distance': 10.0, 'calories': 750, 'date': datetime(2026, 2, 17)},
+            {'_id': 6, 'user_id': 6, 'activity_type': 'Cycling', 'duration': 40, 'distance': 15.0, 'calories': 500, 'date': datetime(2026, 2, 17)},
             # Team DC activities
-            {'_id': 7, 'user_id': 7, 'activity_type': 'Running', 'duration': 60, 'distance': 15.0, 'calories': 900, 'date': '2026-02-15'},
-            {'_id': 8, 'user_id': 8, 'activity_type': 'Martial Arts', 'duration': 120, 'distance': 0.0, 'calories': 1000, 'date': '2026-02-15'},
-            {'_id': 9, 'user_id': 9, 'activity_type': 'Weight Training', 'duration': 75, 'distance': 0.0, 'calories': 550, 'date': '2026-02-16'},
-            {'_id': 10, 'user_id': 10, 'activity_type': 'Running', 'duration': 25, 'distance': 12.0, 'calories': 700, 'date': '2026-02-16'},
-            {'_id': 11, 'user_id': 11, 'activity_type': 'Swimming', 'duration': 60, 'distance': 5.0, 'calories': 800, 'date': '2026-02-17'},
-            {'_id': 12, 'user_id': 12, 'activity_type': 'Cycling', 'duration': 45, 'distance': 20.0, 'calories': 600, 'date': '2026-02-17'},
+            {'_id': 7, 'user_id': 7, 'activity_type': 'Running', 'duration': 60, 'distance': 15.0, 'calories': 900, 'date': datetime(2026, 2, 15)},
+            {'_id': 8, 'user_id': 8, 'activity_type': 'Martial Arts', 'duration': 120, 'distance': 0.0, 'calories': 1000, 'date': datetime(2026, 2, 15)},
+            {'_id': 9, 'user_id': 9, 'activity_type': 'Weight Training', 'duration': 75, 'distance': 0.0, 'calories': 550, 'date': datetime(2026, 2, 16)},
+            {'_id': 10, 'user_id': 10, 'activity_type': 'Running', 'duration': 25, 'distance': 12.0, 'calories': 700, 'date': datetime(2026, 2, 16)},
+            {'_id': 11, 'user_id': 11, 'activity_type': 'Swimming', 'duration': 60, 'distance': 5.0, 'calories': 800, 'date': datetime(2026, 2, 17)},
+            {'_id': 12, 'user_id': 12, 'activity_type': 'Cycling', 'duration': 45, 'distance': 20.0, 'calories': 600, 'date': datetime(2026, 2, 17)},
         ]
-        db.activities.insert_many(activities)
+        insert_activities(db, activities)
         
         # Insert Leaderboard
         self.stdout.write('Inserting leaderboard...')
@@ -104,9 +165,123 @@ class Command(BaseCommand):
         ]
         db.workouts.insert_many(workouts)
         
+        # Summarise the activities into the daily rollups the stats endpoints read
+        self.stdout.write('Building activity rollups...')
+        call_command('rebuild_rollups', stdout=self.stdout)
+        
+        # Index users, teams and workouts for /api/search/ and the admin
+        self.stdout.write('Building search index...')
+        call_command('rebuild_search_index', stdout=self.stdout)
+        
         self.stdout.write(self.style.SUCCESS('Database population completed successfully!'))
         self.stdout.write(f'Inserted {len(teams)} teams')
         self.stdout.write(f'Inserted {len(users)} users')
         self.stdout.write(f'Inserted {len(activities)} activities')
         self.stdout.write(f'Inserted {len(leaderboard)} leaderboard entries')
         self.stdout.write(f'Inserted {len(workouts)} workouts')
+
+    def populate_synthetic(self, users=None, activities=None, teams=None, seed=42,
+                           batch_size=10000, workers=4, resume=False, **kwargs):
+        """Generate a large skewed dataset batch by batch for load testing"""
+        if np is None:
+            raise CommandError('NumPy is required for synthetic data: pip install numpy')
+        users, activities, teams = users or 0, activities or 0, teams or 0
+        if activities and not users:
+            raise CommandError('--activities needs --users to assign them to')
+        if batch_size < 1 or workers < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+
+        db = get_db()
+        run = {
+            'users': users,
+            'activities': activities,
+            'teams': teams,
+            'seed': seed,
+            'batch_size': batch_size,
+        }
+        progress = db.populate_progress
+        checkpoint = progress.find_one({'_id': 'synthetic'})
+        if resume and checkpoint:
+            if any(checkpoint.get(name) != value for name, value in run.items()):
+                raise CommandError(
+                    'The interrupted run used different options: '
+                    + ', '.join(f'--{name.replace("_", "-")} {checkpoint.get(name)}' for name in run)
+                )
+            self.stdout.write('Resuming synthetic population...')
+        else:
+            self.stdout.write('Clearing existing data...')
+            for name in ('users', 'teams', 'activities', 'leaderboard', 'workouts',
+                         'user_daily_rollups', 'team_daily_rollups'):
+                for database in collection_dbs(name, db):
+                    database[name].delete_many({})
+            reset_sequences(db)
+            progress.replace_one({'_id': 'synthetic'}, dict(run, users_done=[], activities_done=[]), upsert=True)
+            checkpoint = {'users_done': [], 'activities_done': []}
+
+        self.stdout.write('Creating indexes...')
+        call_command('ensure_indexes', stdout=self.stdout)
+
+        dataset = SyntheticDataset(users, teams, activities, seed=seed)
+        insert_batch(db.teams, dataset.team_documents())
+        self.stdout.write(f'Inserted {teams} teams')
+        self.insert_batches(db.users, dataset.user_documents, users, batch_size, workers,
+                            set(checkpoint.get('users_done', [])), 'users')
+        self.insert_batches(db.activities, dataset.activity_documents, activities, batch_size, workers,
+                            set(checkpoint.get('activities_done', [])), 'activities',
+                            insert=lambda collection, documents: insert_activities(db, documents))
+
+        self.stdout.write('Building leaderboard...')
+        call_command('rebuild_leaderboard', stdout=self.stdout)
+        self.stdout.write('Building activity rollups...')
+        call_command('rebuild_rollups', stdout=self.stdout)
+        self.stdout.write('Building search index...')
+        call_command('rebuild_search_index', stdout=self.stdout)
+        progress.delete_one({'_id': 'synthetic'})
+        self.stdout.write(self.style.SUCCESS('Synthetic population completed successfully!'))
+
+    def insert_batches(self, collection, generate, total, batch_size, workers, done, label, insert=insert_batch):
+        """
+        Generate and insert ``total`` documents in batches on a thread pool.
+
+        At most two batches per worker are in flight, so memory stays bounded
+        by the batch size rather than the dataset size. Each finished batch is
+        checkpointed so ``--resume`` only redoes batches that never completed.
+        """
+        batches = (total + batch_size - 1) // batch_size
+        pending = [batch for batch in range(batches) if batch not in done]
+        progress = collection.database.populate_progress
+        finished = len(done)
+        written = 0
+        started = time.perf_counter()
+
+        def run(batch):
+            return batch, insert(collection, generate(batch, batch_size))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = set()
+            for batch in pending:
+                in_flight.add(executor.submit(run, batch))
+                if len(in_flight) < workers * 2:
+                    continue
+                completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    written += self.record_batch(progress, label, future.result())
+                    finished += 1
+                    self.report(label, finished, batches, written, started)
+            for future in in_flight:
+                written += self.record_batch(progress, label, future.result())
+                finished += 1
+                self.report(label, finished, batches, written, started)
+
+    @staticmethod
+    def record_batch(progress, label, result):
+        batch, inserted = result
+        progress.update_one({'_id': 'synthetic'}, {'$addToSet': {f'{label}_done': batch}})
+        return inserted
+
+    def report(self, label, finished, batches, written, started):
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(
+            f'Inserted {label}: batch {finished}/{batches}, '
+            f'{written} documents, {written / elapsed:,.0f} docs/s'
+        )
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from pymongo import ReplaceOne
+
+from octofit_tracker.cache import invalidate
+from octofit_tracker.models import Activity
+from octofit_tracker.sharding import ACTIVITIES, scatter, shard_db, shard_for
+
+
+class Command(BaseCommand):
+    help = 'Move every activity to the shard ACTIVITY_SHARDS assigns its user_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            action='append',
+            default=[],
+            metavar='ALIAS',
+            help='Also drain this database alias, e.g. a shard being removed (repeatable)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of activities copied per bulk_write call',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the activities that would move without moving them',
+        )
+
+    def handle(self, *args, **options):
+        shards = list(settings.ACTIVITY_SHARDS)
+        # default held the activities before sharding, so it is always drained
+        sources = list(dict.fromkeys(shards + ['default'] + options['source']))
+        unknown = [alias for alias in options['source'] if alias not in connections.databases]
+        if unknown:
+            raise CommandError(f'Unknown database alias: {", ".join(unknown)}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        if not options['dry_run']:
+            self.stdout.write('Creating indexes...')
+            call_command('ensure_indexes', stdout=self.stdout)
+
+        # Each source is scanned on its own thread; copies are idempotent
+        # upserts, deleted from the source only once written, so an
+        # interrupted run can simply be repeated
+        moved = scatter(lambda alias: self.drain(alias, shards, options), sources)
+        for alias, counts in zip(sources, moved):
+            for target, count in sorted(counts.items()):
+                verb = 'Would move' if options['dry_run'] else 'Moved'
+                self.stdout.write(f'{verb} {count} activities from {alias} to {target}')
+
+        if not options['dry_run']:
+            invalidate(Activity)
+        total = sum(sum(counts.values()) for counts in moved)
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would move" if options["dry_run"] else "Moved"} {total} activities across {len(shards)} shards'
+        ))
+
+    def drain(self, alias, shards, options):
+        """Move the activities on ``alias`` that belong elsewhere; returns {target: count}"""
+        collection = shard_db(alias)[ACTIVITIES]
+        counts, pending = {}, {}
+        for document in collection.find({}, batch_size=options['batch_size']):
+            target = shard_for(document['user_id'], shards)
+            if target == alias:
+                continue
+            counts[target] = counts.get(target, 0) + 1
+            if options['dry_run']:
+                continue
+            batch = pending.setdefault(target, [])
+            batch.append(document)
+            if len(batch) >= options['batch_size']:
+                self.move(collection, target, pending.pop(target))
+        for target, batch in pending.items():
+            self.move(collection, target, batch)
+        return counts
+
+    @staticmethod
+    def move(source, target, documents):
+        shard_db(target)[ACTIVITIES].bulk_write(
+            [ReplaceOne({'_id': document['_id']}, document, upsert=True) for document in documents],
+            ordered=False,
+        )
+        source.delete_many({'_id': {'$in': [document['_id'] for document in documents]}})
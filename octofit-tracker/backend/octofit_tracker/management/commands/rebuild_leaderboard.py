@@ -0,0 +1,117 @@
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from octofit_tracker.cache import invalidate
+from octofit_tracker.models import User, Activity, Leaderboard
+from octofit_tracker.mongo import get_db
+from octofit_tracker.sequences import reserve_ids
+from octofit_tracker.sharding import collection_dbs, merge_sorted, scatter
+
+
+class Command(BaseCommand):
+    help = 'Recompute leaderboard points and ranks from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of leaderboard rows written per bulk_write call',
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        leaderboard = db[Leaderboard._meta.db_table]
+        batch_size = options['batch_size']
+
+        self.stdout.write('Resetting leaderboard points...')
+        leaderboard.update_many({}, {'$set': {'total_points': 0}})
+
+        # Points must match scoring.activity_points (one point per calorie)
+        self.stdout.write('Summing activity points...')
+        teams = {
+            user['_id']: user.get('team_id')
+            for user in db[User._meta.db_table].find({}, {'team_id': 1})
+        }
+        # Users without a row get one, with an _id from the leaderboard
+        # sequence; Leaderboard.team_id is required, so unknown and teamless
+        # users get none
+        existing = {row['user_id'] for row in leaderboard.find({}, projection={'_id': 0, 'user_id': 1})}
+        new_ids = self.new_ids(db, batch_size)
+        users = self.write_batches(leaderboard, (
+            UpdateOne(
+                {'user_id': user_id},
+                {
+                    '$set': {'total_points': total_points, 'team_id': teams.get(user_id)},
+                    **({} if user_id in existing else {'$setOnInsert': {'_id': next(new_ids)}}),
+                },
+                upsert=True,
+            )
+            for user_id, total_points in self.user_totals(db)
+            if teams.get(user_id) is not None
+        ), batch_size)
+
+        self.stdout.write('Assigning ranks...')
+        ranked = self.write_batches(leaderboard, self.rank_updates(leaderboard), batch_size)
+
+        invalidate(Leaderboard)
+
+        self.stdout.write(self.style.SUCCESS('Leaderboard rebuilt successfully!'))
+        self.stdout.write(f'Updated points for {users} users')
+        self.stdout.write(f'Updated ranks for {ranked} leaderboard entries')
+
+    @staticmethod
+    def user_totals(db):
+        """
+        Yield ``(user_id, points)`` in user order: summed on every activity
+        shard in parallel, then merged. A user's activities normally sit on
+        one shard; rows split by an unfinished rebalance are added up.
+        """
+        pipeline = [
+            {'$group': {'_id': '$user_id', 'total_points': {'$sum': '$calories'}}},
+            {'$sort': {'_id': 1}},
+        ]
+        streams = scatter(
+            lambda database: database[Activity._meta.db_table].aggregate(pipeline, allowDiskUse=True),
+            collection_dbs(Activity._meta.db_table, db),
+        )
+        current, points = None, 0
+        for row in merge_sorted(streams, [('_id', ASCENDING)]):
+            if row['_id'] != current and current is not None:
+                yield current, points
+                points = 0
+            current = row['_id']
+            points += row['total_points']
+        if current is not None:
+            yield current, points
+
+    @staticmethod
+    def new_ids(db, batch_size):
+        """Yield leaderboard ids, reserved ``batch_size`` at a time as needed"""
+        while True:
+            yield from reserve_ids(Leaderboard, batch_size, db=db)
+
+    def rank_updates(self, leaderboard):
+        """Yield competition-rank updates walking the points index in order"""
+        rank, previous = 0, None
+        rows = leaderboard.find({}, projection={'total_points': 1, 'rank': 1}).sort(
+            [('total_points', DESCENDING), ('_id', 1)]
+        )
+        for position, row in enumerate(rows, start=1):
+            if row['total_points'] != previous:
+                rank, previous = position, row['total_points']
+            if row.get('rank') != rank:
+                yield UpdateOne({'_id': row['_id']}, {'$set': {'rank': rank}})
+
+    def write_batches(self, collection, operations, batch_size):
+        written, batch = 0, []
+        for operation in operations:
+            batch.append(operation)
+            if len(batch) >= batch_size:
+                collection.bulk_write(batch, ordered=False)
+                written += len(batch)
+                batch = []
+        if batch:
+            collection.bulk_write(batch, ordered=False)
+            written += len(batch)
+        return written
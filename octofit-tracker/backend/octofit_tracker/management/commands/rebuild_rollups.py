@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING
+
+from octofit_tracker.cache import invalidate
+from octofit_tracker.indexes import index_specs
+from octofit_tracker.models import User, Activity, UserDailyRollup, TeamDailyRollup
+from octofit_tracker.mongo import get_db
+from octofit_tracker.rollups import SUM_FIELDS, type_key
+from octofit_tracker.sharding import collection_dbs, merge_sorted, scatter
+
+# Midnight of an activity's date; documents written before
+# migrate_activity_dates may store dates as strings
+DAY = {'$dateFromParts': {
+    'year': {'$year': {'$toDate': '$date'}},
+    'month': {'$month': {'$toDate': '$date'}},
+    'day': {'$dayOfMonth': {'$toDate': '$date'}},
+}}
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily user and team activity rollups from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rollup documents written per insert_many call',
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        batch_size = options['batch_size']
+        user_table = UserDailyRollup._meta.db_table
+        team_table = TeamDailyRollup._meta.db_table
+
+        self.stdout.write('Summing activities per user and day...')
+        teams = {
+            user['_id']: user.get('team_id')
+            for user in db[User._meta.db_table].find({}, {'team_id': 1})
+        }
+        team_days = defaultdict(self.empty_rollup)
+        user_rollups = self.write_collection(db, UserDailyRollup, (
+            self.add_to_team(team_days, teams.get(rollup['user_id']), rollup)
+            for rollup in self.user_rollups(db)
+        ), batch_size)
+
+        self.stdout.write('Summing activities per team and day...')
+        team_rollups = self.write_collection(db, TeamDailyRollup, (
+            dict(team_id=team_id, date=day, **rollup)
+            for (team_id, day), rollup in sorted(team_days.items())
+        ), batch_size)
+
+        # Cached stats responses depend on activities
+        invalidate(Activity)
+
+        self.stdout.write(self.style.SUCCESS('Rollups rebuilt successfully!'))
+        self.stdout.write(f'Wrote {user_rollups} {user_table} documents')
+        self.stdout.write(f'Wrote {team_rollups} {team_table} documents')
+
+    def user_rollups(self, db):
+        """
+        Yield one rollup document per (user_id, day), built from per-type
+        sums computed on every activity shard in parallel and merged in
+        (user_id, day) order
+        """
+        group = {'_id': {'user_id': '$user_id', 'date': DAY, 'type': '$activity_type'}, 'activities': {'$sum': 1}}
+        group.update({field: {'$sum': f'${field}'} for field in SUM_FIELDS})
+        pipeline = [
+            {'$group': group},
+            {'$sort': {'_id.user_id': 1, '_id.date': 1}},
+        ]
+        rows = merge_sorted(
+            scatter(
+                lambda database: database[Activity._meta.db_table].aggregate(pipeline, allowDiskUse=True),
+                collection_dbs(Activity._meta.db_table, db),
+            ),
+            [('_id.user_id', ASCENDING), ('_id.date', ASCENDING)],
+        )
+
+        current, rollup = None, None
+        for row in rows:
+            key = (row['_id']['user_id'], row['_id']['date'])
+            if key != current:
+                if rollup is not None:
+                    yield rollup
+                current = key
+                rollup = dict(user_id=key[0], date=key[1], **self.empty_rollup())
+            totals = {field: row[field] for field in SUM_FIELDS + ('activities',)}
+            # Added up: an unfinished rebalance can split a day across shards
+            type_totals = rollup['types'].setdefault(type_key(row['_id']['type']), dict.fromkeys(totals, 0))
+            for field, value in totals.items():
+                type_totals[field] += value
+                rollup[field] += value
+        if rollup is not None:
+            yield rollup
+
+    def add_to_team(self, team_days, team_id, rollup):
+        if team_id is not None:
+            team_rollup = team_days[(team_id, rollup['date'])]
+            for field in SUM_FIELDS + ('activities',):
+                team_rollup[field] += rollup[field]
+            for name, totals in rollup['types'].items():
+                team_totals = team_rollup['types'].setdefault(name, dict.fromkeys(totals, 0))
+                for field, value in totals.items():
+                    team_totals[field] += value
+        return rollup
+
+    @staticmethod
+    def empty_rollup():
+        return dict(dict.fromkeys(SUM_FIELDS + ('activities',), 0), types={})
+
+    def write_collection(self, db, model, documents, batch_size):
+        """
+        Write the documents to a scratch collection, index it and swap it in
+        with a rename, so readers never see a half-built rollup.
+        """
+        table = model._meta.db_table
+        scratch = db[f'{table}_rebuild']
+        scratch.drop()
+
+        written, batch = 0, []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                scratch.insert_many(batch, ordered=False)
+                written += len(batch)
+                batch = []
+        if batch:
+            scratch.insert_many(batch, ordered=False)
+            written += len(batch)
+
+        if not written:
+            scratch.drop()
+            db[table].delete_many({})
+            return 0
+        for spec in index_specs(model):
+            scratch.create_index(spec.keys, name=spec.name, unique=spec.unique)
+        scratch.rename(table, dropTarget=True)
+        return written
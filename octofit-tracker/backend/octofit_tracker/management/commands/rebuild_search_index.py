@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.indexes import index_specs
+from octofit_tracker.models import SearchEntry
+from octofit_tracker.mongo import get_db
+from octofit_tracker.search import SOURCES, entry_document
+
+
+class Command(BaseCommand):
+    help = 'Recreate the search index entries for users, teams and workouts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of search entries written per insert_many call',
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        batch_size = options['batch_size']
+        table = SearchEntry._meta.db_table
+
+        # Built beside the live index and swapped in with a rename, so
+        # searches keep working during the rebuild
+        scratch = db[f'{table}_rebuild']
+        scratch.drop()
+        written = 0
+        for kind, source in SOURCES.items():
+            self.stdout.write(f'Indexing {source.model._meta.db_table}...')
+            projection = dict.fromkeys(source.weights, 1)
+            documents = db[source.model._meta.db_table].find({}, projection=projection)
+            written += self.write_batches(scratch, (entry_document(kind, document) for document in documents), batch_size)
+
+        if written:
+            for spec in index_specs(SearchEntry):
+                scratch.create_index(spec.keys, name=spec.name, unique=spec.unique)
+            scratch.rename(table, dropTarget=True)
+        else:
+            scratch.drop()
+            db[table].delete_many({})
+
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt successfully!'))
+        self.stdout.write(f'Wrote {written} {table} documents')
+
+    def write_batches(self, collection, documents, batch_size):
+        written, batch = 0, []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                collection.insert_many(batch, ordered=False)
+                written += len(batch)
+                batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+            written += len(batch)
+        return written
@@ -10,6 +10,9 @@ class User(models.Model):
 
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team_id', '_id'], name='user_team_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -38,11 +41,53 @@ class Activity(models.Model):
 
     class Meta:
         db_table = 'activities'
+        indexes = [
+            models.Index(fields=['-date', '-_id'], name='activity_date_idx'),
+            models.Index(fields=['user_id', '-date', '-_id'], name='activity_user_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.activity_type} - {self.date}"
 
 
+class UserDailyRollup(models.Model):
+    """Per-user daily activity totals, maintained by octofit_tracker.rollups"""
+    _id = models.ObjectIdField()
+    user_id = models.IntegerField()
+    date = models.DateField()
+    activities = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0)
+    distance = models.FloatField(default=0)
+    calories = models.IntegerField(default=0)
+    types = models.JSONField(default=dict)  # the same totals per activity type
+
+    class Meta:
+        db_table = 'user_daily_rollups'
+        unique_together = [('user_id', 'date')]
+
+    def __str__(self):
+        return f"User {self.user_id} - {self.date}"
+
+
+class TeamDailyRollup(models.Model):
+    """Per-team daily activity totals, maintained by octofit_tracker.rollups"""
+    _id = models.ObjectIdField()
+    team_id = models.IntegerField()
+    date = models.DateField()
+    activities = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0)
+    distance = models.FloatField(default=0)
+    calories = models.IntegerField(default=0)
+    types = models.JSONField(default=dict)
+
+    class Meta:
+        db_table = 'team_daily_rollups'
+        unique_together = [('team_id', 'date')]
+
+    def __str__(self):
+        return f"Team {self.team_id} - {self.date}"
+
+
 class Leaderboard(models.Model):
     _id = models.IntegerField(primary_key=True)
     user_id = models.IntegerField()
@@ -52,6 +97,12 @@ class Leaderboard(models.Model):
 
     class Meta:
         db_table = 'leaderboard'
+        indexes = [
+            models.Index(fields=['rank', '_id'], name='leaderboard_rank_idx'),
+            models.Index(fields=['team_id', 'rank', '_id'], name='leaderboard_team_rank_idx'),
+            models.Index(fields=['user_id'], name='leaderboard_user_idx'),
+            models.Index(fields=['-total_points', '_id'], name='leaderboard_points_idx'),
+        ]
 
     def __str__(self):
         return f"User {self.user_id} - Rank {self.rank}"
@@ -66,6 +117,29 @@ class Workout(models.Model):
 
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['difficulty', '_id'], name='workout_difficulty_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class SearchEntry(models.Model):
+    """Prefix search terms for one user, team or workout, maintained by octofit_tracker.search"""
+    _id = models.ObjectIdField()
+    kind = models.CharField(max_length=20)  # user, team or workout
+    ref = models.IntegerField()             # the indexed document's _id
+    label = models.CharField(max_length=100)
+    terms = models.JSONField(default=list)  # every prefix of every word
+    words = models.JSONField(default=dict)  # field -> words, for ranking
+
+    class Meta:
+        db_table = 'search_index'
+        unique_together = [('kind', 'ref')]
+        indexes = [
+            models.Index(fields=['terms', 'kind'], name='search_terms_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.ref} - {self.label}"
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from pymongo import MongoClient, monitoring
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # pragma: no cover - motor is only needed for the async views
+    AsyncIOMotorClient = None
+
+from .metrics import Counter, Histogram
+from .profiling import CommandTimer
+
+POOL_CHECKOUT_WAIT = Histogram(
+    'mongo_pool_checkout_wait_seconds',
+    'Time spent waiting to check a connection out of the MongoClient pool',
+    labelnames=('address',),
+)
+POOL_CHECKOUT_FAILURES = Counter(
+    'mongo_pool_checkout_failures_total',
+    'Connection checkouts that failed, e.g. on waitQueueTimeoutMS',
+    labelnames=('address', 'reason'),
+)
+
+
+class PoolWaitListener(monitoring.ConnectionPoolListener):
+    """Records how long each connection checkout waited for the pool"""
+
+    def __init__(self):
+        self._started = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._started.value = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._started, 'value', None)
+        if started is not None:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, address='%s:%s' % event.address)
+            self._started.value = None
+
+    def connection_check_out_failed(self, event):
+        self._started.value = None
+        POOL_CHECKOUT_FAILURES.inc(address='%s:%s' % event.address, reason=event.reason)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+_pool_listener = PoolWaitListener()
+_command_timer = CommandTimer()
+# Motor clients are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _reset_after_fork():
+    """
+    Forget clients inherited from the parent process. MongoClient is not
+    fork-safe, so each gunicorn/uvicorn worker builds its own pools.
+    """
+    global _clients_pid
+    _clients.clear()
+    _async_clients.clear()
+    _clients_pid = os.getpid()
+    for connection in connections.all():
+        connection.connection = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client(alias='default'):
+    """
+    Return the process-wide MongoClient for a database alias.
+
+    Pool sizing and timeouts come from ``DATABASES[alias]['CLIENT']``, which
+    settings.py fills from the MONGO_* environment variables (a test mirror
+    alias uses its mirror's). djongo, the management commands and the direct
+    pymongo paths all share this client.
+    """
+    if os.getpid() != _clients_pid:
+        _reset_after_fork()
+    client = _clients.get(alias)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(alias)
+            if client is None:
+                client = _clients[alias] = new_client(connections[alias].settings_dict)
+    return client
+
+
+def new_client(settings_dict):
+    """
+    Build a MongoClient from a ``DATABASES`` entry's ``CLIENT`` options.
+    Only ``get_client`` and connections outside ``DATABASES`` call this;
+    everything else shares the per-alias client.
+    """
+    return MongoClient(
+        connect=False,
+        event_listeners=[_pool_listener, _command_timer],
+        **dict(settings_dict.get('CLIENT', {}))
+    )
+
+
+def get_db(alias='default'):
+    """Return the pymongo Database for a connection alias"""
+    return get_client(alias)[connections[alias].settings_dict['NAME']]
+
+
+def get_async_client(alias='default'):
+    """
+    Return the Motor client for a database alias on the running event loop,
+    configured from the same ``DATABASES[alias]['CLIENT']`` pool options as
+    ``get_client``.
+    """
+    if AsyncIOMotorClient is None:
+        raise ImproperlyConfigured('motor is required for the async views (pip install motor)')
+    if os.getpid() != _clients_pid:
+        _reset_after_fork()
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(alias)
+        if client is None:
+            options = dict(connections[alias].settings_dict.get('CLIENT', {}))
+            client = clients[alias] = AsyncIOMotorClient(
+                connect=False,
+                event_listeners=[_pool_listener, _command_timer],
+                **options
+            )
+    return client
+
+
+def get_async_db(alias='default'):
+    """Return the Motor database for a connection alias"""
+    return get_async_client(alias)[connections[alias].settings_dict['NAME']]
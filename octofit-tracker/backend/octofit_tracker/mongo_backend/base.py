@@ -0,0 +1,40 @@
+"""
+djongo database backend that runs on the process-wide MongoClient from
+octofit_tracker.mongo instead of opening (and closing) its own client.
+"""
+from collections import OrderedDict
+
+from bson.codec_options import CodecOptions
+from django.db import connections
+from djongo import base
+
+from octofit_tracker.mongo import get_client, new_client
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    @property
+    def shares_client(self):
+        # Test database setup and teardown open a throwaway '__no_db__'
+        # copy of a connection, which is not in DATABASES
+        return self.alias in connections.databases
+
+    def get_new_connection(self, connection_params):
+        name = connection_params['name']
+        if self.shares_client:
+            self.client_connection = get_client(self.alias)
+        else:
+            self.client_connection = new_client(self.settings_dict)
+        # djongo expects OrderedDict documents; the shared pool is unaffected
+        database = self.client_connection.get_database(
+            name, codec_options=CodecOptions(document_class=OrderedDict)
+        )
+        self.djongo_connection = base.DjongoClient(database, connection_params['enforce_schema'])
+        return database
+
+    def _close(self):
+        # Django closes connections at the end of every request; keep the
+        # shared pool open and only drop this wrapper's reference to it. A
+        # throwaway connection closes the client it built.
+        if not self.shares_client and self.client_connection is not None:
+            self.client_connection.close()
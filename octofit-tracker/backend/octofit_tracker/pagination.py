@@ -0,0 +1,171 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Cursor pagination keyed on the queryset ordering plus ``_id``.
+
+    Pages are selected with a range filter on the ordering keys instead of
+    skip/offset, so MongoDB walks a compound index and the cursors stay
+    stable while new documents are inserted.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 1000
+    tiebreaker = '_id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` for a MongoQuery on a Motor database"""
+        queryset = self.get_page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.set_page(await queryset.alist(self.page_size + 1))
+
+    def get_page_queryset(self, queryset, request):
+        """Order and filter ``queryset`` so its first rows are the requested page"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.keys = self.get_keys(queryset)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        ordering = [self._order_term(field, descending != self.reverse) for field, descending in self.keys]
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(self.position, self.reverse))
+        return queryset
+
+    def set_page(self, results):
+        """Trim the page_size + 1 rows read and work out the next/previous links"""
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.reverse:
+            results.reverse()
+            self.has_next = self.position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                value = int(request.query_params[self.page_size_query_param])
+                if value > 0:
+                    return min(value, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_keys(self, queryset):
+        """Return ``(field, descending)`` pairs, always ending with ``_id``"""
+        keys = []
+        # Querysets keep their ordering on .query; MongoQuery on .ordering
+        ordering = queryset.query.order_by if hasattr(queryset, 'query') else queryset.ordering
+        for term in ordering or (self.tiebreaker,):
+            field = term.lstrip('-')
+            if field == 'pk':
+                field = self.tiebreaker
+            keys.append((field, term.startswith('-')))
+        if self.tiebreaker not in [field for field, _ in keys]:
+            keys.append((self.tiebreaker, keys[0][1]))
+        return keys
+
+    def get_keyset_filter(self, position, reverse):
+        """
+        Build ``k1 > v1 OR (k1 = v1 AND k2 > v2) OR ...`` for the page
+        boundary, flipping the comparison for descending keys.
+        """
+        condition = Q()
+        for index, (field, descending) in enumerate(self.keys):
+            lookups = {key: value for (key, _), value in zip(self.keys[:index], position)}
+            lookups[f"{field}__{'lt' if descending != reverse else 'gt'}"] = position[index]
+            condition |= Q(**lookups)
+        return condition
+
+    def get_position(self, instance):
+        position = []
+        for field, _ in self.keys:
+            value = instance[field] if isinstance(instance, dict) else getattr(instance, field)
+            if isinstance(value, date):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """Return ``(position, reverse)`` for the cursor in the request"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = payload['p'], bool(payload['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    @staticmethod
+    def _order_term(field, descending):
+        return f'-{field}' if descending else field
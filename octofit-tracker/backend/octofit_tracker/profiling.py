@@ -0,0 +1,202 @@
+"""
+Per-request profiling.
+
+ProfilingMiddleware opens a RequestProfile for every request and, while it
+is active, times four phases:
+
+- ``mongo``: server round trips, from pymongo command monitoring
+- ``djongo``: djongo's SQL-to-MongoDB translation, from a Django execute
+  wrapper
+- ``serialize``: blocks marked with ``phase('serialize')`` or ``timed``
+  in the serializers and read paths
+- ``render``: the response renderer, from the template response hooks
+
+Phases are exclusive: time already counted by a nested phase (a MongoDB
+round trip while serializing, say) is not counted again. The totals are
+sent in a ``Server-Timing`` header and recorded in per-route histograms
+exported on /metrics. Outside a request every hook costs one context
+variable lookup.
+
+Commands Motor runs on its executor threads are not attributed to the
+request, so the async read path reports its MongoDB time under ``total``
+only.
+"""
+import asyncio
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+from django.db.backends.signals import connection_created
+from django.utils.deprecation import MiddlewareMixin
+from pymongo import monitoring
+
+from .metrics import Histogram
+
+PHASES = ('mongo', 'djongo', 'serialize', 'render')
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling a request, by route',
+    labelnames=('route', 'method'),
+)
+PHASE_DURATION = Histogram(
+    'http_request_phase_seconds',
+    'Time a request spent in each profiled phase, by route',
+    labelnames=('route', 'phase'),
+)
+MONGO_COMMANDS = Histogram(
+    'http_request_mongo_commands',
+    'MongoDB commands issued per request, by route',
+    labelnames=('route',),
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+
+_current = contextvars.ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """Phase totals for one request"""
+    __slots__ = ('started', 'durations', 'accounted', 'mongo_commands', 'open')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        # Sum of all phase time so far; lets an outer phase exclude inner ones
+        self.accounted = 0.0
+        self.mongo_commands = 0
+        self.open = set()
+
+    def add(self, name, seconds):
+        self.durations[name] += seconds
+        self.accounted += seconds
+
+    def begin(self, name):
+        self.open.add(name)
+        return time.perf_counter(), self.accounted
+
+    def end(self, name, mark):
+        started, accounted = mark
+        nested = self.accounted - accounted
+        self.add(name, max(time.perf_counter() - started - nested, 0.0))
+        self.open.discard(name)
+
+    def server_timing(self, total):
+        entries = []
+        for name, seconds in self.durations.items():
+            entry = f'{name};dur={seconds * 1000:.2f}'
+            if name == 'mongo':
+                entry += f';desc="{self.mongo_commands} commands"'
+            entries.append(entry)
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def phase(name):
+    """Count the enclosed block towards ``name`` for the current request"""
+    profile = _current.get()
+    if profile is None or name in profile.open:
+        yield
+        return
+    mark = profile.begin(name)
+    try:
+        yield
+    finally:
+        profile.end(name, mark)
+
+
+def timed(name):
+    """Decorator form of ``phase``; nested calls only count once"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None or name in profile.open:
+                return func(*args, **kwargs)
+            mark = profile.begin(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.end(name, mark)
+        return wrapper
+    return decorator
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Adds each MongoDB command's round trip to the current request's profile"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        profile = _current.get()
+        if profile is not None:
+            profile.add('mongo', event.duration_micros / 1e6)
+            profile.mongo_commands += 1
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+def _time_query(execute, sql, params, many, context):
+    """Execute wrapper timing djongo's translation; its MongoDB calls count as ``mongo``"""
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    with phase('djongo'):
+        return execute(sql, params, many, context)
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_install_query_timer)
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Profiles each request and reports the phase totals in a
+    ``Server-Timing`` header and the per-route histograms. Works under
+    both WSGI and ASGI without moving async views onto a thread.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    def process_template_response(self, request, response):
+        # Called just before response.render(); the callback runs right after
+        profile = _current.get()
+        if profile is not None and 'render' not in profile.open:
+            mark = profile.begin('render')
+            response.add_post_render_callback(lambda rendered: profile.end('render', mark))
+        return response
+
+    def finish(self, request, response, profile):
+        total = time.perf_counter() - profile.started
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name or match.route) if match is not None else 'unmatched'
+        REQUEST_DURATION.observe(total, route=route, method=request.method)
+        for name, seconds in profile.durations.items():
+            PHASE_DURATION.observe(seconds, route=route, phase=name)
+        MONGO_COMMANDS.observe(profile.mongo_commands, route=route)
+        response['Server-Timing'] = profile.server_timing(total)
+        return response
@@ -0,0 +1,256 @@
+from datetime import date, datetime, time
+from functools import lru_cache
+from itertools import islice
+
+from django.db.models import Q
+from pymongo import ASCENDING, DESCENDING
+
+from .models import User, Team, Activity, Leaderboard, Workout
+from .routers import get_read_db
+from .sharding import is_sharded, merge_sorted, scatter, shard_db, shards_for_spec
+from .serializers import (
+    UserSerializer,
+    TeamSerializer,
+    ActivitySerializer,
+    LeaderboardSerializer,
+    WorkoutSerializer,
+    FastReadSerializer
+)
+
+MONGO_OPERATORS = {
+    'lt': '$lt',
+    'lte': '$lte',
+    'gt': '$gt',
+    'gte': '$gte',
+}
+
+# Extractors are compiled once per (model, fields) and shared by all queries
+_reader = lru_cache(maxsize=None)(FastReadSerializer)
+
+
+class MongoQuery:
+    """
+    A queryset-like read over one collection that runs as a native pymongo
+    ``find`` with a projection and yields dicts shaped like the model's
+    serializer output.
+
+    ``filter`` and ``order_by`` accept the same field lookups as the ORM
+    (exact, in, lt, lte, gt, gte and Q objects), so the keyset paginator
+    can page it like a QuerySet without djongo's SQL translation. Built on
+    a Motor database, the same query is read with ``await query.alist()``.
+
+    Activity queries read the shards the filter can match: one when it pins
+    user_id, otherwise all of them in parallel, merged in sort order.
+    """
+
+    def __init__(self, model, fields, spec=None, ordering=(), db=None):
+        self.model = model
+        self.fields = list(fields)
+        self.spec = spec or {}
+        self.ordering = tuple(ordering)
+        self.db = db
+        # The ordering keys are always read: the keyset paginator builds its
+        # cursors from them even when ``only()`` leaves them out
+        keys = [term.lstrip('-') for term in self.ordering]
+        self.reader = _reader(model, tuple(dict.fromkeys(self.fields + keys)))
+
+    def _clone(self, **changes):
+        state = {
+            'fields': self.fields,
+            'spec': self.spec,
+            'ordering': self.ordering,
+            'db': self.db,
+        }
+        state.update(changes)
+        return MongoQuery(self.model, **state)
+
+    def only(self, *fields):
+        """Narrow the projection to ``fields``, like ``QuerySet.only``"""
+        return self._clone(fields=fields)
+
+    def filter(self, *conditions, **lookups):
+        parts = [self._compile(condition) for condition in conditions]
+        parts += [self._compile_lookup(lookup, value) for lookup, value in lookups.items()]
+        if self.spec:
+            parts.insert(0, self.spec)
+        spec = parts[0] if len(parts) == 1 else {'$and': parts}
+        return self._clone(spec=spec)
+
+    def order_by(self, *terms):
+        return self._clone(ordering=terms)
+
+    def _compile(self, node):
+        if not isinstance(node, Q):
+            return self._compile_lookup(*node)
+        parts = [self._compile(child) for child in node.children]
+        if not parts:
+            spec = {}
+        elif len(parts) == 1:
+            spec = parts[0]
+        else:
+            spec = {'$or' if node.connector == Q.OR else '$and': parts}
+        return {'$nor': [spec]} if node.negated else spec
+
+    def _compile_lookup(self, lookup, value):
+        name, _, operator = lookup.partition('__')
+        field = self.model._meta.get_field(name)
+        if operator == 'in':
+            return {field.column: {'$in': [self._to_mongo(field, item) for item in value]}}
+        value = self._to_mongo(field, value)
+        if operator in ('', 'exact'):
+            return {field.column: value}
+        return {field.column: {MONGO_OPERATORS[operator]: value}}
+
+    @staticmethod
+    def _to_mongo(field, value):
+        value = field.to_python(value)
+        if isinstance(value, date) and not isinstance(value, datetime):
+            value = datetime.combine(value, time.min)
+        return value
+
+    def _sort(self):
+        return [
+            (self.model._meta.get_field(term.lstrip('-')).column, DESCENDING if term.startswith('-') else ASCENDING)
+            for term in self.ordering
+        ]
+
+    def _databases(self):
+        if self.db is not None:
+            return [self.db]
+        if self.model is Activity and is_sharded():
+            return [shard_db(alias) for alias in shards_for_spec(self.spec)]
+        return [get_read_db()]
+
+    def _cursor(self, db=None):
+        db = db if db is not None else self._databases()[0]
+        projection = {column: 1 for _, column, _ in self.reader.extractors}
+        cursor = db[self.model._meta.db_table].find(self.spec, projection=projection)
+        if self.ordering:
+            cursor = cursor.sort(self._sort())
+        return cursor
+
+    def to_representation(self, document):
+        return self.reader.to_representation(document)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('MongoQuery only supports slicing without a step')
+        databases = self._databases()
+        start = key.start or 0
+        if len(databases) != 1:
+            return self._gather(databases, start, key.stop)
+        cursor = self._cursor(databases[0])
+        if start:
+            cursor = cursor.skip(start)
+        if key.stop is not None:
+            cursor = cursor.limit(max(key.stop - start, 0))
+        return [self.to_representation(document) for document in cursor]
+
+    def _gather(self, databases, start, stop):
+        """Read a slice across shards: the first ``stop`` rows of each, merged"""
+        if stop is not None and stop <= start:
+            return []
+
+        def read(db):
+            cursor = self._cursor(db)
+            return list(cursor.limit(stop) if stop is not None else cursor)
+
+        documents = merge_sorted(scatter(read, databases), self._sort())
+        return [self.to_representation(document) for document in islice(documents, start, stop)]
+
+    def _documents(self, batch_size=None):
+        cursors = [self._cursor(db) for db in self._databases()]
+        if batch_size is not None:
+            cursors = [cursor.batch_size(batch_size) for cursor in cursors]
+        return merge_sorted(cursors, self._sort())
+
+    def __iter__(self):
+        return (self.to_representation(document) for document in self._documents())
+
+    def iterator(self, batch_size=2000):
+        """Iterate with an explicit cursor batch size, like ``QuerySet.iterator(chunk_size)``"""
+        return (self.to_representation(document) for document in self._documents(batch_size))
+
+    async def alist(self, limit=None):
+        """Read the results through a Motor database without blocking the event loop"""
+        cursor = self._cursor()
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return [self.to_representation(document) for document in await cursor.to_list(length=None)]
+
+
+class MongoRepository:
+    """Native pymongo reads for a model, shaped like its ModelSerializer"""
+    model = None
+    serializer_class = None
+    ordering = ('_id',)
+
+    def __init__(self, db=None):
+        self.db = db
+
+    def all(self):
+        return MongoQuery(
+            self.model,
+            self.serializer_class.Meta.fields,
+            ordering=self.ordering,
+            db=self.db,
+        )
+
+    def filter(self, *conditions, **lookups):
+        return self.all().filter(*conditions, **lookups)
+
+
+class UserRepository(MongoRepository):
+    model = User
+    serializer_class = UserSerializer
+
+    def by_team(self, team_id):
+        return self.filter(team_id=team_id)
+
+
+class TeamRepository(MongoRepository):
+    model = Team
+    serializer_class = TeamSerializer
+
+
+class ActivityRepository(MongoRepository):
+    model = Activity
+    serializer_class = ActivitySerializer
+    ordering = ('-date', '-_id')
+
+    def by_user(self, user_id):
+        return self.filter(user_id=user_id)
+
+
+class LeaderboardRepository(MongoRepository):
+    model = Leaderboard
+    serializer_class = LeaderboardSerializer
+    ordering = ('rank', '_id')
+
+    def by_team(self, team_id):
+        return self.filter(team_id=team_id)
+
+    def by_user(self, user_id):
+        return self.filter(user_id=user_id)
+
+    # Neighbours of an entry in (rank, _id) order. Tied ranks are broken by
+    # _id, as in the list endpoint, and each side is a range read on the
+    # rank index, so slicing k rows costs the same at any leaderboard size.
+
+    def above(self, entry):
+        """Entries before ``entry``, nearest first"""
+        rank, _id = entry['rank'], entry['_id']
+        return self.filter(Q(rank__lt=rank) | Q(rank=rank, _id__lt=_id)).order_by('-rank', '-_id')
+
+    def below(self, entry):
+        """Entries after ``entry``, nearest first"""
+        rank, _id = entry['rank'], entry['_id']
+        return self.filter(Q(rank__gt=rank) | Q(rank=rank, _id__gt=_id))
+
+
+class WorkoutRepository(MongoRepository):
+    model = Workout
+    serializer_class = WorkoutSerializer
+
+    def by_difficulty(self, difficulty):
+        return self.filter(difficulty=difficulty)
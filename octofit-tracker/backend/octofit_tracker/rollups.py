@@ -0,0 +1,157 @@
+"""
+Daily activity rollups.
+
+``user_daily_rollups`` holds one document per (user_id, date) and
+``team_daily_rollups`` one per (team_id, date). Each carries the summed
+duration, distance and calories plus an activity count, and the same
+figures per activity type under ``types``. Activity writes keep them
+current with ``$inc`` upserts; the rebuild_rollups command recomputes them
+from the activities collection.
+"""
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.utils.dateparse import parse_date
+from pymongo import UpdateOne
+
+from .models import User, UserDailyRollup, TeamDailyRollup
+from .mongo import get_db
+
+SUM_FIELDS = ('duration', 'distance', 'calories')
+
+
+def rollup_day(value):
+    """Normalise a date, datetime or ISO string to midnight, as djongo stores dates"""
+    if isinstance(value, str):
+        value = parse_date(value[:10])
+    if isinstance(value, datetime):
+        value = value.date()
+    return datetime.combine(value, time.min)
+
+
+def type_key(activity_type):
+    """Escape an activity type for use as a field name under ``types``"""
+    return activity_type.replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+
+def type_name(key):
+    """Reverse ``type_key``"""
+    return key.replace('%24', '$').replace('%2E', '.').replace('%25', '%')
+
+
+def _getter(activity):
+    """Field access for both model instances and raw activity documents"""
+    if isinstance(activity, dict):
+        return activity.get
+    return lambda name: getattr(activity, name)
+
+
+def increments(activity, sign=1):
+    """The ``$inc`` document that adds (or with ``sign=-1`` removes) one activity"""
+    get = _getter(activity)
+    prefix = f'types.{type_key(get("activity_type"))}'
+    inc = {'activities': sign, f'{prefix}.activities': sign}
+    for field in SUM_FIELDS:
+        inc[field] = sign * get(field)
+        inc[f'{prefix}.{field}'] = sign * get(field)
+    return inc
+
+
+def _merge(total, inc):
+    for field, value in inc.items():
+        total[field] = total.get(field, 0) + value
+
+
+def apply_rollups(changes, db=None):
+    """
+    Apply ``(activity, sign)`` pairs to both rollup collections with one
+    bulk ``$inc`` upsert per (user, day) and (team, day). Activities may be
+    model instances or raw documents; users without a team only count
+    towards their own rollups. Days whose count drops to zero are removed.
+    """
+    db = db if db is not None else get_db()
+    user_days = defaultdict(dict)
+    for activity, sign in changes:
+        get = _getter(activity)
+        _merge(user_days[(get('user_id'), rollup_day(get('date')))], increments(activity, sign))
+    if not user_days:
+        return
+
+    user_ids = {user_id for user_id, _ in user_days}
+    teams = {
+        user['_id']: user.get('team_id')
+        for user in db[User._meta.db_table].find({'_id': {'$in': list(user_ids)}}, {'team_id': 1})
+    }
+    team_days = defaultdict(dict)
+    for (user_id, day), inc in user_days.items():
+        if teams.get(user_id) is not None:
+            _merge(team_days[(teams[user_id], day)], inc)
+
+    _write(db[UserDailyRollup._meta.db_table], 'user_id', user_days)
+    _write(db[TeamDailyRollup._meta.db_table], 'team_id', team_days)
+
+
+def _write(collection, key, days):
+    operations = [
+        UpdateOne({key: owner, 'date': day}, {'$inc': inc}, upsert=True)
+        for (owner, day), inc in days.items()
+        if any(inc.values())
+    ]
+    if not operations:
+        return
+    collection.bulk_write(operations, ordered=False)
+
+    # Drop days, and activity types within a day, whose count reached zero
+    emptied = [{key: owner, 'date': day} for (owner, day), inc in days.items() if inc['activities'] < 0]
+    if emptied:
+        collection.delete_many({'$or': emptied, 'activities': {'$lte': 0}})
+    cleanups = [
+        UpdateOne({key: owner, 'date': day, field: {'$lte': 0}}, {'$unset': {field.rsplit('.', 1)[0]: ''}})
+        for (owner, day), inc in days.items()
+        for field, value in inc.items()
+        if field.startswith('types.') and field.endswith('.activities') and value < 0
+    ]
+    if cleanups:
+        collection.bulk_write(cleanups, ordered=False)
+
+
+def record_rollup_change(before=None, after=None, db=None):
+    """
+    Move an activity's totals between two versions of it, like
+    scoring.record_activity_change. ``before`` is None for a create and
+    ``after`` is None for a delete.
+    """
+    changes = []
+    if before is not None:
+        changes.append((before, -1))
+    if after is not None:
+        changes.append((after, 1))
+    apply_rollups(changes, db=db)
+
+
+def move_user_rollups(user_id, old_team_id, new_team_id, db=None):
+    """Re-attribute a user's daily totals when they change teams"""
+    if old_team_id == new_team_id:
+        return
+    db = db if db is not None else get_db()
+    days = db[UserDailyRollup._meta.db_table].find({'user_id': user_id}, {'_id': 0, 'user_id': 0})
+    team_days = defaultdict(dict)
+    for document in days:
+        day = document.pop('date')
+        inc = _flatten(document)
+        if old_team_id is not None:
+            _merge(team_days[(old_team_id, day)], {field: -value for field, value in inc.items()})
+        if new_team_id is not None:
+            _merge(team_days[(new_team_id, day)], inc)
+    _write(db[TeamDailyRollup._meta.db_table], 'team_id', team_days)
+
+
+def _flatten(document, prefix=''):
+    """Turn a rollup document's nested counters into dotted ``$inc`` paths"""
+    inc = {}
+    for field, value in document.items():
+        if isinstance(value, dict):
+            inc.update(_flatten(value, f'{prefix}{field}.'))
+        else:
+            inc[f'{prefix}{field}'] = value
+    return inc
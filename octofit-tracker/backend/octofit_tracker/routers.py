@@ -0,0 +1,205 @@
+"""
+Read/write splitting across the primary and read replicas.
+
+Each host in MONGO_READ_REPLICAS becomes a ``replicaN`` database alias
+(see settings.py). GET requests to a viewset whose read preference is
+``secondaryPreferred`` read from one of them -- through the ORM via
+ReadReplicaRouter, and through the direct pymongo and Motor paths via
+``get_read_db()`` -- while everything else uses the primary:
+
+- Writes always go to ``default``.
+- A replica whose replication lag exceeds DATABASE_MAX_REPLICA_LAG_SECONDS,
+  or that cannot be reached, is skipped. Lag is read from
+  ``replSetGetStatus`` at most every DATABASE_REPLICA_CHECK_SECONDS per
+  process. With no usable replica, reads fall back to the primary.
+- After a successful write, the client gets a signed cookie that sends its
+  reads to the primary for DATABASE_READ_YOUR_WRITES_SECONDS, so it reads
+  its own writes.
+
+Read preferences are per viewset: ``read_preference`` on the class,
+overridden by DATABASE_READ_PREFERENCES in settings. Code outside a
+request, such as the admin, management commands and the journal flusher,
+reads from the primary.
+
+To try it locally, run two mongod processes as a replica set:
+
+    mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0-a
+    mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0-b
+    mongosh --eval "rs.initiate({_id: 'rs0', members: [
+        {_id: 0, host: 'localhost:27017'}, {_id: 1, host: 'localhost:27018', priority: 0}]})"
+    MONGO_REPLICA_SET=rs0 MONGO_READ_REPLICAS=localhost:27018 python manage.py runserver
+"""
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+from pymongo.errors import OperationFailure, PyMongoError
+from rest_framework.permissions import SAFE_METHODS
+
+from .mongo import get_client, get_db
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'primary'
+SECONDARY_PREFERRED = 'secondaryPreferred'
+
+WRITE_COOKIE = 'octofit_primary_until'
+WRITE_COOKIE_SALT = 'octofit_tracker.routers'
+
+# replSetGetStatus on a server started without --replSet
+NO_REPLICATION_ENABLED = 76
+PRIMARY_STATE = 1
+
+_read_alias = ContextVar('octofit_read_alias', default=None)
+
+
+def read_alias():
+    """The alias the current request reads from; ``default`` outside a replica read"""
+    return _read_alias.get() or 'default'
+
+
+@contextmanager
+def reading_from(alias):
+    """Route reads in the block to ``alias``; None means the primary"""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def get_read_db():
+    """The pymongo Database reads in the current request go to"""
+    return get_db(read_alias())
+
+
+def replica_lag(alias):
+    """Seconds the replica's last applied write trails the primary's; None if unknown"""
+    try:
+        status = get_client(alias).admin.command('replSetGetStatus')
+    except OperationFailure as exc:
+        if exc.code == NO_REPLICATION_ENABLED:
+            # A standalone server, e.g. the primary itself in development
+            return 0.0
+        raise
+    members = status['members']
+    primary = next((member for member in members if member['state'] == PRIMARY_STATE), None)
+    member = next((member for member in members if member.get('self')), None)
+    if primary is None or member is None:
+        return None
+    return max((primary['optimeDate'] - member['optimeDate']).total_seconds(), 0.0)
+
+
+# alias -> (monotonic time of the last check, lag or None)
+_lags = {}
+_lags_lock = threading.Lock()
+
+
+def replica_is_fresh(alias):
+    """Whether ``alias`` is reachable and within the staleness bound"""
+    now = time.monotonic()
+    with _lags_lock:
+        checked_at, lag = _lags.get(alias, (None, None))
+        due = checked_at is None or now - checked_at >= settings.DATABASE_REPLICA_CHECK_SECONDS
+        if due:
+            # Other threads keep using the last result while this one checks
+            _lags[alias] = (now, lag)
+    if due:
+        try:
+            lag = replica_lag(alias)
+        except PyMongoError as exc:
+            logger.warning('Read replica %s is unavailable: %s', alias, exc)
+            lag = None
+        with _lags_lock:
+            _lags[alias] = (now, lag)
+    return lag is not None and lag <= settings.DATABASE_MAX_REPLICA_LAG_SECONDS
+
+
+def choose_replica():
+    """A fresh replica alias at random, or None to read from the primary"""
+    fresh = [alias for alias in settings.DATABASE_READ_REPLICAS if replica_is_fresh(alias)]
+    return random.choice(fresh) if fresh else None
+
+
+def wrote_recently(request):
+    """Whether the client made a write within DATABASE_READ_YOUR_WRITES_SECONDS"""
+    try:
+        until = float(request.get_signed_cookie(WRITE_COOKIE, salt=WRITE_COOKIE_SALT))
+    except (KeyError, ValueError, signing.BadSignature):
+        return False
+    return time.time() < until
+
+
+def remember_write(response):
+    """Send the client's reads to the primary until its write has replicated"""
+    seconds = settings.DATABASE_READ_YOUR_WRITES_SECONDS
+    response.set_signed_cookie(
+        WRITE_COOKIE, str(time.time() + seconds), salt=WRITE_COOKIE_SALT,
+        max_age=seconds, httponly=True, samesite='Lax'
+    )
+
+
+class ReadReplicaRouter:
+    """Sends ORM reads to the alias chosen for the request and writes to the primary"""
+
+    def db_for_read(self, model, **hints):
+        # None falls back to Django's default: the instance's database or default
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        aliases = {'default', *settings.DATABASE_READ_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_READ_REPLICAS:
+            return False
+        return None
+
+
+class ReadPreferenceMixin:
+    """
+    Serves safe requests from a read replica when the viewset's read
+    preference allows it. Mix in before CachedResponseMixin.
+    """
+    read_preference = PRIMARY
+
+    def get_read_preference(self):
+        return settings.DATABASE_READ_PREFERENCES.get(type(self).__name__, self.read_preference)
+
+    def get_read_alias(self, request):
+        """The replica alias to serve this request from, or None for the primary"""
+        if request.method not in SAFE_METHODS or not settings.DATABASE_READ_REPLICAS:
+            return None
+        if self.get_read_preference() != SECONDARY_PREFERRED or wrote_recently(request):
+            return None
+        return choose_replica()
+
+    def dispatch(self, request, *args, **kwargs):
+        with reading_from(self.get_read_alias(request)):
+            response = super().dispatch(request, *args, **kwargs)
+        if (request.method not in SAFE_METHODS and response.status_code < 400
+                and settings.DATABASE_READ_REPLICAS):
+            remember_write(response)
+        return response
+
+
+def _reset_after_fork():
+    global _lags_lock
+    _lags_lock = threading.Lock()
+    _lags.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .cache import invalidate
+from .events import publish_points
+from .models import User, Leaderboard
+from .mongo import get_db
+from .sequences import next_id
+
+logger = logging.getLogger(__name__)
+
+LOCKS = 'locks'
+RANK_LEASE = 'leaderboard_ranks'
+# A lease whose holder died is taken over after this long
+RANK_LEASE_SECONDS = 10
+RANK_LEASE_POLL_SECONDS = 0.005
+
+# Serializes rank adjustments between the threads of this process;
+# rank_lease serializes them between processes
+_rank_lock = threading.Lock()
+
+
+def activity_points(activity):
+    """Return the leaderboard points an activity is worth"""
+    return activity.calories
+
+
+def record_activity_change(before=None, after=None, db=None):
+    """
+    Apply the points change between two versions of an activity.
+
+    ``before`` is None for a create and ``after`` is None for a delete.
+    """
+    deltas = defaultdict(int)
+    if before is not None:
+        deltas[before.user_id] -= activity_points(before)
+    if after is not None:
+        deltas[after.user_id] += activity_points(after)
+    for user_id, delta in deltas.items():
+        apply_points(user_id, delta, db=db)
+
+
+def _acquire_lease(locks, token):
+    now = datetime.utcnow()
+    try:
+        # Matches only an expired lease; a missing one is upserted
+        lease = locks.find_one_and_update(
+            {'_id': RANK_LEASE, 'expires': {'$lt': now}},
+            {'$set': {'owner': token, 'expires': now + timedelta(seconds=RANK_LEASE_SECONDS)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Another process holds a lease that has not expired
+        return False
+    return lease['owner'] == token
+
+
+@contextmanager
+def rank_lease(db):
+    """
+    Hold the leaderboard rank lease, a document in the ``locks``
+    collection, so that one rank adjustment runs at a time across every
+    worker process. A holder that dies is taken over after
+    RANK_LEASE_SECONDS.
+    """
+    locks = db[LOCKS]
+    token = ObjectId()
+    with _rank_lock:
+        while not _acquire_lease(locks, token):
+            time.sleep(RANK_LEASE_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            locks.delete_one({'_id': RANK_LEASE, 'owner': token})
+
+
+def apply_points(user_id, delta, db=None):
+    """
+    Add ``delta`` points to a user's leaderboard row and shift the ranks
+    of only the rows it passes.
+
+    Ranks use competition ranking: 1 + the number of rows with more points.
+    """
+    if not delta:
+        return
+    db = db if db is not None else get_db()
+    leaderboard = db[Leaderboard._meta.db_table]
+
+    with rank_lease(db):
+        before = leaderboard.find_one_and_update(
+            {'user_id': user_id},
+            {'$inc': {'total_points': delta}},
+            projection={'_id': 1, 'team_id': 1, 'total_points': 1, 'rank': 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            entry = _insert_row(db, user_id, delta)
+            if entry is None:
+                return
+            invalidate(Leaderboard, user_id)
+            publish_points(entry, {'gte': None, 'lt': delta, 'by': 1})
+            return
+
+        old, new = before['total_points'], before['total_points'] + delta
+        low, high = min(old, new), max(old, new)
+        others = {'_id': {'$ne': before['_id']}}
+        shift = 1 if new > old else -1
+
+        # Rows between the old and new score move by one place
+        leaderboard.update_many(
+            dict(others, total_points={'$gte': low, '$lt': high}),
+            {'$inc': {'rank': shift}},
+        )
+        passed = leaderboard.count_documents(dict(others, total_points={'$gt': low, '$lte': high}))
+        leaderboard.update_one({'_id': before['_id']}, {'$inc': {'rank': -shift * passed}})
+    # Other rows' ranks moved too, so the whole leaderboard is expired
+    invalidate(Leaderboard, before['_id'])
+    entry = {
+        '_id': before['_id'],
+        'user_id': user_id,
+        'team_id': before.get('team_id'),
+        'total_points': new,
+        'rank': before['rank'] - shift * passed,
+    }
+    publish_points(entry, {'gte': low, 'lt': high, 'by': shift})
+
+
+def _insert_row(db, user_id, points):
+    """Insert and rank a user's first leaderboard row; None for a user without a team"""
+    leaderboard = db[Leaderboard._meta.db_table]
+    user = db[User._meta.db_table].find_one({'_id': user_id}, projection={'team_id': 1}) or {}
+    if user.get('team_id') is None:
+        # Leaderboard.team_id is required: no row for an unknown or teamless
+        # user; rebuild_leaderboard counts the points once it has a team
+        logger.warning('No leaderboard row for user %s, which is unknown or has no team', user_id)
+        return None
+    rank = 1 + leaderboard.count_documents({'total_points': {'$gt': points}})
+    leaderboard.update_many({'total_points': {'$lt': points}}, {'$inc': {'rank': 1}})
+    entry = {
+        '_id': next_id(Leaderboard, db=db),
+        'user_id': user_id,
+        'team_id': user['team_id'],
+        'total_points': points,
+        'rank': rank,
+    }
+    leaderboard.insert_one(entry)
+    return entry
@@ -0,0 +1,146 @@
+"""
+Indexed search over users, teams and workouts.
+
+Each searchable document has an entry in ``search_index`` holding every
+prefix (MIN_PREFIX to MAX_PREFIX characters) of every word of its indexed
+fields, under a multikey index. A query finds the entries that hold a
+prefix of each of its words with one index range scan on the longest
+word, instead of the unanchored ``icontains`` regex djongo runs over the
+whole collection. Matches are ranked by field weight, and a whole-word
+match counts double a prefix.
+
+ORM saves and deletes (the API and the admin) keep the entries current;
+rebuild_search_index recreates them after raw loads such as populate_db.
+"""
+import re
+from collections import namedtuple
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SearchEntry, Team, User, Workout
+from .mongo import get_db
+
+# ``weights`` maps each indexed field to how much a match in it counts
+SearchSource = namedtuple('SearchSource', ['model', 'weights', 'label'])
+
+SOURCES = {
+    'user': SearchSource(User, {'name': 3, 'email': 2}, 'name'),
+    'team': SearchSource(Team, {'name': 3, 'description': 1}, 'name'),
+    'workout': SearchSource(Workout, {'name': 3, 'description': 1}, 'name'),
+}
+KINDS = {source.model: kind for kind, source in SOURCES.items()}
+
+MIN_PREFIX = 2
+MAX_PREFIX = 15
+# Entries ranked per query; a very common prefix is ranked within this many
+CANDIDATES = 500
+
+_WORD = re.compile(r'\w+')
+
+
+def words(text):
+    """Lowercased words of a field value"""
+    return _WORD.findall(str(text).lower()) if text is not None else []
+
+
+def query_words(q):
+    """The distinct words of a query long enough to search for, longest first"""
+    return sorted({word for word in words(q) if len(word) >= MIN_PREFIX}, key=lambda word: (-len(word), word))
+
+
+def entry_document(kind, document):
+    """The search_index entry for a user, team or workout document"""
+    source = SOURCES[kind]
+    fields = {name: words(document.get(name)) for name in source.weights}
+    terms = {
+        word[:length]
+        for field_words in fields.values()
+        for word in field_words
+        for length in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1)
+    }
+    return {
+        'kind': kind,
+        'ref': document['_id'],
+        'label': str(document.get(source.label) or ''),
+        'terms': sorted(terms),
+        'words': fields,
+    }
+
+
+def index_document(kind, document, db=None):
+    """Create or replace the entry for one document"""
+    db = db if db is not None else get_db()
+    db[SearchEntry._meta.db_table].replace_one(
+        {'kind': kind, 'ref': document['_id']},
+        entry_document(kind, document),
+        upsert=True,
+    )
+
+
+def remove_document(kind, ref, db=None):
+    db = db if db is not None else get_db()
+    db[SearchEntry._meta.db_table].delete_one({'kind': kind, 'ref': ref})
+
+
+def score(entry, tokens):
+    """Rank an entry against the query words; 0 when a word matches nothing"""
+    weights = SOURCES[entry['kind']].weights
+    total = 0
+    for token in tokens:
+        best = 0
+        for field, field_words in entry['words'].items():
+            weight = weights.get(field, 0)
+            for word in field_words:
+                if word == token:
+                    best = max(best, 2 * weight)
+                elif word.startswith(token):
+                    best = max(best, weight)
+        if not best:
+            return 0
+        total += best
+    return total
+
+
+def find(q, kinds=None, limit=20, db=None):
+    """
+    Return up to ``limit`` ranked matches for ``q`` as dicts with ``type``,
+    ``_id``, ``label`` and ``score``, optionally only of the given kinds
+    """
+    tokens = query_words(q)
+    if not tokens:
+        return []
+    db = db if db is not None else get_db()
+    spec = {'terms': {'$all': [token[:MAX_PREFIX] for token in tokens]}}
+    if kinds is not None:
+        spec['kind'] = {'$in': list(kinds)}
+    entries = db[SearchEntry._meta.db_table].find(
+        spec, projection={'_id': 0, 'kind': 1, 'ref': 1, 'label': 1, 'words': 1}
+    ).limit(CANDIDATES)
+
+    results = []
+    for entry in entries:
+        # Words longer than MAX_PREFIX are checked in full here
+        entry_score = score(entry, tokens)
+        if entry_score:
+            results.append({'type': entry['kind'], '_id': entry['ref'], 'label': entry['label'], 'score': entry_score})
+    results.sort(key=lambda result: (-result['score'], len(result['label']), result['type'], result['_id']))
+    return results[:limit]
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Team)
+@receiver(post_save, sender=Workout)
+def index_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    kind = KINDS[sender]
+    fields = ('_id', *SOURCES[kind].weights)
+    index_document(kind, {name: getattr(instance, name) for name in fields})
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Team)
+@receiver(post_delete, sender=Workout)
+def remove_on_delete(sender, instance, **kwargs):
+    remove_document(KINDS[sender], instance._id)
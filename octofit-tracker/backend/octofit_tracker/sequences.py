@@ -0,0 +1,168 @@
+"""
+Server-side integer ids for the ``_id`` primary keys.
+
+Each collection has a document in the ``counters`` collection holding the
+highest id handed out so far. A process reserves ids in blocks of
+``ID_BLOCK_SIZE`` with one atomic ``find_one_and_update`` ``$inc`` and
+serves creates from its block in memory, so most creates cost no extra
+round trip and concurrent workers never receive the same id. Ids are
+unique and increasing per process, but not gapless: a worker that exits
+leaves the rest of its block unused.
+
+A counter that does not exist yet starts from the collection's highest
+``_id``, so data loaded by populate_db or with explicit ids is skipped.
+Explicit ids are still accepted; ``observe`` moves the counter past them.
+That cannot reach blocks other processes reserved earlier, so a create
+whose server-assigned id turns out to be taken drops its block and retries
+with an id from a fresh one (SequenceIdMixin).
+"""
+import os
+import threading
+
+from django.conf import settings
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .mongo import get_db
+from .sharding import collection_dbs
+
+COUNTERS = 'counters'
+
+DUPLICATE_KEY = 11000
+
+
+class Sequence:
+    """Block-allocated ids for one collection; safe to share between threads"""
+
+    def __init__(self, name, block_size):
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        # The reserved block is [_next, _end)
+        self._next = self._end = 0
+
+    def next(self, db=None):
+        """Return a new id, reserving a fresh block when this one is used up"""
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._allocate(self.block_size, db)
+            value = self._next
+            self._next += 1
+            return value
+
+    def reserve(self, count, db=None):
+        """Return a range of ``count`` new ids, for bulk loads"""
+        if count <= 0:
+            return range(0)
+        with self._lock:
+            if self._end - self._next >= count:
+                start = self._next
+                self._next += count
+                return range(start, start + count)
+        # Larger than what is left locally: a dedicated block
+        return range(*self._allocate(count, db))
+
+    def observe(self, value, db=None):
+        """Move the counter past an id the client chose, once it is written"""
+        db = db if db is not None else get_db()
+        result = db[COUNTERS].update_one({'_id': self.name}, {'$max': {'seq': value}})
+        if not result.matched_count:
+            self._seed(db, floor=value)
+        with self._lock:
+            if self._next <= value < self._end:
+                # Skip past it rather than hand it out again
+                self._next = value + 1
+
+    def reset(self):
+        """Forget the reserved block, e.g. after the counter was deleted or an id in it was taken"""
+        with self._lock:
+            self._next = self._end = 0
+
+    def _allocate(self, count, db=None):
+        db = db if db is not None else get_db()
+        counters = db[COUNTERS]
+        for _ in range(2):
+            counter = counters.find_one_and_update(
+                {'_id': self.name},
+                {'$inc': {'seq': count}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if counter is not None:
+                return counter['seq'] - count + 1, counter['seq'] + 1
+            self._seed(db)
+        raise RuntimeError(f'Could not create the {self.name} id counter')
+
+    def _seed(self, db, floor=0):
+        """Create the counter at the collection's highest _id, or ``floor``"""
+        start = floor
+        # Every shard of a sharded collection
+        for database in collection_dbs(self.name, db):
+            latest = database[self.name].find_one({}, projection={'_id': 1}, sort=[('_id', DESCENDING)])
+            if latest is not None and isinstance(latest['_id'], int):
+                start = max(start, latest['_id'])
+        try:
+            # $max keeps a counter another worker created in the meantime
+            db[COUNTERS].update_one({'_id': self.name}, {'$max': {'seq': start}}, upsert=True)
+        except DuplicateKeyError:
+            # Concurrent upserts of the same counter; the other one won
+            pass
+
+
+def is_duplicate_key(exc):
+    """Whether a duplicate key caused ``exc``; djongo wraps its insert's BulkWriteError"""
+    while exc is not None:
+        if isinstance(exc, DuplicateKeyError):
+            return True
+        if isinstance(exc, BulkWriteError):
+            return any(error['code'] == DUPLICATE_KEY for error in exc.details.get('writeErrors', ()))
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+_sequences = {}
+_sequences_lock = threading.Lock()
+
+
+def get_sequence(model):
+    """Return the process-wide Sequence for a model's collection"""
+    name = model._meta.db_table
+    sequence = _sequences.get(name)
+    if sequence is None:
+        with _sequences_lock:
+            sequence = _sequences.setdefault(name, Sequence(name, settings.ID_BLOCK_SIZE))
+    return sequence
+
+
+def next_id(model, db=None):
+    return get_sequence(model).next(db)
+
+
+def reserve_ids(model, count, db=None):
+    return get_sequence(model).reserve(count, db)
+
+
+def reset_sequences(db=None, models=None):
+    """
+    Delete the counters of ``models`` (default: all), so they restart from
+    the highest ``_id`` of their collection. Used after reloading data.
+    """
+    db = db if db is not None else get_db()
+    names = [model._meta.db_table for model in models] if models is not None else None
+    db[COUNTERS].delete_many({'_id': {'$in': names}} if names is not None else {})
+    for name, sequence in list(_sequences.items()):
+        if names is None or name in names:
+            sequence.reset()
+
+
+def _reset_after_fork():
+    # A forked worker must not hand out the parent's reserved block again.
+    # The locks are replaced, not taken: another thread may have held one.
+    global _sequences_lock
+    _sequences_lock = threading.Lock()
+    for sequence in _sequences.values():
+        sequence._lock = threading.Lock()
+        sequence._next = sequence._end = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
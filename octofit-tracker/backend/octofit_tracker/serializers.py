@@ -1,57 +1,321 @@
+from collections import namedtuple
+from datetime import date, datetime
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DatabaseError, models as django_models
+from django.urls import reverse
 from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import SAFE_METHODS
 from .models import User, Team, Activity, Leaderboard, Workout
+from .profiling import timed
+from .routers import get_read_db
+from .sequences import get_sequence, is_duplicate_key
+from .sharding import is_sharded, locate_activity
+
+# A related document that can be embedded with ``?expand=<name>``: rows of
+# ``model`` whose ``target`` field equals the instance's ``source`` field.
+# A ``many`` expansion embeds at most EXPAND_MANY_LIMIT rows, with their
+# total as ``<name>_count`` and, given ``url_name``, a link to the full
+# list as ``<name>_url``.
+Expansion = namedtuple(
+    'Expansion', ['source', 'model', 'target', 'serializer', 'many', 'url_name'], defaults=(None,)
+)
+
+
+def requested_fields(request, serializer_class):
+    """
+    Return the serializer fields named in ``?fields=``, in declaration
+    order, or None when the parameter is absent
+    """
+    value = request.query_params.get('fields') if request is not None else None
+    if value is None:
+        return None
+    allowed = serializer_class.Meta.fields
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise ParseError(
+            f"Unknown field(s): {', '.join(unknown) or '(none given)'}. "
+            f"Allowed: {', '.join(allowed)}"
+        )
+    return [name for name in allowed if name in names]
+
+
+class SparseFieldsMixin:
+    """Drops the fields not named in ``?fields=`` from read responses"""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return fields
+        names = requested_fields(request, type(self))
+        if names is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in names}
+
+
+# Attempts at a create whose server-assigned _id turns out to be taken
+ID_ATTEMPTS = 3
+
+
+class SequenceIdMixin:
+    """
+    Makes ``_id`` optional on create and assigns it from the model's
+    sequence when the client leaves it out. A client-chosen ``_id`` that
+    the insert finds taken is a validation error, not a server error.
+    """
+
+    def create(self, validated_data):
+        sequence = get_sequence(self.Meta.model)
+        if validated_data.get('_id') is None:
+            return self.create_with_next_id(sequence, validated_data)
+        try:
+            instance = super().create(validated_data)
+        except DatabaseError as exc:
+            if not is_duplicate_key(exc):
+                raise
+            raise serializers.ValidationError(
+                {'_id': [f'{self.Meta.model._meta.verbose_name} with this _id already exists.']}
+            )
+        sequence.observe(instance._id)
+        return instance
+
+    def create_with_next_id(self, sequence, validated_data):
+        for attempt in range(ID_ATTEMPTS):
+            validated_data['_id'] = sequence.next()
+            try:
+                return super().create(validated_data)
+            except DatabaseError as exc:
+                if not is_duplicate_key(exc) or attempt == ID_ATTEMPTS - 1:
+                    raise
+                # A client took an id of this block through another process,
+                # which moved the counter past it: reserve a fresh block
+                sequence.reset()
+
+
+class ProfiledListSerializer(serializers.ListSerializer):
+    """Counts a whole page towards the request's ``serialize`` phase"""
+
+    @timed('serialize')
+    def to_representation(self, data):
+        return super().to_representation(data)
+
 
+class ProfiledModelSerializer(SequenceIdMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    """Base serializer: server-assigned ids, sparse fieldsets and ``serialize`` phase timing"""
 
-class UserSerializer(serializers.ModelSerializer):
     class Meta:
-        model = User
-        fields = ['_id', 'name', 'email', 'team_id', 'role']
+        list_serializer_class = ProfiledListSerializer
+        extra_kwargs = {'_id': {'required': False}}
 
+    @timed('serialize')
     def to_representation(self, instance):
-        """Convert ObjectId fields to strings"""
-        representation = super().to_representation(instance)
-        return representation
+        return super().to_representation(instance)
+
 
+class ExpandListSerializer(ProfiledListSerializer):
+    """Resolves expansions for a whole page with one $in query per relation"""
+
+    @timed('serialize')
+    def to_representation(self, data):
+        instances = list(data.all() if hasattr(data, 'all') else data)
+        self.child.related = self.child.load_related(instances)
+        try:
+            return super().to_representation(instances)
+        finally:
+            self.child.related = None
+
+
+class ExpandableModelSerializer(ProfiledModelSerializer):
+    """ModelSerializer that embeds the related documents named in ``?expand=``"""
+    expansions = {}
+    related = None
 
-class TeamSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Team
-        fields = ['_id', 'name', 'description']
+        list_serializer_class = ExpandListSerializer
+
+    def get_expand(self):
+        request = self.context.get('request')
+        value = request.query_params.get('expand', '') if request is not None else ''
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.expansions]
+        if unknown:
+            raise ParseError(
+                f"Unknown expand value(s): {', '.join(unknown)}. "
+                f"Allowed: {', '.join(self.expansions)}"
+            )
+        return names
+
+    def load_related(self, instances):
+        """
+        Fetch and serialize the requested related rows for ``instances``:
+        ``{name: {key: rows}}``, and for a ``many`` expansion
+        ``{name: {key: (rows, count)}}``
+        """
+        related = {}
+        for name in self.get_expand():
+            expansion = self.expansions[name]
+            keys = {getattr(instance, expansion.source) for instance in instances}
+            if expansion.many:
+                related[name] = self.load_many(expansion, keys)
+                continue
+            rows = expansion.model.objects.filter(**{f'{expansion.target}__in': keys})
+            related[name] = {getattr(row, expansion.target): expansion.serializer(row).data for row in rows}
+        return related
+
+    @staticmethod
+    def load_many(expansion, keys):
+        """
+        The first EXPAND_MANY_LIMIT rows by _id and the row count for each
+        key. One aggregation reads just the ids and counts, then one $in
+        query loads the rows kept, so a key with thousands of rows costs
+        no more to embed than one with a few.
+        """
+        column = expansion.model._meta.get_field(expansion.target).column
+        groups = get_read_db()[expansion.model._meta.db_table].aggregate([
+            {'$match': {column: {'$in': list(keys)}}},
+            {'$sort': {'_id': 1}},
+            {'$group': {'_id': f'${column}', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$project': {'ids': {'$slice': ['$ids', settings.EXPAND_MANY_LIMIT]}, 'count': 1}},
+        ])
+        counts, ids = {}, []
+        for group in groups:
+            counts[group['_id']] = group['count']
+            ids.extend(group['ids'])
+        grouped = {key: ([], count) for key, count in counts.items()}
+        for row in expansion.model.objects.filter(_id__in=ids).order_by('_id'):
+            grouped[getattr(row, expansion.target)][0].append(expansion.serializer(row).data)
+        return grouped
 
     def to_representation(self, instance):
-        """Convert ObjectId fields to strings"""
         representation = super().to_representation(instance)
+        related = self.related if self.related is not None else self.load_related([instance])
+        for name, rows in related.items():
+            expansion = self.expansions[name]
+            key = getattr(instance, expansion.source)
+            if not expansion.many:
+                representation[name] = rows.get(key)
+                continue
+            representation[name], representation[f'{name}_count'] = rows.get(key, ([], 0))
+            if expansion.url_name:
+                representation[f'{name}_url'] = self.related_url(expansion.url_name, instance)
         return representation
 
+    def related_url(self, url_name, instance):
+        url = reverse(url_name, args=[instance.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
 
-class ActivitySerializer(serializers.ModelSerializer):
-    class Meta:
+
+class UserSerializer(ProfiledModelSerializer):
+    class Meta(ProfiledModelSerializer.Meta):
+        model = User
+        fields = ['_id', 'name', 'email', 'team_id', 'role']
+
+
+class TeamSerializer(ExpandableModelSerializer):
+    expansions = {
+        'members': Expansion('_id', User, 'team_id', UserSerializer, many=True, url_name='team-members'),
+    }
+
+    class Meta(ExpandableModelSerializer.Meta):
+        model = Team
+        fields = ['_id', 'name', 'description']
+
+
+class ActivitySerializer(ProfiledModelSerializer):
+    class Meta(ProfiledModelSerializer.Meta):
         model = Activity
         fields = ['_id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date']
+        # The _id index is per shard: validate__id checks every shard instead
+        extra_kwargs = {'_id': {'required': False, 'validators': []}}
 
-    def to_representation(self, instance):
-        """Convert ObjectId fields to strings"""
-        representation = super().to_representation(instance)
-        return representation
+    def validate__id(self, value):
+        if value is None or (self.instance is not None and self.instance._id == value):
+            return value
+        # Unsharded, the insert itself rejects a taken _id (SequenceIdMixin)
+        if is_sharded() and locate_activity(value) is not None:
+            raise serializers.ValidationError('activity with this _id already exists.')
+        return value
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
-    class Meta:
+class LeaderboardSerializer(ExpandableModelSerializer):
+    expansions = {
+        'user': Expansion('user_id', User, '_id', UserSerializer, many=False),
+        'team': Expansion('team_id', Team, '_id', TeamSerializer, many=False),
+    }
+
+    class Meta(ExpandableModelSerializer.Meta):
         model = Leaderboard
         fields = ['_id', 'user_id', 'team_id', 'total_points', 'rank']
 
-    def to_representation(self, instance):
-        """Convert ObjectId fields to strings"""
-        representation = super().to_representation(instance)
-        return representation
-
 
-class WorkoutSerializer(serializers.ModelSerializer):
-    class Meta:
+class WorkoutSerializer(ProfiledModelSerializer):
+    class Meta(ProfiledModelSerializer.Meta):
         model = Workout
         fields = ['_id', 'name', 'description', 'difficulty', 'duration']
 
-    def to_representation(self, instance):
-        """Convert ObjectId fields to strings"""
-        representation = super().to_representation(instance)
-        return representation
+
+def _date_representation(value):
+    # djongo stores dates as midnight datetimes; documents written before
+    # migrate_activity_dates may hold strings
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _field_converter(field):
+    """Return the function that renders a stored value like the serializer field does"""
+    if isinstance(field, django_models.DateField):
+        return _date_representation
+    if isinstance(field, (django_models.IntegerField, django_models.AutoField)):
+        return int
+    if isinstance(field, django_models.FloatField):
+        return float
+    return str
+
+
+class FastReadSerializer:
+    """
+    Read-only counterpart of a ModelSerializer for list responses.
+
+    Renders ``.values()`` rows or raw MongoDB documents to plain dicts with
+    one precompiled extractor per field, skipping DRF's per-row field
+    objects. The output matches the ModelSerializer's representation.
+    """
+
+    def __init__(self, model, fields):
+        self.fields = list(fields)
+        self.extractors = []
+        for name in self.fields:
+            field = model._meta.get_field(name)
+            self.extractors.append((name, field.column, _field_converter(field)))
+
+    def to_representation(self, row):
+        get = row.get
+        return {
+            name: None if (value := get(column)) is None else convert(value)
+            for name, column, convert in self.extractors
+        }
+
+    @timed('serialize')
+    def many(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+def fast_serializer(serializer_class, fields=None):
+    """
+    Return the cached FastReadSerializer for a ModelSerializer class,
+    optionally limited to a subset of its fields
+    """
+    return _fast_serializer(serializer_class, tuple(fields or serializer_class.Meta.fields))
+
+
+@lru_cache(maxsize=None)
+def _fast_serializer(serializer_class, fields):
+    return FastReadSerializer(serializer_class.Meta.model, fields)
@@ -53,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its total and Server-Timing header cover the whole request
+    'octofit_tracker.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -87,17 +89,143 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# One pooled MongoClient per process is shared by djongo, the management
+# commands and the direct pymongo read paths (see octofit_tracker/mongo.py).
+MONGO_CLIENT = {
+    'host': os.environ.get('MONGO_HOST', 'localhost'),
+    'port': int(os.environ.get('MONGO_PORT', 27017)),
+    'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+    'waitQueueTimeoutMS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+    'connectTimeoutMS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+    'serverSelectionTimeoutMS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+}
+# With a replica set, default follows the primary wherever it is elected
+if os.environ.get('MONGO_REPLICA_SET'):
+    MONGO_CLIENT['replicaSet'] = os.environ['MONGO_REPLICA_SET']
+
 DATABASES = {
     'default': {
-        'ENGINE': 'djongo',
+        'ENGINE': 'octofit_tracker.mongo_backend',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
-        'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
-        }
+        'CLIENT': MONGO_CLIENT,
+    }
+}
+
+# Read replicas (see octofit_tracker/routers.py). Each comma-separated
+# host:port in MONGO_READ_REPLICAS is added as a replicaN alias connected
+# directly to that secondary. GETs to the viewsets marked secondaryPreferred
+# in DATABASE_READ_PREFERENCES read from a replica lagging the primary by at
+# most DATABASE_MAX_REPLICA_LAG_SECONDS (checked every
+# DATABASE_REPLICA_CHECK_SECONDS); a client's reads go to the primary for
+# DATABASE_READ_YOUR_WRITES_SECONDS after each of its writes.
+DATABASE_READ_REPLICAS = []
+for _index, _address in enumerate(filter(None, os.environ.get('MONGO_READ_REPLICAS', '').split(',')), start=1):
+    _host, _, _port = _address.strip().partition(':')
+    DATABASES[f'replica{_index}'] = dict(
+        DATABASES['default'],
+        CLIENT=dict(
+            {key: value for key, value in MONGO_CLIENT.items() if key != 'replicaSet'},
+            host=_host, port=int(_port or 27017),
+            directConnection=True, readPreference='secondaryPreferred',
+        ),
+        # Tests read the test database through the replica aliases
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_READ_REPLICAS.append(f'replica{_index}')
+
+# Activity sharding (see octofit_tracker/sharding.py). Each comma-separated
+# host:port[/name] in MONGO_ACTIVITY_SHARDS is added as an activitiesN alias,
+# or names the default database when it is "default", and activities are
+# spread across them by a hash of user_id. Without it they stay on default.
+# Run rebalance_activities after changing the list or its order.
+ACTIVITY_SHARDS = []
+for _index, _address in enumerate(filter(None, os.environ.get('MONGO_ACTIVITY_SHARDS', '').split(',')), start=1):
+    _address = _address.strip()
+    if _address == 'default':
+        ACTIVITY_SHARDS.append('default')
+        continue
+    _address, _, _name = _address.partition('/')
+    _host, _, _port = _address.partition(':')
+    DATABASES[f'activities{_index}'] = dict(
+        DATABASES['default'],
+        NAME=_name or DATABASES['default']['NAME'],
+        CLIENT=dict(
+            {key: value for key, value in MONGO_CLIENT.items() if key != 'replicaSet'},
+            host=_host, port=int(_port or 27017),
+        ),
+    )
+    ACTIVITY_SHARDS.append(f'activities{_index}')
+ACTIVITY_SHARDS = ACTIVITY_SHARDS or ['default']
+# Threads per process for reading and writing the shards in parallel
+ACTIVITY_SHARD_WORKERS = int(os.environ.get('ACTIVITY_SHARD_WORKERS', 4 * len(ACTIVITY_SHARDS)))
+
+DATABASE_ROUTERS = [
+    'octofit_tracker.sharding.ActivityShardRouter',
+    'octofit_tracker.routers.ReadReplicaRouter',
+]
+DATABASE_READ_PREFERENCES = {
+    'UserViewSet': 'secondaryPreferred',
+    'TeamViewSet': 'secondaryPreferred',
+    'ActivityViewSet': 'secondaryPreferred',
+    'LeaderboardViewSet': 'secondaryPreferred',
+    'WorkoutViewSet': 'secondaryPreferred',
+}
+DATABASE_MAX_REPLICA_LAG_SECONDS = float(os.environ.get('DATABASE_MAX_REPLICA_LAG_SECONDS', 10))
+DATABASE_REPLICA_CHECK_SECONDS = float(os.environ.get('DATABASE_REPLICA_CHECK_SECONDS', 5))
+DATABASE_READ_YOUR_WRITES_SECONDS = int(os.environ.get(
+    'DATABASE_READ_YOUR_WRITES_SECONDS', max(int(DATABASE_MAX_REPLICA_LAG_SECONDS), 1)
+))
+
+# Django REST Framework
+# Keyset pagination keeps list endpoints on an index range scan instead of
+# returning whole collections in one response.
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Response cache for read-heavy API endpoints (see octofit_tracker/cache.py).
+# locmem is per process; point API_CACHE_ALIAS at a shared backend such as
+# file-based or Redis caching when running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-api',
     }
 }
+API_CACHE_ALIAS = 'default'
+API_CACHE_TIMEOUT = int(os.environ.get('API_CACHE_TIMEOUT', 300))
+
+# ?expand= of a one-to-many relation, such as a team's members, embeds at
+# most this many rows per object; the rest are paged through the relation's
+# own endpoint
+EXPAND_MANY_LIMIT = int(os.environ.get('EXPAND_MANY_LIMIT', 25))
+
+# Server-assigned _id values are reserved from the counters collection this
+# many at a time per process (see octofit_tracker/sequences.py)
+ID_BLOCK_SIZE = int(os.environ.get('ID_BLOCK_SIZE', 100))
+
+# Admin changelists on large collections (see octofit_tracker/admin_performance.py):
+# how long filter choices and date hierarchy links are cached, and how many
+# matches a filtered changelist counts and pages through
+ADMIN_CACHE_TIMEOUT = int(os.environ.get('ADMIN_CACHE_TIMEOUT', 600))
+ADMIN_EXACT_COUNT_LIMIT = int(os.environ.get('ADMIN_EXACT_COUNT_LIMIT', 10000))
+
+# Write-behind activity logging (see octofit_tracker/journal.py): when enabled,
+# creates sent with "Prefer: respond-async" are journaled to ACTIVITY_JOURNAL_DIR
+# and answered 202, then written to MongoDB in batches of up to
+# ACTIVITY_JOURNAL_FLUSH_RECORDS at least every ACTIVITY_JOURNAL_FLUSH_MS
+ACTIVITY_WRITE_BEHIND = os.environ.get('ACTIVITY_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+ACTIVITY_JOURNAL_DIR = os.environ.get('ACTIVITY_JOURNAL_DIR', str(BASE_DIR / 'journal'))
+ACTIVITY_JOURNAL_FLUSH_MS = int(os.environ.get('ACTIVITY_JOURNAL_FLUSH_MS', 50))
+ACTIVITY_JOURNAL_FLUSH_RECORDS = int(os.environ.get('ACTIVITY_JOURNAL_FLUSH_RECORDS', 500))
 
 # CORS Settings
 CORS_ALLOW_ALL_ORIGINS = True
@@ -0,0 +1,233 @@
+"""
+Horizontal partitioning of the activities collection by user_id.
+
+ACTIVITY_SHARDS lists the database aliases activities are spread across
+(settings.py builds it from MONGO_ACTIVITY_SHARDS; by default it is just
+``default``). An activity lives on ``shard_for(user_id)``: a CRC-32 of the
+user id modulo the number of shards, so every activity of a user is on one
+shard and every process agrees on which. Users, teams, the leaderboard,
+the rollups and the id counters stay on ``default``, so activity ids remain
+globally unique and stats keep reading the rollups there.
+
+- A read that pins user_id, such as ``ActivityViewSet.by_user``, goes to
+  that user's shard only.
+- Other reads scatter to every shard in parallel on a thread pool and
+  merge the results in their sort order: a page of N rows reads at most
+  N rows from each shard.
+- ORM writes go to the shard of the instance's user_id (ActivityShardRouter).
+  ORM reads need ``.using(alias)``; ``locate_activity`` finds the shard of
+  an id for the detail routes and the admin. An ORM activity query that
+  names no shard raises ShardRequired rather than reading one shard, or a
+  read replica of one, as if it held every activity.
+
+Changing the shard list, including its order, moves most activities to
+another shard: run rebalance_activities after deploying the new list.
+"""
+import heapq
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain
+
+from django.conf import settings
+from pymongo import ASCENDING
+
+from .models import Activity
+from .mongo import get_db
+
+ACTIVITIES = Activity._meta.db_table
+
+
+def is_sharded():
+    """Whether activities live anywhere but the default database"""
+    return list(settings.ACTIVITY_SHARDS) != ['default']
+
+
+def shard_for(user_id, aliases=None):
+    """The alias holding a user's activities"""
+    aliases = aliases if aliases is not None else settings.ACTIVITY_SHARDS
+    return aliases[zlib.crc32(str(user_id).encode('utf-8')) % len(aliases)]
+
+
+def shard_db(alias, db=None):
+    """The Database of a shard; ``db`` stands in for the default database"""
+    return db if db is not None and alias == 'default' else get_db(alias)
+
+
+def shard_dbs(aliases=None, db=None):
+    """``(alias, Database)`` for each shard"""
+    aliases = aliases if aliases is not None else settings.ACTIVITY_SHARDS
+    return [(alias, shard_db(alias, db)) for alias in aliases]
+
+
+def collection_dbs(name, db=None):
+    """Every Database holding part of the collection ``name``"""
+    if name == ACTIVITIES:
+        return [database for _, database in shard_dbs(db=db)]
+    return [db if db is not None else get_db()]
+
+
+def _conjuncts(spec):
+    yield spec
+    for part in spec.get('$and', ()):
+        yield from _conjuncts(part)
+
+
+def shards_for_spec(spec):
+    """The shards a find with ``spec`` can match: one when it pins user_id"""
+    aliases = set(settings.ACTIVITY_SHARDS)
+    for condition in _conjuncts(spec):
+        if 'user_id' not in condition:
+            continue
+        value = condition['user_id']
+        if not isinstance(value, dict):
+            aliases &= {shard_for(value)}
+        elif '$in' in value:
+            aliases &= {shard_for(user_id) for user_id in value['$in']}
+    return [alias for alias in settings.ACTIVITY_SHARDS if alias in aliases]
+
+
+def group_by_shard(documents):
+    """``{alias: [index, ...]}`` of activity documents, by their user_id"""
+    groups = {}
+    for index, document in enumerate(documents):
+        groups.setdefault(shard_for(document['user_id']), []).append(index)
+    return groups
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def scatter(function, items):
+    """
+    ``[function(item) for item in items]``, run in parallel on the shard
+    thread pool. A single item runs inline. ``function`` must not scatter.
+    """
+    global _executor
+    items = list(items)
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ACTIVITY_SHARD_WORKERS, thread_name_prefix='activity-shard'
+                )
+    return list(_executor.map(function, items))
+
+
+def _bson_key(value):
+    # MongoDB's order across the types sort keys hold: null, numbers,
+    # strings, booleans, dates
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (4, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (5, value)
+    return (3, str(value))
+
+
+class _Descending:
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+def _lookup(document, path):
+    for name in path.split('.'):
+        document = document.get(name) if isinstance(document, dict) else None
+    return document
+
+
+def sort_key(sort):
+    """A key function ordering documents as the pymongo ``sort`` list does"""
+    def key(document):
+        return tuple(
+            _bson_key(_lookup(document, column)) if direction == ASCENDING
+            else _Descending(_bson_key(_lookup(document, column)))
+            for column, direction in sort
+        )
+    return key
+
+
+def merge_sorted(streams, sort):
+    """Merge per-shard streams, each already in ``sort`` order, lazily"""
+    streams = list(streams)
+    if len(streams) == 1:
+        return iter(streams[0])
+    if not sort:
+        return chain.from_iterable(streams)
+    return heapq.merge(*streams, key=sort_key(sort))
+
+
+def locate_activity(_id, db=None):
+    """The alias of the shard holding activity ``_id``, or None"""
+    def find(shard):
+        alias, database = shard
+        return alias if database[ACTIVITIES].find_one({'_id': _id}, projection={'_id': 1}) else None
+    return next((alias for alias in scatter(find, shard_dbs(db=db)) if alias is not None), None)
+
+
+class ShardRequired(Exception):
+    """An ORM activity query that names no shard while activities are sharded"""
+
+
+class ActivityShardRouter:
+    """
+    Routes activity instances to the shard of their user_id. Listed before
+    ReadReplicaRouter, which would otherwise send an activity read to a
+    replica of ``default``.
+    """
+
+    def _shard(self, model, hints):
+        if model is not Activity or not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if instance is None:
+            raise ShardRequired(
+                'Activities are sharded: query them with ActivityRepository, or pick '
+                'a shard with .using(alias) (see sharding.locate_activity)'
+            )
+        return instance
+
+    def db_for_read(self, model, **hints):
+        instance = self._shard(model, hints)
+        if instance is None:
+            return None
+        return instance._state.db or shard_for(instance.user_id)
+
+    def db_for_write(self, model, **hints):
+        instance = self._shard(model, hints)
+        return shard_for(instance.user_id) if instance is not None else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shard databases only hold activities
+        if db != 'default' and db in settings.ACTIVITY_SHARDS:
+            return app_label == Activity._meta.app_label and model_name == Activity._meta.model_name
+        return None
+
+
+def _reset_after_fork():
+    # The pool's threads belong to the parent
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,96 @@
+"""
+Server-Sent Events streams, served directly by the ASGI application.
+
+Django 4.1 iterates streaming responses synchronously, so a long-lived
+stream would hold the event loop or a thread. asgi.py routes the paths in
+``STREAMS`` here instead: an open stream is a broker subscription plus
+two small coroutines, with no thread or database connection, and an idle
+one only wakes for a keepalive comment.
+
+    GET /api/leaderboard/stream/?team_id=1   points and rank deltas
+    GET /api/activities/stream/?user_id=1    created/updated/deleted activities
+
+Both also send ``reset`` when the client should refetch the collection.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from .events import ACTIVITIES, LEADERBOARD, broker
+
+KEEPALIVE_SECONDS = 15
+RETRY_MILLISECONDS = 5000
+
+# path -> (broker topic, query parameter selecting the subscription key)
+STREAMS = {
+    '/api/leaderboard/stream/': (LEADERBOARD, 'team_id'),
+    '/api/activities/stream/': (ACTIVITIES, 'user_id'),
+}
+
+
+def _headers(scope, content_type):
+    headers = [
+        (b'content-type', content_type),
+        (b'cache-control', b'no-cache'),
+        # Stop nginx and similar proxies from buffering the stream
+        (b'x-accel-buffering', b'no'),
+    ]
+    # The React app reads the streams cross-origin, like the REST API
+    origin = dict(scope['headers']).get(b'origin')
+    if getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False):
+        headers.append((b'access-control-allow-origin', b'*'))
+    elif origin and origin.decode('latin-1') in getattr(settings, 'CORS_ALLOWED_ORIGINS', ()):
+        headers.append((b'access-control-allow-origin', origin))
+    return headers
+
+
+async def _error(scope, send, status, message):
+    await send({'type': 'http.response.start', 'status': status, 'headers': _headers(scope, b'application/json')})
+    await send({'type': 'http.response.body', 'body': json.dumps({'error': message}).encode('utf-8')})
+
+
+async def _pump(subscription, send):
+    """Forward the subscription's frames, with a keepalive comment when idle"""
+    await send({'type': 'http.response.body', 'body': b'retry: %d\n\n' % RETRY_MILLISECONDS, 'more_body': True})
+    while True:
+        try:
+            frame = await asyncio.wait_for(subscription.get(), KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            frame = b': keepalive\n\n'
+        await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+
+
+async def stream(scope, receive, send):
+    """ASGI application for one of the ``STREAMS`` paths"""
+    topic, key_param = STREAMS[scope['path']]
+    if scope['method'] != 'GET':
+        return await _error(scope, send, 405, f"Method \"{scope['method']}\" not allowed.")
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    key = None
+    if query.get(key_param):
+        try:
+            key = int(query[key_param][-1])
+        except ValueError:
+            return await _error(scope, send, 400, f'{key_param} must be an integer')
+
+    subscription = broker.subscribe(topic, key)
+    await send({'type': 'http.response.start', 'status': 200, 'headers': _headers(scope, b'text/event-stream')})
+    pump = asyncio.ensure_future(_pump(subscription, send))
+    try:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    finally:
+        subscription.close()
+        pump.cancel()
+        await asyncio.gather(pump, return_exceptions=True)
+
+
+def route_streams(application):
+    """Wrap the Django ASGI application so the ``STREAMS`` paths are served here"""
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in STREAMS:
+            return await stream(scope, receive, send)
+        return await application(scope, receive, send)
+    return router
@@ -0,0 +1,73 @@
+from datetime import datetime, time, timedelta
+
+from .models import UserDailyRollup, TeamDailyRollup
+from .routers import get_read_db
+from .rollups import SUM_FIELDS
+
+# $dateToString formats for each supported grouping period
+PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+    'month': '%Y-%m',
+}
+
+
+def _bucket_stages(period, start=None, end=None):
+    """
+    Stages that reduce daily rollup documents to one document per period,
+    so a range of months reads one row per active day rather than every
+    activity.
+    """
+    date_range = {}
+    if start is not None:
+        date_range['$gte'] = datetime.combine(start, time.min)
+    if end is not None:
+        date_range['$lt'] = datetime.combine(end + timedelta(days=1), time.min)
+
+    stages = []
+    if date_range:
+        stages.append({'$match': {'date': date_range}})
+    group = {'_id': {'$dateToString': {'format': PERIOD_FORMATS[period], 'date': '$date'}}}
+    group.update({field: {'$sum': f'${field}'} for field in SUM_FIELDS + ('activities',)})
+    stages.append({'$group': group})
+    return stages
+
+
+def _summary_stages():
+    """Merge per-period documents into sorted buckets and overall totals"""
+    sums = {field: {'$sum': f'${field}'} for field in SUM_FIELDS + ('activities',)}
+    return [{'$facet': {
+        'buckets': [{'$group': dict(_id='$_id', **sums)}, {'$sort': {'_id': 1}}],
+        'totals': [{'$group': dict(_id=None, **sums)}],
+    }}]
+
+
+def _format(result):
+    empty = dict.fromkeys(SUM_FIELDS + ('activities',), 0)
+    totals = result['totals'][0] if result['totals'] else dict(empty)
+    totals.pop('_id', None)
+    buckets = []
+    for bucket in result['buckets']:
+        period = bucket.pop('_id')
+        buckets.append(dict(period=period, **bucket))
+    return {'totals': totals, 'buckets': buckets}
+
+
+def user_stats(user_id, period='day', start=None, end=None, db=None):
+    """Sum a user's activity duration, distance and calories per period"""
+    db = db if db is not None else get_read_db()
+    pipeline = [{'$match': {'user_id': user_id}}]
+    pipeline += _bucket_stages(period, start, end)
+    pipeline += _summary_stages()
+    result = next(db[UserDailyRollup._meta.db_table].aggregate(pipeline))
+    return _format(result)
+
+
+def team_stats(team_id, period='day', start=None, end=None, db=None):
+    """Sum the activities of every team member per period"""
+    db = db if db is not None else get_read_db()
+    pipeline = [{'$match': {'team_id': team_id}}]
+    pipeline += _bucket_stages(period, start, end)
+    pipeline += _summary_stages()
+    result = next(db[TeamDailyRollup._meta.db_table].aggregate(pipeline))
+    return _format(result)
@@ -0,0 +1,119 @@
+"""
+Vectorized synthetic data for load testing (``populate_db --users ...``).
+
+Every batch is generated from its own RNG stream derived from the seed and
+the batch index, so batches can be produced in any order, in parallel, or
+again after an interruption and still yield identical documents.
+"""
+from datetime import date, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is only needed for synthetic data
+    np = None
+
+# activity type, share of activities, median minutes, km per minute, kcal per minute
+ACTIVITY_PROFILES = [
+    ('Running', 0.30, 40, 0.17, 11.0),
+    ('Cycling', 0.25, 60, 0.40, 8.0),
+    ('Walking', 0.15, 45, 0.09, 4.5),
+    ('Weight Training', 0.12, 50, 0.0, 6.0),
+    ('Swimming', 0.10, 35, 0.05, 9.0),
+    ('Martial Arts', 0.08, 60, 0.0, 10.0),
+]
+
+USERS, TEAMS, ACTIVITIES = 1, 2, 3
+HISTORY_DAYS = 365
+
+
+class SyntheticDataset:
+    """Skewed users/teams/activities generated batch by batch with NumPy"""
+
+    def __init__(self, users, teams, activities, seed=42, end_date=None):
+        if np is None:
+            raise ImportError('NumPy is required to generate synthetic data (pip install numpy)')
+        self.users = users
+        self.teams = teams
+        self.activities = activities
+        self.seed = seed
+        self.end_date = end_date or date.today()
+
+        rng = np.random.default_rng([seed, 0])
+        # Team sizes follow a Zipf-like curve: a few huge teams, a long tail
+        self.team_cdf = self._cdf(1.0 / np.arange(1, teams + 1) ** 0.8) if teams else None
+        # Heavy-tailed activity levels: most users log little, a few log a lot
+        self.user_cdf = self._cdf(rng.lognormal(0.0, 1.2, users)) if users else None
+        self.type_cdf = self._cdf(np.array([profile[1] for profile in ACTIVITY_PROFILES]))
+        self.type_names = np.array([profile[0] for profile in ACTIVITY_PROFILES], dtype=object)
+        self.type_minutes = np.array([profile[2] for profile in ACTIVITY_PROFILES], dtype=float)
+        self.type_speed = np.array([profile[3] for profile in ACTIVITY_PROFILES])
+        self.type_kcal = np.array([profile[4] for profile in ACTIVITY_PROFILES])
+
+    @staticmethod
+    def _cdf(weights):
+        cdf = np.cumsum(weights, dtype=float)
+        return cdf / cdf[-1]
+
+    def _rng(self, kind, batch):
+        return np.random.default_rng([self.seed, kind, batch])
+
+    @staticmethod
+    def _sample(rng, cdf, size):
+        """Draw 0-based indices from a cumulative distribution in O(size log n)"""
+        return np.searchsorted(cdf, rng.random(size), side='right')
+
+    def team_documents(self):
+        return [
+            {'_id': _id, 'name': f'Team {_id}', 'description': f'Synthetic team number {_id}'}
+            for _id in range(1, self.teams + 1)
+        ]
+
+    def user_documents(self, batch, batch_size):
+        first = batch * batch_size + 1
+        ids = np.arange(first, min(first + batch_size, self.users + 1))
+        rng = self._rng(USERS, batch)
+        if self.teams:
+            team_ids = (self._sample(rng, self.team_cdf, len(ids)) + 1).tolist()
+        else:
+            team_ids = [None] * len(ids)
+        return [
+            {
+                '_id': _id,
+                'name': f'User {_id}',
+                'email': f'user{_id}@octofit.example',
+                'team_id': team_id,
+                'role': 'member',
+            }
+            for _id, team_id in zip(ids.tolist(), team_ids)
+        ]
+
+    def activity_documents(self, batch, batch_size):
+        first = batch * batch_size + 1
+        ids = np.arange(first, min(first + batch_size, self.activities + 1))
+        size = len(ids)
+        rng = self._rng(ACTIVITIES, batch)
+
+        user_ids = self._sample(rng, self.user_cdf, size) + 1
+        types = self._sample(rng, self.type_cdf, size)
+        duration = np.maximum(5, np.rint(rng.lognormal(np.log(self.type_minutes[types]), 0.4))).astype(int)
+        distance = np.round(np.maximum(0.0, duration * self.type_speed[types] * rng.normal(1.0, 0.15, size)), 2)
+        calories = np.rint(duration * self.type_kcal[types] * rng.normal(1.0, 0.1, size)).clip(min=0).astype(int)
+        start = np.datetime64(self.end_date - timedelta(days=HISTORY_DAYS - 1), 'D')
+        days = (start + rng.integers(0, HISTORY_DAYS, size)).astype('datetime64[ms]')
+
+        # Stored like djongo writes DateField values: naive midnight datetimes
+        return [
+            {
+                '_id': _id,
+                'user_id': user_id,
+                'activity_type': activity_type,
+                'duration': minutes,
+                'distance': km,
+                'calories': kcal,
+                'date': day,
+            }
+            for _id, user_id, activity_type, minutes, km, kcal, day in zip(
+                ids.tolist(), user_ids.tolist(), self.type_names[types].tolist(), duration.tolist(),
+                distance.tolist(), calories.tolist(), days.tolist(),
+            )
+        ]
@@ -0,0 +1,91 @@
+"""
+``{% cached_date_hierarchy cl %}``: Django's date_hierarchy tag, with the
+year, month and day links from ``admin_performance.date_buckets`` instead
+of distinct scans of the changelist queryset.
+"""
+from datetime import date
+
+from django import template
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.utils import formats
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+from octofit_tracker.admin_performance import date_buckets
+
+register = template.Library()
+
+
+def cached_date_hierarchy(cl):
+    field_name = cl.date_hierarchy
+    year_field = f'{field_name}__year'
+    month_field = f'{field_name}__month'
+    day_field = f'{field_name}__day'
+    try:
+        year = int(cl.params[year_field]) if year_field in cl.params else None
+        month = int(cl.params[month_field]) if month_field in cl.params else None
+        day = int(cl.params[day_field]) if day_field in cl.params else None
+    except ValueError:
+        year = month = day = None
+
+    def link(filters):
+        return cl.get_query_string(filters, [f'{field_name}__'])
+
+    if year is None:
+        years = date_buckets(cl.model, field_name, 'year')
+        # Start one level down when every row is in the same year or month
+        if len(years) != 1:
+            return {
+                'show': True,
+                'back': None,
+                'choices': [{'link': link({year_field: str(bucket.year)}), 'title': str(bucket.year)} for bucket in years],
+            }
+        year = years[0].year
+        months = date_buckets(cl.model, field_name, 'month', year)
+        if len(months) == 1:
+            month = months[0].month
+
+    if month is not None and day is not None:
+        selected = date(year, month, day)
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year, month_field: month}),
+                'title': capfirst(formats.date_format(selected, 'YEAR_MONTH_FORMAT')),
+            },
+            'choices': [{'title': capfirst(formats.date_format(selected, 'MONTH_DAY_FORMAT'))}],
+        }
+    if month is not None:
+        return {
+            'show': True,
+            'back': {'link': link({year_field: year}), 'title': str(year)},
+            'choices': [
+                {
+                    'link': link({year_field: year, month_field: month, day_field: bucket.day}),
+                    'title': capfirst(formats.date_format(bucket, 'MONTH_DAY_FORMAT')),
+                }
+                for bucket in date_buckets(cl.model, field_name, 'day', year, month)
+            ],
+        }
+    return {
+        'show': True,
+        'back': {'link': link({}), 'title': _('All dates')},
+        'choices': [
+            {
+                'link': link({year_field: year, month_field: bucket.month}),
+                'title': capfirst(formats.date_format(bucket, 'YEAR_MONTH_FORMAT')),
+            }
+            for bucket in date_buckets(cl.model, field_name, 'month', year)
+        ],
+    }
+
+
+@register.tag(name='cached_date_hierarchy')
+def cached_date_hierarchy_tag(parser, token):
+    return InclusionAdminNode(
+        parser,
+        token,
+        func=cached_date_hierarchy,
+        template_name='date_hierarchy.html',
+        takes_context=False,
+    )
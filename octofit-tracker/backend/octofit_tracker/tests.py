@@ -1,8 +1,50 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.models import Q
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
+from pymongo.errors import AutoReconnect
+from .models import User, Team, Activity, UserDailyRollup, TeamDailyRollup, Leaderboard, Workout, SearchEntry
+from .admin_performance import cached_distinct, date_buckets
+from .events import LEADERBOARD, QUEUE_SIZE, broker, publish_points
+from .indexes import HOT_QUERIES, explain_query, index_specs
+from .ingest import write_activities
+from .journal import APPLIED, PENDING, ActivityJournal
+from . import journal, mongo, routers, sharding
+from .metrics import REGISTRY, Histogram, render as render_metrics
+from .mongo import get_client, get_db
+from .profiling import CommandTimer, ProfilingMiddleware, phase
+from .repositories import ActivityRepository, LeaderboardRepository, MongoQuery, UserRepository
+from .renderers import ORJSONRenderer
+from .routers import WRITE_COOKIE, ReadReplicaRouter, reading_from, remember_write
+from .scoring import LOCKS, RANK_LEASE, apply_points
+from .sequences import COUNTERS, Sequence, get_sequence, reset_sequences
+from .serializers import ActivitySerializer, LeaderboardSerializer, UserSerializer, fast_serializer
+from .sharding import ShardRequired, merge_sorted, shard_for, shards_for_spec
+from .sse import route_streams
+from .synthetic import SyntheticDataset, np
 
 
 class UserModelTest(TestCase):
@@ -129,6 +171,118 @@ class ActivityAPITest(APITestCase):
         url = reverse('activity-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_duplicate_id_is_rejected_by_the_insert(self):
+        """Test that an unsharded create leaves _id uniqueness to the insert"""
+        data = dict(
+            _id=101, user_id=1, activity_type='Running', duration=30,
+            distance=5.0, calories=300, date='2026-02-20'
+        )
+        with mock.patch('octofit_tracker.serializers.locate_activity') as locate:
+            response = self.client.post(reverse('activity-list'), data, format='json')
+        locate.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('_id', response.data)
+        self.assertEqual(Activity.objects.get(_id=101).activity_type, 'Cycling')
+
+
+class ActivityPaginationTest(APITestCase):
+    """Test case for keyset pagination on the activities list"""
+    
+    def setUp(self):
+        for _id, day in [(1, 15), (2, 15), (3, 16), (4, 16), (5, 17)]:
+            Activity.objects.create(
+                _id=_id,
+                user_id=1,
+                activity_type='Running',
+                duration=30,
+                distance=5.0,
+                calories=300,
+                date=f'2026-02-{day}'
+            )
+    
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['_id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+    
+    def test_pages_follow_date_and_id_order(self):
+        """Test that next links walk (date, _id) descending without gaps"""
+        url = reverse('activity-list') + '?page_size=2'
+        self.assertEqual(self.walk(url), [5, 4, 3, 2, 1])
+    
+    def test_cursor_is_stable_under_inserts(self):
+        """Test that a newer activity does not shift the following pages"""
+        response = self.client.get(reverse('activity-list'), {'page_size': 2})
+        self.assertEqual([item['_id'] for item in response.data['results']], [5, 4])
+        Activity.objects.create(
+            _id=6,
+            user_id=1,
+            activity_type='Cycling',
+            duration=20,
+            distance=7.0,
+            calories=200,
+            date='2026-02-18'
+        )
+        self.assertEqual(self.walk(response.data['next']), [3, 2, 1])
+    
+    def test_previous_link(self):
+        """Test that the previous link returns the preceding page"""
+        first = self.client.get(reverse('activity-list'), {'page_size': 2})
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        previous = self.client.get(second.data['previous'])
+        self.assertEqual(previous.data['results'], first.data['results'])
+    
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get(reverse('activity-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_by_user_is_paginated(self):
+        """Test that the by_user action uses the same cursor pagination"""
+        url = reverse('activity-by-user') + '?user_id=1&page_size=3'
+        self.assertEqual(self.walk(url), [5, 4, 3, 2, 1])
+
+
+class SeedDataTest(APITestCase):
+    """Test case for reading the activities populate_db seeds"""
+    
+    def setUp(self):
+        call_command('populate_db', stdout=StringIO())
+    
+    def export_ids(self, **params):
+        response = self.client.get(reverse('activity-export'), params)
+        return sorted(json.loads(line)['_id'] for line in b''.join(response.streaming_content).splitlines())
+    
+    def test_pages_cover_seeded_activities(self):
+        """Test that following next walks every seeded activity in (date, _id) order"""
+        ids, url = [], reverse('activity-list') + '?page_size=5'
+        while url:
+            response = self.client.get(url)
+            ids += [row['_id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [12, 11, 6, 5, 10, 9, 4, 3, 8, 7, 2, 1])
+    
+    def test_export_date_range(self):
+        """Test that export start and end match seeded activity dates"""
+        self.assertEqual(self.export_ids(start='2026-02-16', end='2026-02-16'), [3, 4, 9, 10])
+        self.assertEqual(self.export_ids(user_id=5, start='2026-02-17'), [5])
+        self.assertEqual(self.export_ids(end='2026-02-15'), [1, 2, 7, 8])
+    
+    def test_string_dates_are_migrated(self):
+        """Test that migrate_activity_dates converts dates older seeds stored as strings"""
+        get_db().activities.update_many({'date': datetime(2026, 2, 15)}, {'$set': {'date': '2026-02-15'}})
+        query = ActivityRepository().all().filter(date__lte=date(2026, 2, 15))
+        self.assertEqual(list(query), [])
+        out = StringIO()
+        call_command('migrate_activity_dates', stdout=out)
+        self.assertIn('Converted 4 activity dates', out.getvalue())
+        self.assertEqual([row['_id'] for row in query], [8, 7, 2, 1])
 
 
 class LeaderboardAPITest(APITestCase):
@@ -150,6 +304,42 @@ class LeaderboardAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class LeaderboardAroundTest(APITestCase):
+    """Test case for the leaderboard around action"""
+    
+    def setUp(self):
+        for _id, points, rank in [(1, 900, 1), (2, 700, 2), (3, 700, 2), (4, 500, 4), (5, 300, 5)]:
+            Leaderboard.objects.create(_id=_id, user_id=_id, team_id=1, total_points=points, rank=rank)
+    
+    def around(self, **params):
+        return self.client.get(reverse('leaderboard-around'), params)
+    
+    def test_neighbours_break_ties_by_id(self):
+        """Test that tied ranks are ordered by _id like the list endpoint"""
+        response = self.around(user_id=3, k=1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rank'], 2)
+        self.assertEqual([entry['user_id'] for entry in response.data['above']], [2])
+        self.assertEqual([entry['user_id'] for entry in response.data['below']], [4])
+        response = self.around(user_id=2, k=2)
+        self.assertEqual([entry['user_id'] for entry in response.data['above']], [1])
+        self.assertEqual([entry['user_id'] for entry in response.data['below']], [3, 4])
+    
+    def test_edges_and_defaults(self):
+        """Test that the ends of the leaderboard return short sides"""
+        response = self.around(user_id=5)
+        self.assertEqual([entry['user_id'] for entry in response.data['above']], [1, 2, 3, 4])
+        self.assertEqual(response.data['below'], [])
+        self.assertEqual(self.around(user_id=1, k=0).data['entry']['total_points'], 900)
+    
+    def test_invalid_requests(self):
+        """Test missing, malformed and unknown parameters"""
+        self.assertEqual(self.around().status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.around(user_id=1, k='many').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.around(user_id=1, k=1000).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.around(user_id=99).status_code, status.HTTP_404_NOT_FOUND)
+
+
 class WorkoutAPITest(APITestCase):
     """Test case for Workout API endpoints"""
     
@@ -176,6 +366,1285 @@ class WorkoutAPITest(APITestCase):
         self.assertEqual(response.data['name'], 'Test Workout')
 
 
+class LeaderboardScoringTest(APITestCase):
+    """Test case for incremental leaderboard updates on activity writes"""
+    
+    def setUp(self):
+        for _id, points, rank in [(1, 900, 1), (2, 700, 2), (3, 500, 3)]:
+            User.objects.create(_id=_id, name=f'User {_id}', email=f'user{_id}@example.com', team_id=1)
+            Leaderboard.objects.create(_id=_id, user_id=_id, team_id=1, total_points=points, rank=rank)
+    
+    def ranks(self):
+        return {
+            entry.user_id: (entry.total_points, entry.rank)
+            for entry in Leaderboard.objects.all()
+        }
+    
+    def create_activity(self, _id, user_id, calories):
+        return self.client.post(reverse('activity-list'), {
+            '_id': _id,
+            'user_id': user_id,
+            'activity_type': 'Running',
+            'duration': 30,
+            'distance': 5.0,
+            'calories': calories,
+            'date': '2026-02-19',
+        }, format='json')
+    
+    def test_create_moves_only_passed_rows(self):
+        """Test that creating an activity updates points and shifts ranks"""
+        response = self.create_activity(200, 3, 300)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.ranks(), {1: (900, 1), 2: (700, 3), 3: (800, 2)})
+    
+    def test_tie_shares_rank(self):
+        """Test that equal points share the same rank"""
+        self.create_activity(200, 3, 200)
+        self.assertEqual(self.ranks(), {1: (900, 1), 2: (700, 2), 3: (700, 2)})
+    
+    def test_update_and_delete_revert_points(self):
+        """Test that editing and deleting an activity apply the difference"""
+        self.create_activity(200, 3, 300)
+        url = reverse('activity-detail', args=[200])
+        self.client.patch(url, {'calories': 500}, format='json')
+        self.assertEqual(self.ranks(), {1: (900, 2), 2: (700, 3), 3: (1000, 1)})
+        self.client.delete(url)
+        self.assertEqual(self.ranks(), {1: (900, 1), 2: (700, 2), 3: (500, 3)})
+    
+    def test_new_user_gets_a_row(self):
+        """Test that a user without a leaderboard row is inserted and ranked"""
+        User.objects.create(_id=4, name='User 4', email='user4@example.com', team_id=2)
+        self.create_activity(200, 4, 800)
+        self.assertEqual(self.ranks(), {1: (900, 1), 2: (700, 3), 3: (500, 4), 4: (800, 2)})
+        self.assertEqual(Leaderboard.objects.get(user_id=4).team_id, 2)
+    
+    def test_unknown_user_gets_no_row(self):
+        """Test that points for a user that does not exist insert no invalid row"""
+        apply_points(99, 300)
+        self.assertEqual(Leaderboard.objects.filter(user_id=99).count(), 0)
+        self.assertEqual(self.ranks(), {1: (900, 1), 2: (700, 2), 3: (500, 3)})
+    
+    def test_rank_updates_wait_for_other_processes(self):
+        """Test that a rank update waits for the lease another process holds in MongoDB"""
+        locks = get_db()[LOCKS]
+        locks.insert_one({'_id': RANK_LEASE, 'owner': 'other', 'expires': datetime.utcnow() + timedelta(minutes=1)})
+        release = threading.Timer(0.2, locks.delete_one, args=[{'_id': RANK_LEASE, 'owner': 'other'}])
+        release.start()
+        self.addCleanup(release.cancel)
+        started = time.monotonic()
+        apply_points(3, 300)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(self.ranks(), {1: (900, 1), 2: (700, 3), 3: (800, 2)})
+        self.assertIsNone(locks.find_one({'_id': RANK_LEASE}))
+    
+    def test_new_row_is_published_with_its_id(self):
+        """Test that a newly inserted row is streamed with its own leaderboard _id"""
+        User.objects.create(_id=4, name='User 4', email='user4@example.com', team_id=2)
+        with mock.patch('octofit_tracker.scoring.publish_points') as publish:
+            self.create_activity(200, 4, 800)
+        entry, _ = publish.call_args.args
+        self.assertEqual(entry['_id'], Leaderboard.objects.get(user_id=4)._id)
+    
+    def test_points_change_is_published(self):
+        """Test that an activity write streams the row's new rank and the shifted range"""
+        async def scenario():
+            subscription = broker.subscribe(LEADERBOARD, key=1)
+            try:
+                await sync_to_async(self.create_activity)(200, 3, 300)
+                return await asyncio.wait_for(subscription.get(), 1)
+            finally:
+                subscription.close()
+        frame = async_to_sync(scenario)()
+        self.assertEqual(json.loads(frame.decode().split('data: ', 1)[1]), {
+            '_id': 3, 'user_id': 3, 'team_id': 1, 'total_points': 800, 'rank': 2,
+            'shift': {'gte': 500, 'lt': 800, 'by': 1},
+        })
+    
+    def test_rebuild_command(self):
+        """Test that rebuild_leaderboard recomputes points and ranks"""
+        Activity.objects.create(
+            _id=200, user_id=3, activity_type='Running', duration=30,
+            distance=5.0, calories=1000, date='2026-02-19'
+        )
+        call_command('rebuild_leaderboard', stdout=StringIO())
+        self.assertEqual(self.ranks(), {1: (0, 2), 2: (0, 2), 3: (1000, 1)})
+
+
+class SequenceIdTest(APITestCase):
+    """Test case for server-assigned, block-allocated _id values"""
+    
+    def setUp(self):
+        reset_sequences()
+        User.objects.create(_id=7, name='User 7', email='user7@example.com', team_id=1)
+    
+    def create_user(self, name, **extra):
+        return self.client.post(reverse('user-list'), dict(
+            name=name, email=f'{name.lower()}@example.com', **extra
+        ), format='json')
+    
+    def test_create_assigns_next_id(self):
+        """Test that creates without _id continue after the highest existing id"""
+        first = self.create_user('Alice')
+        second = self.create_user('Bob')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((first.data['_id'], second.data['_id']), (8, 9))
+        self.assertEqual(User.objects.get(_id=9).name, 'Bob')
+    
+    def test_explicit_ids_move_the_counter(self):
+        """Test that a client-chosen id is never handed out again"""
+        self.create_user('Alice', _id=50)
+        self.assertEqual(self.create_user('Bob').data['_id'], 51)
+    
+    def test_id_taken_inside_a_reserved_block_is_retried(self):
+        """Test that a create whose reserved id a client took through another process gets a fresh one"""
+        self.assertEqual(get_sequence(User).next(), 8)
+        # Another process's allocator accepts the explicit id 9, which sits in
+        # this process's block, and moves the counter past it
+        User.objects.create(_id=9, name='Mallory', email='mallory@example.com', team_id=1)
+        Sequence('users', block_size=10).observe(9)
+        response = self.create_user('Alice')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(response.data['_id'], 9)
+        self.assertEqual(User.objects.get(_id=response.data['_id']).name, 'Alice')
+        self.assertEqual(User.objects.get(_id=9).name, 'Mallory')
+    
+    def test_blocks_need_one_round_trip(self):
+        """Test that ids come from per-process blocks reserved with one $inc each"""
+        db = get_db()
+        first, second = Sequence('users', block_size=10), Sequence('users', block_size=10)
+        ids = [first.next(db) for _ in range(3)] + [second.next(db) for _ in range(3)] + [first.next(db)]
+        self.assertEqual(ids, [8, 9, 10, 18, 19, 20, 11])
+        self.assertEqual(db[COUNTERS].find_one({'_id': 'users'})['seq'], 27)
+        self.assertEqual(list(first.reserve(20, db)), list(range(28, 48)))
+    
+    def test_bulk_ingest_reserves_ids(self):
+        """Test that bulk records without _id get consecutive ids"""
+        body = '\n'.join(
+            '{"user_id": 7, "activity_type": "Running", "duration": 30, '
+            '"distance": 5.0, "calories": 100, "date": "2026-02-20"}'
+            for _ in range(3)
+        )
+        response = self.client.post(reverse('activity-bulk'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.data['inserted'], 3)
+        self.assertEqual(sorted(Activity.objects.values_list('_id', flat=True)), [1, 2, 3])
+
+
+class ActivityBulkIngestTest(APITestCase):
+    """Test case for the streaming bulk activity ingest endpoint"""
+    
+    def setUp(self):
+        self.url = reverse('activity-bulk')
+        User.objects.create(_id=1, name='User 1', email='user1@example.com', team_id=1)
+        Activity.objects.create(
+            _id=1, user_id=1, activity_type='Running', duration=30,
+            distance=5.0, calories=300, date='2026-02-19'
+        )
+    
+    def test_ndjson_ingest_reports_per_record_errors(self):
+        """Test that valid NDJSON records are inserted and bad ones reported"""
+        body = '\n'.join([
+            '{"_id": 2, "user_id": 1, "activity_type": "Cycling", "duration": 60, '
+            '"distance": 20.0, "calories": 500, "date": "2026-02-20"}',
+            '{"_id": 1, "user_id": 1, "activity_type": "Cycling", "duration": 60, '
+            '"distance": 20.0, "calories": 500, "date": "2026-02-20"}',
+            '{"_id": 3, "user_id": 1}',
+            'not json',
+        ])
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['received'], 4)
+        self.assertEqual(response.data['inserted'], 1)
+        self.assertEqual(sorted(error['line'] for error in response.data['errors']), [2, 3, 4])
+        self.assertEqual(Activity.objects.get(_id=2).calories, 500)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_points, 500)
+    
+    def test_csv_ingest(self):
+        """Test that CSV uploads are parsed with a header row"""
+        body = (
+            '_id,user_id,activity_type,duration,distance,calories,date\n'
+            '10,2,Swimming,30,2.0,400,2026-02-21\n'
+            '11,2,Running,45,8.5,650,2026-02-22\n'
+        )
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.data['inserted'], 2)
+        self.assertEqual(response.data['failed'], 0)
+        self.assertEqual(Activity.objects.filter(user_id=2).count(), 2)
+    
+    def test_records_skip_the_id_lookup(self):
+        """Test that records are validated without a per-row _id query, even when sharded"""
+        body = '_id,user_id,activity_type,duration,distance,calories,date\n10,2,Swimming,30,2.0,400,2026-02-21\n'
+        with mock.patch('octofit_tracker.serializers.is_sharded', return_value=True), \
+                mock.patch('octofit_tracker.serializers.locate_activity') as locate, \
+                mock.patch('octofit_tracker.ingest.write_activities', return_value={}) as write:
+            response = self.client.post(self.url, body, content_type='text/csv')
+        locate.assert_not_called()
+        self.assertEqual(response.data['inserted'], 1)
+        self.assertEqual([document['_id'] for document in write.call_args.args[0]], [10])
+    
+    def test_unsupported_content_type(self):
+        """Test that JSON arrays are rejected in favour of NDJSON"""
+        response = self.client.post(self.url, [], format='json')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+
+class ActivityExportTest(APITestCase):
+    """Test case for the streaming NDJSON/CSV activity export"""
+    
+    def setUp(self):
+        self.url = reverse('activity-export')
+        for _id, user_id, day in [(1, 1, '2026-02-19'), (2, 1, '2026-02-21'), (3, 2, '2026-02-20')]:
+            Activity.objects.create(
+                _id=_id, user_id=user_id, activity_type='Running', duration=30,
+                distance=5.0, calories=100 * _id, date=day
+            )
+    
+    def test_ndjson_is_streamed(self):
+        """Test that the default export is streamed NDJSON, filtered by user_id"""
+        response = self.client.get(self.url, {'user_id': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertIn('activities.ndjson', response['Content-Disposition'])
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['_id'] for row in rows], [2, 1])
+        self.assertEqual(rows[0]['date'], '2026-02-21')
+    
+    def test_csv_matches_bulk_columns(self):
+        """Test that ?format=csv exports the columns the bulk endpoint ingests"""
+        response = self.client.get(self.url, {'format': 'csv', 'start': '2026-02-20'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], '_id,user_id,activity_type,duration,distance,calories,date')
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['2', '3'])
+    
+    def test_date_range(self):
+        """Test that start and end bound the exported dates inclusively"""
+        response = self.client.get(self.url, {'start': '2026-02-19', 'end': '2026-02-20'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(row['_id'] for row in rows), [1, 3])
+    
+    def test_invalid_parameters(self):
+        """Test that bad user_id and date values are rejected"""
+        for params in ({'user_id': 'abc'}, {'start': '19-02-2026'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', json.loads(response.content))
+
+
+class ActivityJournalTest(APITestCase):
+    """Test case for write-behind activity logging through the journal"""
+    
+    def setUp(self):
+        reset_sequences()
+        User.objects.create(_id=1, name='User 1', email='user1@example.com', team_id=1)
+        Leaderboard.objects.create(_id=1, user_id=1, team_id=1, total_points=0, rank=1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # Not started: the tests flush explicitly
+        self.journal = ActivityJournal(self.directory)
+        self.addCleanup(self.journal.stop)
+        self.data = dict(user_id=1, activity_type='Running', duration=30, distance=5.0, calories=300)
+    
+    def append(self, **extra):
+        serializer = ActivitySerializer(data=dict(self.data, date='2026-02-20', **extra))
+        serializer.is_valid(raise_exception=True)
+        return self.journal.append(serializer.validated_data)
+    
+    def segment_lines(self):
+        return [
+            json.loads(line)
+            for name in sorted(os.listdir(self.directory))
+            for line in open(os.path.join(self.directory, name), 'rb')
+        ]
+    
+    def test_flush_writes_journaled_records(self):
+        """Test that appends are on disk and pending until a flush writes them"""
+        record = self.append()
+        self.assertEqual(self.journal.status(record['_id']), (PENDING, None))
+        self.assertEqual([line['_id'] for line in self.segment_lines()], [record['_id']])
+        self.assertFalse(Activity.objects.filter(_id=record['_id']).exists())
+        
+        self.assertEqual(self.journal.flush(), 1)
+        self.assertEqual(self.journal.status(record['_id']), (APPLIED, None))
+        self.assertEqual(Activity.objects.get(_id=record['_id']).calories, 300)
+        self.assertGreater(Leaderboard.objects.get(user_id=1).total_points, 0)
+        self.assertEqual(self.segment_lines(), [])
+    
+    def test_retry_after_a_partial_insert(self):
+        """Test that records a failed flush inserted are applied, with their points, by the retry"""
+        records = [self.append() for _ in range(3)]
+        insert_activities = journal.insert_activities
+        
+        def dropped_connection(documents):
+            insert_activities(documents[:2])
+            raise AutoReconnect('connection closed')
+        
+        with mock.patch.object(journal, 'insert_activities', side_effect=dropped_connection):
+            with self.assertRaises(AutoReconnect):
+                self.journal.flush()
+        self.assertEqual(self.journal.status(records[0]['_id']), (PENDING, None))
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_points, 0)
+        
+        with mock.patch.object(journal, 'publish_activity') as publish:
+            self.assertEqual(self.journal.flush(), 3)
+        self.assertEqual([self.journal.status(record['_id']) for record in records], [(APPLIED, None)] * 3)
+        self.assertEqual(publish.call_count, 3)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_points, 900)
+        self.assertEqual(get_db().user_daily_rollups.find_one({'user_id': 1})['activities'], 3)
+        self.assertEqual(self.segment_lines(), [])
+    
+    def test_recover_replays_orphaned_segments(self):
+        """Test that a crashed process's segment is replayed up to a torn last line"""
+        line = json.dumps(dict(self.data, _id=40, date='2026-02-20')) + '\n'
+        with open(os.path.join(self.directory, 'activities-1-1-0.ndjson'), 'w') as segment:
+            segment.write(line + '{"_id": 41, "user_id"')
+        # The same record again: it was written before the crash
+        with open(os.path.join(self.directory, 'activities-1-1-1.ndjson'), 'w') as segment:
+            segment.write(line)
+        self.assertEqual(self.journal.recover(), 1)
+        self.assertEqual(list(Activity.objects.values_list('_id', flat=True)), [40])
+        self.assertEqual(self.journal.status(40), (APPLIED, None))
+        self.assertEqual(self.segment_lines(), [])
+    
+    @override_settings(ACTIVITY_WRITE_BEHIND=True)
+    def test_respond_async_create(self):
+        """Test that Prefer: respond-async is answered 202 with a write status URL"""
+        self.addCleanup(setattr, journal, '_journal', journal._journal)
+        journal._journal = self.journal
+        response = self.client.post(
+            reverse('activity-list'), dict(self.data, date='2026-02-20'),
+            format='json', HTTP_PREFER='respond-async'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response['Preference-Applied'], 'respond-async')
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(response['Location'], response.data['status_url'])
+        
+        self.assertEqual(self.client.get(response['Location']).data['status'], 'pending')
+        self.journal.flush()
+        self.assertEqual(self.client.get(response['Location']).data['status'], 'applied')
+        missing = self.client.get(reverse('activity-write-status', args=[999]))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_only_serving_processes_start_the_journal(self):
+        """Test that app loading leaves the journal alone and the entry points start it"""
+        self.addCleanup(setattr, journal, '_journal', journal._journal)
+        journal._journal = None
+        with self.settings(ACTIVITY_WRITE_BEHIND=True, ACTIVITY_JOURNAL_DIR=self.directory):
+            apps.get_app_config('octofit_tracker').ready()
+            self.assertIsNone(journal._journal)
+            journal.start_journal()
+            self.assertIsNotNone(journal._journal)
+            self.addCleanup(journal._journal.stop)
+    
+    def test_synchronous_without_preference(self):
+        """Test that creates without the preference, or with the mode off, are written at once"""
+        response = self.client.post(
+            reverse('activity-list'), dict(self.data, date='2026-02-20'),
+            format='json', HTTP_PREFER='respond-async'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        status_response = self.client.get(reverse('activity-write-status', args=[response.data['_id']]))
+        self.assertEqual(status_response.data['status'], 'applied')
+
+
+class SearchTest(APITestCase):
+    """Test case for the indexed search endpoint and admin search"""
+    
+    def setUp(self):
+        for _id, name, email in [
+            (1, 'Tony Stark', 'tony@stark.com'),
+            (2, 'Steve Rogers', 'steve@avengers.com'),
+            (3, 'Stan Lee', 'stan@marvel.com'),
+            (4, 'Stanley Park', 'stanley@park.com'),
+        ]:
+            User.objects.create(_id=_id, name=name, email=email, team_id=1)
+        Team.objects.create(_id=1, name='Team Stark', description='Family business')
+        Workout.objects.create(_id=1, name='Strength Circuit', description='Heavy lifting', difficulty='Hard', duration=45)
+        self.url = reverse('search')
+    
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(result['type'], result['_id']) for result in response.data['results']]
+    
+    def test_prefix_matches_across_types(self):
+        """Test that every word of the query must prefix a word of an indexed field"""
+        self.assertEqual(sorted(self.search(q='stark')), [('team', 1), ('user', 1)])
+        self.assertEqual(self.search(q='tony st'), [('user', 1)])
+        self.assertEqual(self.search(q='heavy str'), [('workout', 1)])
+        response = self.client.get(self.url, {'q': 'tony'})
+        self.assertTrue(response.data['results'][0]['url'].endswith('/api/users/1/'))
+    
+    def test_ranking(self):
+        """Test that whole words outrank prefixes, then shorter labels come first"""
+        self.assertEqual(self.search(q='stan', type='user'), [('user', 3), ('user', 4)])
+        self.assertEqual(self.search(q='st', type='user'), [('user', 3), ('user', 1), ('user', 2), ('user', 4)])
+        self.assertEqual(self.search(q='st', limit=2, type='user,team'), [('user', 3), ('team', 1)])
+    
+    def test_index_follows_writes(self):
+        """Test that updates and deletes through the API reach the index"""
+        self.client.patch(reverse('user-detail', args=[2]), {'name': 'Captain America'}, format='json')
+        self.assertEqual(self.search(q='captain'), [('user', 2)])
+        self.assertEqual(self.search(q='rogers'), [])
+        self.client.delete(reverse('user-detail', args=[2]))
+        self.assertEqual(self.search(q='captain'), [])
+    
+    def test_rebuild_command(self):
+        """Test that rebuild_search_index recreates entries from the collections"""
+        get_db()[SearchEntry._meta.db_table].drop()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search(q='stanley'), [('user', 4)])
+    
+    def test_admin_search_uses_index(self):
+        """Test that the admin changelist search is answered from the index"""
+        model_admin = admin.site._registry[User]
+        request = RequestFactory().get('/admin/octofit_tracker/user/', {'q': 'stan'})
+        queryset, may_have_duplicates = model_admin.get_search_results(request, User.objects.all(), 'stan')
+        self.assertEqual(sorted(user._id for user in queryset), [3, 4])
+        self.assertFalse(may_have_duplicates)
+    
+    def test_invalid_parameters(self):
+        """Test that missing or short queries, unknown types and bad limits are rejected"""
+        for params in ({}, {'q': 'a'}, {'q': 'stan', 'type': 'activity'}, {'q': 'stan', 'limit': 0}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn('error', response.data)
+
+
+class AdminPerformanceTest(TestCase):
+    """Test case for the admin changelist performance mode"""
+    
+    def setUp(self):
+        cache.clear()
+        for _id, activity_type, day in [
+            (1, 'Running', '2025-12-30'), (2, 'Cycling', '2026-01-05'),
+            (3, 'Running', '2026-02-15'), (4, 'Swimming', '2026-02-19'),
+        ]:
+            Activity.objects.create(
+                _id=_id, user_id=1, activity_type=activity_type, duration=30,
+                distance=5.0, calories=100, date=day
+            )
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        self.url = reverse('admin:octofit_tracker_activity_changelist')
+    
+    def test_counts_avoid_full_scans(self):
+        """Test that unfiltered lists use the estimated count and filtered ones are capped"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['cl'].result_count, 4)
+        self.assertIsNone(response.context['cl'].full_result_count)
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=1):
+            response = self.client.get(self.url, {'activity_type': 'Running'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+    
+    def test_filter_choices_are_cached(self):
+        """Test that list filter choices are read once and reused until they expire"""
+        self.client.get(self.url)
+        Activity.objects.create(
+            _id=5, user_id=1, activity_type='Yoga', duration=30,
+            distance=0.0, calories=100, date='2026-02-20'
+        )
+        self.assertEqual(cached_distinct(Activity, Activity._meta.get_field('activity_type')),
+                         ['Cycling', 'Running', 'Swimming'])
+        cache.clear()
+        self.assertIn('Yoga', cached_distinct(Activity, Activity._meta.get_field('activity_type')))
+    
+    def test_filter_choices_sort_by_value(self):
+        """Test that numeric choices sort as numbers and mixed types fall back to text"""
+        for _id, team_id in [(1, 10), (2, 2), (3, 11), (4, 1)]:
+            Leaderboard.objects.create(_id=_id, user_id=_id, team_id=team_id, total_points=0, rank=1)
+        field = Leaderboard._meta.get_field('team_id')
+        self.assertEqual(cached_distinct(Leaderboard, field), [1, 2, 10, 11])
+        cache.clear()
+        get_db().leaderboard.insert_one({'_id': 5, 'user_id': 5, 'team_id': '3', 'total_points': 0, 'rank': 1})
+        self.assertEqual(cached_distinct(Leaderboard, field), [1, 10, 11, 2, '3'])
+    
+    def test_date_hierarchy_buckets(self):
+        """Test that years, months and days are found for both stored date formats"""
+        get_db()[Activity._meta.db_table].insert_one({
+            '_id': 6, 'user_id': 1, 'activity_type': 'Running', 'duration': 30,
+            'distance': 5.0, 'calories': 100, 'date': '2026-02-03',
+        })
+        self.assertEqual(date_buckets(Activity, 'date', 'year'), [date(2025, 1, 1), date(2026, 1, 1)])
+        self.assertEqual(date_buckets(Activity, 'date', 'month', 2026), [date(2026, 1, 1), date(2026, 2, 1)])
+        self.assertEqual(date_buckets(Activity, 'date', 'day', 2026, 2),
+                         [date(2026, 2, 3), date(2026, 2, 15), date(2026, 2, 19)])
+        response = self.client.get(self.url, {'date__year': 2026})
+        self.assertContains(response, 'date__month=2')
+        self.assertNotContains(response, 'date__month=3')
+
+
+class ExpandAPITest(APITestCase):
+    """Test case for ?expand= on leaderboard and team responses"""
+    
+    def setUp(self):
+        Team.objects.create(_id=1, name='Team A', description='First team')
+        Team.objects.create(_id=2, name='Team B', description='Second team')
+        for _id in range(1, 5):
+            team_id = 1 if _id <= 2 else 2
+            User.objects.create(_id=_id, name=f'User {_id}', email=f'user{_id}@example.com', team_id=team_id)
+            Leaderboard.objects.create(_id=_id, user_id=_id, team_id=team_id, total_points=100 * _id, rank=5 - _id)
+    
+    def test_leaderboard_expand_user_and_team(self):
+        """Test that leaderboard rows embed their user and team"""
+        response = self.client.get(reverse('leaderboard-list'), {'expand': 'user,team'})
+        first = response.data['results'][0]
+        self.assertEqual(first['user']['name'], 'User 4')
+        self.assertEqual(first['team']['name'], 'Team B')
+    
+    def test_expand_query_count_is_constant(self):
+        """Test that expanding a page costs one query per relation"""
+        with self.assertNumQueries(3):
+            self.client.get(reverse('leaderboard-list'), {'expand': 'user,team'})
+        with self.assertNumQueries(2):
+            self.client.get(reverse('team-list'), {'expand': 'members'})
+    
+    def test_team_expand_members(self):
+        """Test that teams embed their members"""
+        response = self.client.get(reverse('team-list'), {'expand': 'members'})
+        members = {team['_id']: [user['_id'] for user in team['members']] for team in response.data['results']}
+        self.assertEqual(members, {1: [1, 2], 2: [3, 4]})
+    
+    @override_settings(EXPAND_MANY_LIMIT=1)
+    def test_team_expand_members_is_capped(self):
+        """Test that large teams embed a capped member list with a count and a link"""
+        response = self.client.get(reverse('team-detail', args=[2]), {'expand': 'members'})
+        self.assertEqual([user['_id'] for user in response.data['members']], [3])
+        self.assertEqual(response.data['members_count'], 2)
+        self.assertTrue(response.data['members_url'].endswith(reverse('team-members', args=[2])))
+    
+    def test_unknown_expand(self):
+        """Test that unknown expand names are rejected"""
+        response = self.client.get(reverse('team-list'), {'expand': 'owner'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SparseFieldsTest(APITestCase):
+    """Test case for ?fields= sparse fieldsets"""
+    
+    def setUp(self):
+        Team.objects.create(_id=1, name='Team A', description='A long team description')
+        User.objects.create(_id=1, name='User 1', email='user1@example.com', team_id=1)
+        Workout.objects.create(_id=1, name='Plank', description='Hold it', difficulty='Easy', duration=5)
+        for _id, day in [(1, 15), (2, 16), (3, 17)]:
+            Activity.objects.create(
+                _id=_id, user_id=1, activity_type='Running', duration=30,
+                distance=5.0, calories=100 * _id, date=f'2026-02-{day}'
+            )
+    
+    def test_list_returns_only_named_fields(self):
+        """Test that list rows carry just the requested fields"""
+        response = self.client.get(reverse('team-list'), {'fields': 'name,_id'})
+        self.assertEqual(response.data['results'], [{'_id': 1, 'name': 'Team A'}])
+    
+    def test_pagination_without_ordering_fields(self):
+        """Test that cursors still work when the ordering keys are not requested"""
+        url = reverse('activity-list') + '?fields=calories&page_size=2'
+        calories = []
+        while url:
+            response = self.client.get(url)
+            calories.extend(response.data['results'])
+            url = response.data['next']
+        self.assertEqual(calories, [{'calories': 300}, {'calories': 200}, {'calories': 100}])
+    
+    def test_detail_and_action_fields(self):
+        """Test that detail views and list actions honour ?fields="""
+        response = self.client.get(reverse('workout-detail', args=[1]), {'fields': 'name'})
+        self.assertEqual(response.data, {'name': 'Plank'})
+        response = self.client.get(reverse('team-members', args=[1]), {'fields': 'email'})
+        self.assertEqual(response.data['results'], [{'email': 'user1@example.com'}])
+    
+    def test_projection_skips_unrequested_columns(self):
+        """Test that a narrowed query only reads the fields and ordering keys"""
+        query = ActivityRepository().all().only('calories')
+        self.assertEqual([column for _, column, _ in query.reader.extractors], ['calories', 'date', '_id'])
+    
+    def test_unknown_field(self):
+        """Test that unknown field names are rejected"""
+        for value in ('name,owner', ''):
+            response = self.client.get(reverse('team-list'), {'fields': value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityRollupTest(APITestCase):
+    """Test case for the daily rollups kept current by activity writes"""
+    
+    def setUp(self):
+        User.objects.create(_id=1, name='User 1', email='user1@example.com', team_id=1)
+        User.objects.create(_id=2, name='User 2', email='user2@example.com', team_id=1)
+    
+    def create_activity(self, _id, user_id, activity_type, calories, day='2026-02-19'):
+        return self.client.post(reverse('activity-list'), {
+            '_id': _id,
+            'user_id': user_id,
+            'activity_type': activity_type,
+            'duration': 30,
+            'distance': 5.0,
+            'calories': calories,
+            'date': day,
+        }, format='json')
+    
+    def rollups(self, model):
+        return sorted(
+            get_db()[model._meta.db_table].find({}, {'_id': 0}),
+            key=lambda rollup: (rollup.get('user_id', rollup.get('team_id')), rollup['date'])
+        )
+    
+    def test_writes_update_user_and_team_days(self):
+        """Test that create, edit and delete keep the day and type totals current"""
+        self.create_activity(1, 1, 'Running', 100)
+        self.create_activity(2, 1, 'Cycling', 200)
+        self.create_activity(3, 2, 'Running', 300)
+        user_day = self.rollups(UserDailyRollup)[0]
+        self.assertEqual((user_day['activities'], user_day['calories']), (2, 300))
+        self.assertEqual(user_day['types']['Cycling']['calories'], 200)
+        team_day = self.rollups(TeamDailyRollup)[0]
+        self.assertEqual((team_day['activities'], team_day['calories']), (3, 600))
+        
+        self.client.patch(reverse('activity-detail', args=[2]), {'date': '2026-02-20'}, format='json')
+        self.assertEqual([rollup['activities'] for rollup in self.rollups(UserDailyRollup)], [1, 1, 1])
+        self.assertNotIn('Cycling', self.rollups(UserDailyRollup)[0]['types'])
+        
+        self.client.delete(reverse('activity-detail', args=[2]))
+        self.assertEqual(len(self.rollups(UserDailyRollup)), 2)
+    
+    def test_rebuild_matches_incremental(self):
+        """Test that rebuild_rollups reproduces the incrementally maintained documents"""
+        self.create_activity(1, 1, 'Running', 100)
+        self.create_activity(2, 1, 'Swimming', 200, day='2026-02-20')
+        self.create_activity(3, 2, 'Running', 300)
+        incremental = (self.rollups(UserDailyRollup), self.rollups(TeamDailyRollup))
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual((self.rollups(UserDailyRollup), self.rollups(TeamDailyRollup)), incremental)
+    
+    def test_team_change_moves_totals(self):
+        """Test that changing a user's team re-attributes their daily totals"""
+        self.create_activity(1, 1, 'Running', 100)
+        self.create_activity(2, 2, 'Running', 300)
+        self.client.patch(reverse('user-detail', args=[1]), {'team_id': 2}, format='json')
+        self.assertEqual(
+            [(rollup['team_id'], rollup['calories']) for rollup in self.rollups(TeamDailyRollup)],
+            [(1, 300), (2, 100)]
+        )
+
+
+class StatsAPITest(APITestCase):
+    """Test case for the user and team stats endpoints"""
+    
+    def setUp(self):
+        Team.objects.create(_id=1, name='Team A', description='')
+        User.objects.create(_id=1, name='User 1', email='user1@example.com', team_id=1)
+        User.objects.create(_id=2, name='User 2', email='user2@example.com', team_id=1)
+        for _id, user_id, day, calories in [(1, 1, 2, 100), (2, 1, 2, 200), (3, 2, 3, 300), (4, 1, 20, 400)]:
+            Activity.objects.create(
+                _id=_id, user_id=user_id, activity_type='Running', duration=10,
+                distance=1.5, calories=calories, date=f'2026-02-{day:02d}'
+            )
+        call_command('rebuild_rollups', stdout=StringIO())
+    
+    def test_user_stats_by_day(self):
+        """Test that a user's activities are summed per day"""
+        response = self.client.get(reverse('user-stats', args=[1]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals']['calories'], 700)
+        self.assertEqual(
+            [(bucket['period'], bucket['activities']) for bucket in response.data['buckets']],
+            [('2026-02-02', 2), ('2026-02-20', 1)]
+        )
+    
+    def test_team_stats_by_month_with_range(self):
+        """Test that team stats sum members and honour the date range"""
+        url = reverse('team-stats', args=[1])
+        response = self.client.get(url, {'period': 'month', 'start': '2026-02-01', 'end': '2026-02-10'})
+        self.assertEqual(response.data['buckets'], [{
+            'period': '2026-02', 'duration': 30, 'distance': 4.5, 'calories': 600, 'activities': 3
+        }])
+    
+    def test_invalid_period(self):
+        """Test that an unknown period is rejected"""
+        response = self.client.get(reverse('user-stats', args=[1]), {'period': 'year'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ResponseCacheTest(APITestCase):
+    """Test case for the read-through response cache and ETags"""
+    
+    def setUp(self):
+        cache.clear()
+        self.workout = Workout.objects.create(
+            _id=1, name='Cached Workout', description='', difficulty='Easy', duration=30
+        )
+        Workout.objects.create(_id=2, name='Other Workout', description='', difficulty='Hard', duration=20)
+    
+    def test_repeat_get_is_served_from_cache(self):
+        """Test that a repeated list request does not query the database"""
+        url = reverse('workout-list')
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+    
+    def test_if_none_match_returns_304(self):
+        """Test that a matching ETag gets 304 Not Modified"""
+        url = reverse('workout-detail', args=[1])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_write_invalidates_model_and_object(self):
+        """Test that a write expires the list and only that object's detail"""
+        list_url = reverse('workout-list')
+        other_url = reverse('workout-detail', args=[2])
+        self.client.get(list_url)
+        self.client.get(other_url)
+        self.client.patch(reverse('workout-detail', args=[1]), {'name': 'Renamed'}, format='json')
+        response = self.client.get(list_url)
+        self.assertEqual(response.data['results'][0]['name'], 'Renamed')
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+    
+    def test_activity_write_expires_leaderboard(self):
+        """Test that leaderboard updates made by scoring expire cached pages"""
+        Leaderboard.objects.create(_id=1, user_id=1, team_id=1, total_points=0, rank=1)
+        url = reverse('leaderboard-list')
+        self.client.get(url)
+        self.client.post(reverse('activity-list'), {
+            '_id': 1, 'user_id': 1, 'activity_type': 'Running', 'duration': 30,
+            'distance': 5.0, 'calories': 250, 'date': '2026-02-19',
+        }, format='json')
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['total_points'], 250)
+
+
+class DirectReadPathTest(TestCase):
+    """Test case for the pymongo repository read path"""
+    
+    def setUp(self):
+        User.objects.create(_id=1, name='Solo', email='solo@example.com', team_id=None)
+        User.objects.create(_id=2, name='Member', email='member@example.com', team_id=1)
+        Activity.objects.create(
+            _id=1, user_id=1, activity_type='Running', duration=30,
+            distance=5.0, calories=300, date='2026-02-19'
+        )
+        Leaderboard.objects.create(_id=1, user_id=1, team_id=1, total_points=300, rank=1)
+    
+    def test_output_matches_serializers(self):
+        """Test that repositories return the same JSON shape as the serializers"""
+        cases = [
+            (UserRepository().all(), UserSerializer(User.objects.order_by('_id'), many=True)),
+            (ActivityRepository().by_user(1), ActivitySerializer(Activity.objects.filter(user_id=1), many=True)),
+            (LeaderboardRepository().by_team(1), LeaderboardSerializer(Leaderboard.objects.all(), many=True)),
+        ]
+        for query, serializer in cases:
+            self.assertEqual(list(query), [dict(row) for row in serializer.data])
+    
+    def test_lookups_compile_to_mongo_filters(self):
+        """Test that paginator Q objects become native Mongo filters"""
+        query = MongoQuery(Activity, ['_id', 'date']).filter(
+            Q(date__lt='2026-02-16') | Q(date='2026-02-16', _id__lt=5), user_id__in=['1', 2]
+        )
+        self.assertEqual(query.spec, {'$and': [
+            {'$or': [
+                {'date': {'$lt': datetime(2026, 2, 16)}},
+                {'$and': [{'_id': {'$lt': 5}}, {'date': datetime(2026, 2, 16)}]},
+            ]},
+            {'user_id': {'$in': [1, 2]}},
+        ]})
+
+
+class AsyncReadPathTest(TestCase):
+    """Test case for the Motor-backed async read endpoints"""
+    
+    def setUp(self):
+        Team.objects.create(_id=1, name='Async Team', description='Served on the event loop')
+        for i in range(1, 4):
+            User.objects.create(_id=i, name=f'User {i}', email=f'user{i}@example.com', team_id=1)
+            Activity.objects.create(
+                _id=i, user_id=1, activity_type='Running', duration=30,
+                distance=5.0, calories=100 * i, date=f'2026-02-1{i}'
+            )
+            Leaderboard.objects.create(_id=i, user_id=i, team_id=1, total_points=100 * i, rank=4 - i)
+        Workout.objects.create(_id=1, name='Intervals', description='Hill repeats', difficulty='Hard', duration=20)
+        cache.clear()
+    
+    def async_request(self, method, path, **kwargs):
+        """Send a request through the ASGI handler from a synchronous test"""
+        async def request():
+            return await getattr(self.async_client, method)(path, **kwargs)
+        return async_to_sync(request)()
+    
+    def test_async_routes_match_sync_routes(self):
+        """Test that every async route returns the same status and body as its sync viewset"""
+        paths = [
+            '/api/users/?page_size=2',
+            '/api/teams/',
+            '/api/teams/1/members/',
+            '/api/teams/99/members/',
+            '/api/activities/?page_size=2',
+            '/api/activities/by_user/?user_id=1',
+            '/api/activities/by_user/',
+            '/api/activities/?cursor=invalid',
+            '/api/leaderboard/',
+            '/api/leaderboard/by_team/?team_id=1',
+            '/api/leaderboard/around/?user_id=2&k=1',
+            '/api/workouts/',
+            '/api/workouts/by_difficulty/?difficulty=Hard',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                cache.clear()
+                expected = self.client.get(path, HTTP_ACCEPT='application/json')
+                cache.clear()
+                response = self.async_request('get', path, HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response['Allow'], expected['Allow'])
+    
+    def test_writes_fall_through_to_sync_viewset(self):
+        """Test that non-GET requests on an async route still reach the viewset"""
+        response = self.async_request(
+            'post',
+            '/api/workouts/',
+            data={'_id': 2, 'name': 'Stretch', 'description': 'Cool down', 'difficulty': 'Easy', 'duration': 10},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Workout.objects.filter(_id=2).count(), 1)
+
+
+class FastSerializerBenchmarkTest(SimpleTestCase):
+    """Benchmark for the read-only fast serializer and orjson renderer"""
+    
+    rows = 5000
+    
+    def setUp(self):
+        self.activities = [
+            Activity(
+                _id=_id, user_id=_id % 50, activity_type='Running \u2028 Ü' if _id % 7 == 0 else 'Cycling',
+                duration=30 + _id % 60, distance=_id / 7, calories=300 + _id,
+                date=date(2026, 1 + _id % 12, 1 + _id % 28)
+            )
+            for _id in range(self.rows)
+        ]
+        fields = ActivitySerializer.Meta.fields
+        self.values = [{name: getattr(activity, name) for name in fields} for activity in self.activities]
+    
+    def render_model_serializer(self):
+        return JSONRenderer().render(ActivitySerializer(self.activities, many=True).data)
+    
+    def render_fast(self):
+        return ORJSONRenderer().render(fast_serializer(ActivitySerializer).many(self.values))
+    
+    def best_of(self, func, runs=3):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+    
+    def test_output_is_byte_identical(self):
+        """Test that the fast path renders exactly the same bytes"""
+        self.assertEqual(self.render_fast(), self.render_model_serializer())
+    
+    def test_fast_path_is_faster(self):
+        """Test that the fast path beats ModelSerializer + JSONRenderer"""
+        slow = self.best_of(self.render_model_serializer)
+        fast = self.best_of(self.render_fast)
+        print(f'\n{self.rows} activities: ModelSerializer {slow * 1000:.1f}ms, fast path {fast * 1000:.1f}ms')
+        self.assertLess(fast, slow)
+
+
+class MongoClientFactoryTest(SimpleTestCase):
+    """Test case for the shared, pooled MongoClient"""
+    
+    def test_client_is_shared_and_configured(self):
+        """Test that one client per alias is reused with the settings pool options"""
+        client = get_client()
+        self.assertIs(get_client(), client)
+        self.assertEqual(client.max_pool_size, mongo.settings.MONGO_CLIENT['maxPoolSize'])
+    
+    def test_client_is_recreated_after_fork(self):
+        """Test that a forked worker does not reuse the parent's client"""
+        client = get_client()
+        mongo._reset_after_fork()
+        self.assertIsNot(get_client(), client)
+    
+    def test_connection_outside_databases(self):
+        """Test that test database setup's '__no_db__' connection builds a client of its own"""
+        default = connections['default']
+        wrapper = type(default)({**default.settings_dict, 'NAME': None}, alias=NO_DB_ALIAS)
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        self.assertIsNot(wrapper.client_connection, get_client())
+        self.assertEqual(wrapper.client_connection.max_pool_size, get_client().max_pool_size)
+    
+    def test_pool_wait_histogram_is_exported(self):
+        """Test that checkout waits are rendered in Prometheus format"""
+        histogram = Histogram('test_wait_seconds', 'Test histogram', labelnames=('address',), buckets=(0.1, 1.0))
+        self.addCleanup(REGISTRY.remove, histogram)
+        histogram.observe(0.05, address='localhost:27017')
+        histogram.observe(2.0, address='localhost:27017')
+        text = render_metrics()
+        self.assertIn('test_wait_seconds_bucket{address="localhost:27017",le="0.1"} 1', text)
+        self.assertIn('test_wait_seconds_bucket{address="localhost:27017",le="+Inf"} 2', text)
+        self.assertIn('# TYPE mongo_pool_checkout_wait_seconds histogram', text)
+
+
+class ProfilingMiddlewareTest(APITestCase):
+    """Test case for the per-request profiling middleware"""
+    
+    @staticmethod
+    def server_timing(response):
+        timings = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, duration = entry.split(';')[:2]
+            timings[name] = float(duration[len('dur='):])
+        return timings
+    
+    def test_phases_exclude_nested_time(self):
+        """Test that MongoDB time inside another phase is only counted as mongo"""
+        def view(request):
+            with phase('serialize'):
+                CommandTimer().succeeded(SimpleNamespace(duration_micros=50000))
+            return HttpResponse()
+        response = ProfilingMiddleware(view)(RequestFactory().get('/'))
+        timings = self.server_timing(response)
+        self.assertEqual(timings['mongo'], 50.0)
+        self.assertLess(timings['serialize'], 50.0)
+        self.assertIn('mongo;dur=50.00;desc="1 commands"', response['Server-Timing'])
+    
+    def test_header_and_route_histograms(self):
+        """Test that API responses carry Server-Timing and feed the /metrics histograms"""
+        Workout.objects.create(_id=1, name='Plank', description='Hold it', difficulty='Easy', duration=5)
+        response = self.client.get(reverse('workout-detail', args=[1]))
+        self.assertEqual(set(self.server_timing(response)), {'mongo', 'djongo', 'serialize', 'render', 'total'})
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('http_request_phase_seconds_count{route="workout-detail",phase="render"}', text)
+        self.assertIn('http_request_duration_seconds_count{route="workout-detail",method="GET"}', text)
+
+
+class LiveEventsTest(SimpleTestCase):
+    """Test case for the event broker and the Server-Sent Events streams"""
+    
+    entry = {'_id': 3, 'user_id': 3, 'team_id': 1, 'total_points': 800, 'rank': 2}
+    shift = {'gte': 500, 'lt': 800, 'by': 1}
+    
+    @staticmethod
+    def data(frame):
+        return json.loads(frame.decode().split('data: ', 1)[1])
+    
+    def test_team_streams_only_get_the_shift(self):
+        """Test that other teams' streams receive the rank shift without the row"""
+        async def scenario():
+            everyone, team, other = (broker.subscribe(LEADERBOARD, key) for key in (None, 1, 2))
+            publish_points(self.entry, self.shift)
+            frames = [await asyncio.wait_for(subscription.get(), 1) for subscription in (everyone, team, other)]
+            for subscription in (everyone, team, other):
+                subscription.close()
+            return frames
+        everyone, team, other = async_to_sync(scenario)()
+        self.assertEqual(self.data(everyone), dict(self.entry, shift=self.shift))
+        self.assertEqual(team, everyone)
+        self.assertEqual(self.data(other), {'shift': self.shift})
+        self.assertEqual(broker.subscriber_count(), 0)
+    
+    def test_lagging_subscriber_is_reset(self):
+        """Test that a subscriber that falls behind gets a reset instead of a backlog"""
+        async def scenario():
+            subscription = broker.subscribe(LEADERBOARD)
+            for _ in range(QUEUE_SIZE + 1):
+                publish_points(self.entry, self.shift)
+            await asyncio.sleep(0)
+            frame = await subscription.get()
+            subscription.close()
+            return frame
+        self.assertIn(b'event: reset', async_to_sync(scenario)())
+    
+    def test_stream_endpoint(self):
+        """Test that the ASGI stream sends headers, events and stops on disconnect"""
+        async def scenario():
+            sent, disconnected = [], asyncio.Event()
+            
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+            
+            async def send(message):
+                sent.append(message)
+                if b'event: points' in message.get('body', b''):
+                    disconnected.set()
+            
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': '/api/leaderboard/stream/',
+                'query_string': b'team_id=2', 'headers': [],
+            }
+            app = asyncio.ensure_future(route_streams(None)(scope, receive, send))
+            while not broker.subscriber_count(LEADERBOARD):
+                await asyncio.sleep(0)
+            publish_points(self.entry, self.shift)
+            await asyncio.wait_for(app, 1)
+            return sent
+        sent = async_to_sync(scenario)()
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(self.data(sent[-1]['body']), {'shift': self.shift})
+        self.assertEqual(broker.subscriber_count(), 0)
+
+
+class SyntheticDatasetTest(SimpleTestCase):
+    """Test case for the synthetic load-testing data generator"""
+    
+    def setUp(self):
+        if np is None:
+            self.skipTest('NumPy is not installed')
+        self.dataset = SyntheticDataset(users=50, teams=5, activities=2500, seed=7, end_date=date(2026, 3, 1))
+    
+    def test_batches_are_reproducible(self):
+        """Test that a batch is identical however often and in whatever order it is generated"""
+        later = self.dataset.activity_documents(2, 1000)
+        self.dataset.activity_documents(0, 1000)
+        self.assertEqual(later, SyntheticDataset(50, 5, 2500, seed=7, end_date=date(2026, 3, 1)).activity_documents(2, 1000))
+        self.assertNotEqual(later, SyntheticDataset(50, 5, 2500, seed=8, end_date=date(2026, 3, 1)).activity_documents(2, 1000))
+    
+    def test_batches_cover_ids_and_references(self):
+        """Test that batches split the id range exactly and reference existing users and teams"""
+        activities = [doc for batch in range(3) for doc in self.dataset.activity_documents(batch, 1000)]
+        self.assertEqual([doc['_id'] for doc in activities], list(range(1, 2501)))
+        self.assertTrue(all(1 <= doc['user_id'] <= 50 for doc in activities))
+        self.assertTrue(all(date(2025, 3, 2) <= doc['date'].date() <= date(2026, 3, 1) for doc in activities))
+        users = self.dataset.user_documents(0, 100)
+        self.assertEqual(len(users), 50)
+        self.assertTrue(all(1 <= doc['team_id'] <= 5 for doc in users))
+
+
+class BenchmarkAPICommandTest(APITestCase):
+    """Test case for the benchmark_api management command"""
+    
+    def setUp(self):
+        Workout.objects.create(_id=1, name='Sprint', description='Short sprints', difficulty='Advanced', duration=20)
+        handle, self.output = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, self.output)
+    
+    def benchmark(self, **options):
+        call_command(
+            'benchmark_api', routes=['workout-'], requests=6, concurrency=2, warmup=1,
+            output=self.output, stdout=StringIO(), **options
+        )
+        with open(self.output) as f:
+            return json.load(f)
+    
+    def test_reports_percentiles_per_route(self):
+        """Test that every matching GET route is measured and saved as JSON"""
+        results = self.benchmark()
+        self.assertEqual(
+            set(results['routes']), {'workout-list', 'workout-detail', 'workout-by-difficulty'}
+        )
+        by_difficulty = results['routes']['workout-by-difficulty']
+        self.assertEqual(by_difficulty['path'], '/api/workouts/by_difficulty/?difficulty=Advanced')
+        self.assertEqual(by_difficulty['requests'], 6)
+        self.assertEqual(by_difficulty['errors'], 0)
+        self.assertLessEqual(by_difficulty['p50'], by_difficulty['p95'])
+        self.assertLessEqual(by_difficulty['p95'], by_difficulty['p99'])
+    
+    def test_fails_on_regression_against_baseline(self):
+        """Test that a route slower than baseline * (1 + threshold) fails the run"""
+        results = self.benchmark()
+        for result in results['routes'].values():
+            result['p95'] = 1e-6
+        handle, baseline = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(results, f)
+        self.addCleanup(os.remove, baseline)
+        with self.assertRaisesMessage(CommandError, 'regressed more than 20% on p95'):
+            self.benchmark(baseline=baseline, threshold=0.2)
+
+
+class EnsureIndexesTest(TestCase):
+    """Test case for the ensure_indexes management command"""
+    
+    def setUp(self):
+        self.db = get_db()
+        call_command('ensure_indexes', stdout=StringIO())
+    
+    def test_declared_indexes_exist(self):
+        """Test that every declared index spec is present"""
+        for query in HOT_QUERIES:
+            existing = self.db[query.model._meta.db_table].index_information()
+            keys = [info['key'] for info in existing.values()]
+            for spec in index_specs(query.model):
+                self.assertIn(spec.keys, keys)
+    
+    def test_command_is_idempotent(self):
+        """Test that a second run creates nothing"""
+        out = StringIO()
+        call_command('ensure_indexes', stdout=out)
+        self.assertNotIn('Creating', out.getvalue())
+        self.assertNotIn('Rebuilding', out.getvalue())
+    
+    def test_hot_queries_do_not_collscan(self):
+        """Test that every viewset query is served by an index"""
+        for query in HOT_QUERIES:
+            stages = [stage for stage, _ in explain_query(self.db, query)]
+            self.assertNotIn('COLLSCAN', stages, query.name)
+
+
+class ReadReplicaRoutingTest(APITestCase):
+    """Test case for read/write splitting across the primary and read replicas"""
+    
+    def setUp(self):
+        routers._lags.clear()
+        self.addCleanup(routers._lags.clear)
+        self.lag = 1.0
+        patcher = mock.patch.object(routers, 'replica_lag', lambda alias: self.lag)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def read_alias(self, viewset_class=None, method='get', cookies=None):
+        from .views import ActivityViewSet
+        request = getattr(RequestFactory(), method)('/api/activities/')
+        request.COOKIES.update(cookies or {})
+        return (viewset_class or ActivityViewSet)().get_read_alias(request)
+    
+    def test_router_splits_reads_and_writes(self):
+        """Test that ORM reads follow the request's alias and writes the primary"""
+        router = ReadReplicaRouter()
+        self.assertIsNone(router.db_for_read(Activity))
+        with reading_from('replica1'):
+            self.assertEqual(router.db_for_read(Activity), 'replica1')
+            self.assertEqual(router.db_for_write(Activity), 'default')
+        with override_settings(DATABASE_READ_REPLICAS=['replica1']):
+            self.assertFalse(router.allow_migrate('replica1', 'octofit_tracker'))
+            self.assertIsNone(router.allow_migrate('default', 'octofit_tracker'))
+    
+    @override_settings(DATABASE_READ_REPLICAS=['replica1'], DATABASE_MAX_REPLICA_LAG_SECONDS=10)
+    def test_gets_read_from_a_fresh_replica(self):
+        """Test that safe requests use a replica within the staleness bound"""
+        from .views import ActivityViewSet
+        self.assertEqual(self.read_alias(), 'replica1')
+        self.assertIsNone(self.read_alias(method='post'))
+        with override_settings(DATABASE_READ_PREFERENCES={}):
+            self.assertIsNone(self.read_alias(ActivityViewSet))
+        routers._lags.clear()
+        self.lag = 30.0
+        self.assertIsNone(self.read_alias())
+    
+    @override_settings(DATABASE_READ_REPLICAS=['replica1'])
+    def test_reads_after_a_write_use_the_primary(self):
+        """Test that a write's response sends the client's next reads to the primary"""
+        response = self.client.post(reverse('user-list'), {'name': 'Alice', 'email': 'alice@example.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(WRITE_COOKIE, response.cookies)
+        self.assertIsNone(self.read_alias(cookies={WRITE_COOKIE: response.cookies[WRITE_COOKIE].value}))
+        
+        expired = HttpResponse()
+        with override_settings(DATABASE_READ_YOUR_WRITES_SECONDS=-1):
+            remember_write(expired)
+        self.assertEqual(self.read_alias(cookies={WRITE_COOKIE: expired.cookies[WRITE_COOKIE].value}), 'replica1')
+
+
+class ActivityShardingTest(APITestCase):
+    """Test case for partitioning activities across databases by user_id"""
+    
+    def setUp(self):
+        self.dbs = {'default': get_db(), 'shard2': get_client()[f'{get_db().name}_shard2']}
+        self.addCleanup(get_client().drop_database, self.dbs['shard2'].name)
+        patcher = mock.patch.object(sharding, 'get_db', lambda alias='default': self.dbs[alias])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings = self.settings(ACTIVITY_SHARDS=['default', 'shard2'])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # One user on each shard
+        self.users = {shard_for(user_id): user_id for user_id in range(1, 20)}
+    
+    def documents(self, count):
+        return [
+            {
+                '_id': _id, 'user_id': self.users['default' if _id % 2 else 'shard2'],
+                'activity_type': 'Running', 'duration': 30, 'distance': 5.0,
+                'calories': 100, 'date': datetime(2026, 2, _id),
+            }
+            for _id in range(1, count + 1)
+        ]
+    
+    def stored(self, alias):
+        return sorted(document['_id'] for document in self.dbs[alias].activities.find())
+    
+    def test_user_id_picks_one_shard(self):
+        """Test that a user's activities, and queries pinning user_id, map to one shard"""
+        self.assertEqual(set(self.users), {'default', 'shard2'})
+        user_id = self.users['shard2']
+        self.assertEqual(shards_for_spec({'user_id': user_id}), ['shard2'])
+        self.assertEqual(shards_for_spec({'$and': [{'user_id': user_id}, {'date': {'$lt': 1}}]}), ['shard2'])
+        self.assertEqual(shards_for_spec({'user_id': {'$in': list(self.users.values())}}), ['default', 'shard2'])
+        self.assertEqual(shards_for_spec({}), ['default', 'shard2'])
+    
+    def test_writes_and_scatter_gather_reads(self):
+        """Test that writes land on their user's shard and lists merge every shard in order"""
+        write_activities(self.documents(6))
+        self.assertEqual(self.stored('default'), [1, 3, 5])
+        self.assertEqual(self.stored('shard2'), [2, 4, 6])
+        
+        response = self.client.get(reverse('activity-list'), {'page_size': 4})
+        self.assertEqual([row['_id'] for row in response.data['results']], [6, 5, 4, 3])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['_id'] for row in response.data['results']], [2, 1])
+        
+        response = self.client.get(reverse('activity-by-user'), {'user_id': self.users['shard2']})
+        self.assertEqual([row['_id'] for row in response.data['results']], [6, 4, 2])
+    
+    def test_write_status_and_ids_span_shards(self):
+        """Test that write status and _id uniqueness see activities on every shard"""
+        write_activities(self.documents(2))
+        response = self.client.get(reverse('activity-write-status', args=[2]))
+        self.assertEqual(response.data['status'], 'applied')
+        missing = self.client.get(reverse('activity-write-status', args=[999]))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+        
+        duplicate = dict(self.documents(2)[1], date='2026-02-02')
+        response = self.client.post(reverse('activity-list'), duplicate, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('_id', response.data)
+    
+    @override_settings(DATABASE_READ_REPLICAS=['replica1'])
+    def test_orm_reads_never_fall_through_to_a_replica(self):
+        """Test that an activity query naming no shard raises instead of reading a replica"""
+        activity = Activity(_id=2, user_id=self.users['shard2'])
+        activity._state.db = 'shard2'
+        with reading_from('replica1'):
+            with self.assertRaises(ShardRequired):
+                list(Activity.objects.filter(user_id=self.users['shard2']))
+            self.assertEqual(router.db_for_read(Activity, instance=activity), 'shard2')
+            self.assertEqual(router.db_for_write(Activity, instance=activity), 'shard2')
+            self.assertEqual(router.db_for_read(User), 'replica1')
+    
+    def test_rebalance_moves_activities_to_their_shard(self):
+        """Test that rebalance_activities moves rows after the shard list changes"""
+        self.dbs['default'].activities.insert_many(self.documents(4))
+        out = StringIO()
+        call_command('rebalance_activities', stdout=out)
+        self.assertIn('Moved 2 activities from default to shard2', out.getvalue())
+        self.assertEqual((self.stored('default'), self.stored('shard2')), ([1, 3], [2, 4]))
+        call_command('rebalance_activities', stdout=out)
+        self.assertIn('Moved 0 activities', out.getvalue())
+    
+    def test_merge_follows_mongodb_sort_order(self):
+        """Test that merged shard results keep a mixed-direction, mixed-type sort"""
+        streams = [
+            [{'date': datetime(2026, 2, 2), '_id': 1}, {'date': '2026-02-03', '_id': 4}],
+            [{'date': datetime(2026, 2, 2), '_id': 3}, {'date': datetime(2026, 2, 1), '_id': 2}],
+        ]
+        merged = merge_sorted(streams, [('date', -1), ('_id', 1)])
+        self.assertEqual([row['_id'] for row in merged], [1, 3, 2, 4])
+
+
 class APIRootTest(APITestCase):
     """Test case for API root endpoint"""
     
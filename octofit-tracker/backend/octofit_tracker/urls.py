@@ -19,12 +19,15 @@ from rest_framework import routers
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from .async_views import async_read_urls
 from .views import (
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
     LeaderboardViewSet,
-    WorkoutViewSet
+    WorkoutViewSet,
+    metrics,
+    search
 )
 import os
 
@@ -54,6 +57,7 @@ def api_root(request, format=None):
         'activities': reverse('activity-list', request=request, format=format),
         'leaderboard': reverse('leaderboard-list', request=request, format=format),
         'workouts': reverse('workout-list', request=request, format=format),
+        'search': reverse('search', request=request, format=format),
         'admin': f"{base_url}/admin/",
     })
 
@@ -61,6 +65,8 @@ def api_root(request, format=None):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', api_root, name='api-root'),
-    path('api/', include(router.urls)),
+    path('api/', include(async_read_urls(router.urls))),
+    path('api/search/', search, name='search'),
+    path('metrics', metrics, name='metrics'),
     path('', api_root, name='root'),
 ]
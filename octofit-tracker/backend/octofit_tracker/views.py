@@ -1,89 +1,451 @@
-from rest_framework import viewsets
+from copy import copy
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from rest_framework import status, viewsets
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.reverse import reverse
 from .models import User, Team, Activity, Leaderboard, Workout
 from .serializers import (
     UserSerializer,
     TeamSerializer,
     ActivitySerializer,
     LeaderboardSerializer,
-    WorkoutSerializer
+    WorkoutSerializer,
+    fast_serializer,
+    requested_fields
 )
+from .cache import CachedResponseMixin
+from .events import publish_activity
+from .export import export_chunks, export_query
+from .journal import APPLIED, get_journal, write_behind_requested
+from .metrics import render as render_metrics
+from .profiling import phase
+from .ingest import CSV_CONTENT_TYPES, NDJSON_CONTENT_TYPES, ingest_activities, read_records
+from .renderers import CSVRenderer, NDJSONRenderer
+from .repositories import ActivityRepository, LeaderboardRepository, UserRepository
+from .rollups import move_user_rollups, record_rollup_change
+from .routers import ReadPreferenceMixin
+from .search import MIN_PREFIX, SOURCES as SEARCH_SOURCES, find, query_words
+from .sharding import is_sharded, locate_activity
+from .scoring import record_activity_change
+from .stats import PERIOD_FORMATS, team_stats, user_stats
+
+
+def _date_range_params(request):
+    """Parse start/end query parameters; returns (params, error)"""
+    params = {}
+    for name in ('start', 'end'):
+        value = request.query_params.get(name)
+        try:
+            params[name] = parse_date(value) if value else None
+        except ValueError:
+            params[name] = None
+        if value and params[name] is None:
+            return None, f"{name} must be a date in YYYY-MM-DD format"
+    return params, None
+
+
+def _stats_params(request):
+    """Parse period/start/end query parameters; returns (params, error)"""
+    period = request.query_params.get('period', 'day')
+    if period not in PERIOD_FORMATS:
+        return None, f"period must be one of: {', '.join(PERIOD_FORMATS)}"
+    params, error = _date_range_params(request)
+    if error:
+        return None, error
+    return dict(period=period, **params), None
+
+
+def _export_params(request):
+    """Parse user_id/start/end query parameters; returns (params, error)"""
+    params, error = _date_range_params(request)
+    if error:
+        return None, error
+    user_id = request.query_params.get('user_id')
+    try:
+        params['user_id'] = int(user_id) if user_id else None
+    except ValueError:
+        return None, "user_id must be an integer"
+    return params, None
+
+
+# Largest k accepted by the leaderboard ``around`` action
+MAX_AROUND = 100
+
+
+def around_params(request):
+    """Parse user_id/k query parameters; returns (params, error)"""
+    if not request.query_params.get('user_id'):
+        return None, "user_id parameter is required"
+    try:
+        user_id = int(request.query_params['user_id'])
+        k = int(request.query_params.get('k', 5))
+    except ValueError:
+        return None, "user_id and k must be integers"
+    if not 0 <= k <= MAX_AROUND:
+        return None, f"k must be between 0 and {MAX_AROUND}"
+    return {'user_id': user_id, 'k': k}, None
+
+
+def around_response(user_id, entry, above, below):
+    """Body of the leaderboard ``around`` action; ``above`` is nearest first"""
+    if entry is None:
+        return Response({"error": f"user {user_id} has no leaderboard entry"}, status=404)
+    return Response({
+        'user_id': user_id,
+        'rank': entry['rank'],
+        'entry': entry,
+        'above': list(reversed(above)),
+        'below': list(below),
+    })
+
+
+# Largest number of results /api/search/ returns
+MAX_SEARCH_RESULTS = 50
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def _search_params(request):
+    """Parse q/type/limit query parameters; returns (params, error)"""
+    q = request.query_params.get('q', '')
+    if not query_words(q):
+        return None, f"q must contain a word of at least {MIN_PREFIX} characters"
+    kinds = None
+    if request.query_params.get('type'):
+        kinds = [kind.strip() for kind in request.query_params['type'].split(',') if kind.strip()]
+        unknown = [kind for kind in kinds if kind not in SEARCH_SOURCES]
+        if unknown or not kinds:
+            return None, f"type must be one or more of: {', '.join(SEARCH_SOURCES)}"
+    try:
+        limit = int(request.query_params.get('limit', 20))
+    except ValueError:
+        return None, "limit must be an integer"
+    if not 1 <= limit <= MAX_SEARCH_RESULTS:
+        return None, f"limit must be between 1 and {MAX_SEARCH_RESULTS}"
+    return {'q': q, 'kinds': kinds, 'limit': limit}, None
+
+
+@api_view(['GET'])
+def search(request):
+    """Ranked prefix search over user names and emails, team names and workouts"""
+    params, error = _search_params(request)
+    if error:
+        return Response({"error": error}, status=400)
+    results = find(**params)
+    for result in results:
+        result['url'] = reverse(f"{result['type']}-detail", args=[result['_id']], request=request)
+    return Response({'query': params['q'], 'results': results})
+
+
+def metrics(request):
+    """Prometheus text exposition of the in-process metrics"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class DirectReadMixin:
+    """
+    Serves read-only lists without ModelSerializer instances: either a
+    MongoRepository query, which yields serializer-shaped dicts straight
+    from pymongo, or a ``.values()`` queryset rendered with the view's
+    FastReadSerializer.
+
+    ``?fields=`` narrows both the MongoDB projection and the response to
+    the named serializer fields.
+    """
+
+    def sparse_fields(self):
+        """The serializer fields named in ``?fields=``, or None for all of them"""
+        return requested_fields(self.request, self.get_serializer_class())
+
+    def sparse_query(self, query):
+        """Narrow a MongoQuery's projection to ``?fields=``"""
+        fields = self.sparse_fields()
+        return query.only(*fields) if fields else query
+
+    def sparse_rows(self, rows):
+        """Drop the ordering keys a narrowed MongoQuery reads for the paginator"""
+        fields = self.sparse_fields()
+        if not fields:
+            return rows
+        return [{name: row[name] for name in fields} for row in rows]
+
+    def direct_response(self, query, fast=False):
+        if not fast:
+            query = self.sparse_query(query)
+        # Reading the page builds the rows; MongoDB and djongo time is
+        # excluded from the phase
+        with phase('serialize'):
+            page = self.paginate_queryset(query)
+            rows = page if page is not None else list(query)
+            if fast:
+                rows = fast_serializer(self.get_serializer_class(), self.sparse_fields()).many(rows)
+            else:
+                rows = self.sparse_rows(rows)
+        if page is not None:
+            return self.get_paginated_response(rows)
+        return Response(rows)
+
+    def values(self, queryset):
+        fields = self.sparse_fields() or self.get_serializer_class().Meta.fields
+        keys = [term.lstrip('-') for term in queryset.query.order_by]
+        return queryset.values(*dict.fromkeys([*fields, *keys]))
+
+    def get_queryset(self):
+        """Defer the fields left out of ``?fields=`` on instance reads"""
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        serializer_class = self.get_serializer_class()
+        fields = self.sparse_fields()
+        if not fields or serializer_class.Meta.model is not queryset.model:
+            return queryset
+        # Expansion sources and ordering keys would otherwise be loaded
+        # one row at a time
+        sources = [expansion.source for expansion in getattr(serializer_class, 'expansions', {}).values()]
+        keys = [term.lstrip('-') for term in queryset.query.order_by]
+        return queryset.only(*dict.fromkeys([*fields, *sources, *keys]))
+
+
+class UserViewSet(ReadPreferenceMixin, CachedResponseMixin, DirectReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
     queryset = User.objects.all().order_by('_id')
     serializer_class = UserSerializer
+    cache_models = (User,)
+    cache_action_models = {'stats': (User, Activity)}
+
+    def list(self, request, *args, **kwargs):
+        return self.direct_response(UserRepository().all())
+
+    def perform_update(self, serializer):
+        old_team_id = serializer.instance.team_id
+        user = serializer.save()
+        move_user_rollups(user._id, old_team_id, user.team_id)
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get a user's activity totals grouped by day, week or month"""
+        user = self.get_object()
+        params, error = _stats_params(request)
+        if error:
+            return Response({"error": error}, status=400)
+        return Response(dict(user_id=user._id, **params, **user_stats(user._id, **params)))
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ReadPreferenceMixin, CachedResponseMixin, DirectReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows teams to be viewed or edited.
     """
     queryset = Team.objects.all().order_by('_id')
     serializer_class = TeamSerializer
+    cache_models = (Team, User)
+    cache_action_models = {'stats': (Team, User, Activity)}
+
+    def get_serializer_class(self):
+        if self.action == 'members':
+            return UserSerializer
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        # ?expand= needs model instances for the expandable serializer
+        if 'expand' in request.query_params:
+            return super().list(request, *args, **kwargs)
+        return self.direct_response(self.values(self.get_queryset()), fast=True)
 
     @action(detail=True, methods=['get'])
     def members(self, request, pk=None):
         """Get all members of a team"""
         team = self.get_object()
-        members = User.objects.filter(team_id=team._id)
-        serializer = UserSerializer(members, many=True)
-        return Response(serializer.data)
+        return self.direct_response(UserRepository().by_team(team._id))
 
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get a team's activity totals grouped by day, week or month"""
+        team = self.get_object()
+        params, error = _stats_params(request)
+        if error:
+            return Response({"error": error}, status=400)
+        return Response(dict(team_id=team._id, **params, **team_stats(team._id, **params)))
 
-class ActivityViewSet(viewsets.ModelViewSet):
+
+class ActivityViewSet(ReadPreferenceMixin, DirectReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows activities to be viewed or edited.
     """
-    queryset = Activity.objects.all().order_by('-date')
+    queryset = Activity.objects.all().order_by('-date', '-_id')
     serializer_class = ActivitySerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if pk is None or not is_sharded():
+            return queryset
+        # Detail routes read the one shard that holds the activity
+        try:
+            alias = locate_activity(Activity._meta.pk.to_python(pk))
+        except ValidationError:
+            alias = None
+        return queryset.using(alias) if alias is not None else queryset.none()
+
+    def list(self, request, *args, **kwargs):
+        return self.direct_response(ActivityRepository().all())
+
+    def create(self, request, *args, **kwargs):
+        if not write_behind_requested(request):
+            return super().create(request, *args, **kwargs)
+        # Journaled now, written to MongoDB by the journal's flusher
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        record = get_journal().append(serializer.validated_data)
+        status_url = reverse('activity-write-status', args=[record['_id']], request=request)
+        return Response(
+            {'status': 'pending', 'activity': record, 'status_url': status_url},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': status_url, 'Preference-Applied': 'respond-async'}
+        )
+
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        record_activity_change(after=activity)
+        record_rollup_change(after=activity)
+        publish_activity('created', dict(serializer.data))
+
+    def perform_update(self, serializer):
+        before = copy(serializer.instance)
+        activity = serializer.save()
+        if activity._state.db != before._state.db:
+            # A new user_id saved the activity to another shard
+            Activity.objects.using(before._state.db).filter(_id=before._id).delete()
+        record_activity_change(before=before, after=activity)
+        record_rollup_change(before=before, after=activity)
+        publish_activity('updated', dict(serializer.data))
+
+    def perform_destroy(self, instance):
+        before = copy(instance)
+        instance.delete()
+        record_activity_change(before=before)
+        record_rollup_change(before=before)
+        publish_activity('deleted', {'_id': before._id, 'user_id': before.user_id})
+
     @action(detail=False, methods=['get'])
     def by_user(self, request):
         """Get activities by user_id"""
         user_id = request.query_params.get('user_id')
         if user_id:
-            activities = Activity.objects.filter(user_id=int(user_id)).order_by('-date')
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            return self.direct_response(ActivityRepository().by_user(int(user_id)))
         return Response({"error": "user_id parameter is required"}, status=400)
 
+    @action(detail=True, methods=['get'])
+    def write_status(self, request, pk=None):
+        """Whether an activity accepted with Prefer: respond-async is in MongoDB yet"""
+        try:
+            _id = int(pk)
+        except ValueError:
+            return Response({"error": "activity id must be an integer"}, status=400)
+        if settings.ACTIVITY_WRITE_BEHIND:
+            state, error = get_journal().status(_id)
+        else:
+            # Looks on every shard, and on the primary rather than a replica
+            state, error = (APPLIED if locate_activity(_id) is not None else None), None
+        if state is None:
+            return Response({"error": f"activity {_id} not found"}, status=404)
+        return Response({'_id': _id, 'status': state, 'error': error})
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """Stream activities as NDJSON or CSV (?format=csv), filtered by user_id and start/end"""
+        params, error = _export_params(request)
+        if error:
+            return Response({"error": error}, status=400)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            export_chunks(export_query(**params), renderer.format),
+            content_type=f'{renderer.media_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{renderer.format}"'
+        return response
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Stream-insert activities from an NDJSON or CSV request body"""
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type not in NDJSON_CONTENT_TYPES + CSV_CONTENT_TYPES:
+            return Response(
+                {"error": "body must be NDJSON (application/x-ndjson) or CSV (text/csv)"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        stream = request.stream or []
+        report = ingest_activities(read_records(stream, content_type))
+        return Response(report.as_dict())
+
+
+class LeaderboardViewSet(ReadPreferenceMixin, CachedResponseMixin, DirectReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows leaderboard entries to be viewed or edited.
     """
-    queryset = Leaderboard.objects.all().order_by('rank')
+    queryset = Leaderboard.objects.all().order_by('rank', '_id')
     serializer_class = LeaderboardSerializer
+    cache_models = (Leaderboard, User, Team)
+
+    def list(self, request, *args, **kwargs):
+        # ?expand= needs model instances for the expandable serializer
+        if 'expand' in request.query_params:
+            return super().list(request, *args, **kwargs)
+        return self.direct_response(LeaderboardRepository().all())
 
     @action(detail=False, methods=['get'])
     def by_team(self, request):
         """Get leaderboard by team_id"""
         team_id = request.query_params.get('team_id')
+        if team_id and 'expand' not in request.query_params:
+            return self.direct_response(LeaderboardRepository().by_team(int(team_id)))
         if team_id:
-            leaderboard = Leaderboard.objects.filter(team_id=int(team_id)).order_by('rank')
+            leaderboard = self.get_queryset().filter(team_id=int(team_id))
+            page = self.paginate_queryset(leaderboard)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
             serializer = self.get_serializer(leaderboard, many=True)
             return Response(serializer.data)
         return Response({"error": "team_id parameter is required"}, status=400)
 
+    @action(detail=False, methods=['get'])
+    def around(self, request):
+        """Get a user's rank with the k entries above and below it"""
+        params, error = around_params(request)
+        if error:
+            return Response({"error": error}, status=400)
+        repository = LeaderboardRepository()
+        entries = repository.by_user(params['user_id'])[:1]
+        if not entries:
+            return around_response(params['user_id'], None, [], [])
+        entry, k = entries[0], params['k']
+        above = repository.above(entry)[:k] if k else []
+        below = repository.below(entry)[:k] if k else []
+        return around_response(params['user_id'], entry, above, below)
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+
+class WorkoutViewSet(ReadPreferenceMixin, CachedResponseMixin, DirectReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows workouts to be viewed or edited.
     """
     queryset = Workout.objects.all().order_by('_id')
     serializer_class = WorkoutSerializer
+    cache_models = (Workout,)
+
+    def list(self, request, *args, **kwargs):
+        return self.direct_response(self.values(self.get_queryset()), fast=True)
 
     @action(detail=False, methods=['get'])
     def by_difficulty(self, request):
         """Get workouts by difficulty level"""
         difficulty = request.query_params.get('difficulty')
         if difficulty:
-            workouts = Workout.objects.filter(difficulty=difficulty)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+            workouts = Workout.objects.filter(difficulty=difficulty).order_by('_id')
+            return self.direct_response(self.values(workouts), fast=True)
         return Response({"error": "difficulty parameter is required"}, status=400)
@@ -47,6 +47,24 @@ const Activities = () => {
     };
 
     fetchActivities();
+
+    // Apply changes pushed by the server instead of re-fetching the list
+    const source = new EventSource(`https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/activities/stream/`);
+    source.addEventListener('created', (event) => {
+      const activity = JSON.parse(event.data);
+      setActivities(current => [activity, ...current.filter(item => item._id !== activity._id)]);
+    });
+    source.addEventListener('updated', (event) => {
+      const activity = JSON.parse(event.data);
+      setActivities(current => current.map(item => (item._id === activity._id ? activity : item)));
+    });
+    source.addEventListener('deleted', (event) => {
+      const { _id } = JSON.parse(event.data);
+      setActivities(current => current.filter(item => item._id !== _id));
+    });
+    source.addEventListener('reset', fetchActivities);
+
+    return () => source.close();
   }, []);
 
   if (loading) {
@@ -84,6 +84,32 @@ const Leaderboard = () => {
     };
 
     fetchData();
+
+    // Apply rank and points deltas pushed by the server instead of re-fetching
+    const source = new EventSource(`https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/leaderboard/stream/`);
+    source.addEventListener('points', (event) => {
+      const { shift, ...entry } = JSON.parse(event.data);
+      setLeaderboard(current => {
+        // Other rows with gte <= total_points < lt moved by shift.by places
+        const rows = current.map(row => (
+          row.user_id !== entry.user_id
+            && (shift.gte === null || row.total_points >= shift.gte)
+            && row.total_points < shift.lt
+            ? { ...row, rank: row.rank + shift.by }
+            : row
+        ));
+        const index = rows.findIndex(row => row.user_id === entry.user_id);
+        if (index === -1) {
+          rows.push(entry);
+        } else {
+          rows[index] = { ...rows[index], ...entry };
+        }
+        return rows.sort((a, b) => a.rank - b.rank || a._id - b._id);
+      });
+    });
+    source.addEventListener('reset', fetchData);
+
+    return () => source.close();
   }, []);
 
   if (loading) {